@@ -0,0 +1,92 @@
+import functools
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+
+from flask import Response, current_app, request
+
+try:
+    import brotli  # optional, enables "Content-Encoding: br"
+except ImportError:
+    brotli = None
+
+# Bodies smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 512
+
+
+class _Entry:
+    """One serialized response: identity body plus precompressed variants"""
+
+    def __init__(self, version, body):
+        self.version = version
+        self.digest = hashlib.sha256(body).hexdigest()[:32]
+        self.bodies = {'identity': body}
+        if len(body) >= MIN_COMPRESS_SIZE:
+            self.bodies['gzip'] = gzip.compress(body, compresslevel=6, mtime=0)
+            if brotli is not None:
+                self.bodies['br'] = brotli.compress(body)
+
+    def etag(self, encoding):
+        return self.digest if encoding == 'identity' else f"{self.digest}-{encoding}"
+
+    def respond(self):
+        encoding = 'identity'
+        for candidate in ('br', 'gzip'):
+            if candidate in self.bodies and request.accept_encodings[candidate]:
+                encoding = candidate
+                break
+
+        if any(request.if_none_match.contains(self.etag(enc)) for enc in self.bodies) \
+                or request.if_none_match.star_tag:
+            response = Response(status=304)
+        else:
+            response = Response(self.bodies[encoding], mimetype='application/json')
+            if encoding != 'identity':
+                response.headers['Content-Encoding'] = encoding
+        response.set_etag(self.etag(encoding))
+        response.headers['Cache-Control'] = 'no-cache'
+        response.vary.add('Accept-Encoding')
+        return response
+
+
+class ResponseCache:
+    """
+    Cache successful JSON responses per snapshot version. Clients get a strong
+    ETag and a 304 on If-None-Match; gzip (and brotli, when installed) bodies are
+    compressed once per version instead of once per request.
+    """
+
+    def __init__(self, version, max_entries=256):
+        self.version = version
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def cached(self, view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            version = self.version()
+            key = request.full_path
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry.version == version:
+                    self._entries.move_to_end(key)
+                    return entry.respond()
+
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code != 200 or not response.is_json:
+                return response
+
+            entry = _Entry(version, response.get_data())
+            with self._lock:
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            return entry.respond()
+        return wrapper
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
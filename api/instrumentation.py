@@ -0,0 +1,93 @@
+import cProfile
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from flask import g, request
+
+from services.metrics import REGISTRY
+
+
+class RequestProfiler:
+    """
+    Opt-in sampling profiler: a random `rate` fraction of requests (and any
+    request carrying `trigger_header`, when set) runs under cProfile and the
+    stats are written to `directory` as '<time>-<endpoint>.prof' (open them
+    with pstats or snakeviz). Only one request is profiled at a time; others
+    pass through untouched.
+    """
+
+    def __init__(self, rate=0.0, directory=None, trigger_header=None):
+        self.rate = rate
+        self.directory = directory or os.path.join(tempfile.gettempdir(), 'hospital-kpi-profiles')
+        self.trigger_header = trigger_header
+        self._busy = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """Build from KPI_PROFILE_RATE / KPI_PROFILE_DIR / KPI_PROFILE_HEADER; None when all unset"""
+        rate = float(os.environ.get('KPI_PROFILE_RATE', 0) or 0)
+        header = os.environ.get('KPI_PROFILE_HEADER')
+        if not rate and not header:
+            return None
+        return cls(rate, os.environ.get('KPI_PROFILE_DIR'), header)
+
+    @property
+    def enabled(self):
+        return self.rate > 0 or bool(self.trigger_header)
+
+    def wants(self):
+        if self.trigger_header and request.headers.get(self.trigger_header):
+            return True
+        return self.rate > 0 and random.random() < self.rate
+
+    def start(self):
+        if not self.wants() or not self._busy.acquire(blocking=False):
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:  # another profiler (or debugger) already owns the hook
+            self._busy.release()
+            return None
+        return profile
+
+    def stop(self, profile, endpoint):
+        try:
+            profile.disable()
+            os.makedirs(self.directory, exist_ok=True)
+            name = re.sub(r'[^\w.-]+', '_', endpoint).strip('_') or 'request'
+            path = os.path.join(self.directory, f"{datetime.now():%Y%m%dT%H%M%S%f}-{name}.prof")
+            profile.dump_stats(path)
+            REGISTRY.inc('profiles_total', endpoint=endpoint)
+            return path
+        finally:
+            self._busy.release()
+
+
+def instrument(blueprint, profiler=None, registry=REGISTRY):
+    """Time and count every request to the blueprint, profiling a sample when a profiler is given"""
+
+    @blueprint.before_request
+    def _start_request():
+        g.kpi_request_started = time.perf_counter()
+        g.kpi_profile = profiler.start() if profiler is not None and profiler.enabled else None
+
+    @blueprint.after_request
+    def _finish_request(response):
+        started = g.pop('kpi_request_started', None)
+        if started is None:
+            return response
+        # The URL rule ('/api/kpi/<kpi_id>'), not the raw path, keeps label cardinality bounded
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        registry.observe('http_request_duration_seconds', time.perf_counter() - started, endpoint=endpoint)
+        registry.inc('http_requests_total', endpoint=endpoint, method=request.method,
+                     status=str(response.status_code))
+        profile = g.pop('kpi_profile', None)
+        if profile is not None:
+            response.headers['X-Profile'] = os.path.basename(profiler.stop(profile, endpoint))
+        return response
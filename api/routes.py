@@ -1,115 +1,530 @@
-from flask import Blueprint, jsonify, current_app
+from flask import Blueprint, Response, jsonify, current_app, request, stream_with_context
+import base64
+import binascii
+import json
+import random
+import threading
+import time
 import traceback
 
-def init_api(ontology):
+import numpy as np
+
+from ontology.snapshot import get_snapshot_store, as_float, RECORD_FIELDS, EXTRA_FIELDS, STATUS_NAMES
+from ontology.thresholds import attainment, worse
+from ontology.index import get_kpi_index
+from ontology.graph import get_dependency_graph, within_hops
+from ontology.history import HistoryStore, PERIOD_BUCKETS
+from services.aggregation import get_aggregates, GROUPINGS
+from services.benchmarking import get_benchmarks
+from services.root_cause import get_root_causes, DEFAULT_LIMIT
+from services.scorecard import get_scorecards, LEVELS
+from services.events import ChangeFeed
+from services.jobs import JobQueue, DONE, FAILED, DEFAULT_WAIT
+from services.metrics import REGISTRY
+from services.reasoning_engine import HospitalKPIReasoner
+from services.updates import KPIValueUpdater, InvalidUpdate
+from .cache import ResponseCache
+from .instrumentation import instrument
+
+# /api/kpis query parameters answered by the KPI index
+KPI_FILTERS = ("department", "category", "period", "status", "alert_level", "trend")
+MAX_PAGE_SIZE = 1000
+# Deepest /api/kpi/<id> neighborhood
+MAX_HOPS = 5
+MAX_CAUSES = 50
+
+# Each open /api/stream holds one worker thread, so this process admits a
+# capped number at a time and ends each one after SSE_MAX_DURATION seconds.
+# Defaults for the app.config settings (create_app() reads them from the environment)
+SSE_DEFAULTS = {
+    "SSE_MAX_STREAMS": 12,
+    "SSE_MAX_DURATION": 300.0,
+    "SSE_HEARTBEAT": 15.0,
+    "SSE_POLL_INTERVAL": 1.0,
+    "SSE_RETRY_MS": 3000,
+}
+_stream_lock = threading.Lock()
+_open_streams = 0
+
+
+def encode_cursor(kpi_id):
+    return base64.urlsafe_b64encode(kpi_id.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        return base64.b64decode(cursor + "=" * (-len(cursor) % 4), altchars=b"-_", validate=True).decode()
+    except (binascii.Error, UnicodeDecodeError) as e:
+        raise ValueError(f"bad cursor {cursor!r}") from e
+
+
+def _reason(reasoner):
+    """JobQueue run: a full reasoning pass and the version its result is valid for"""
+    result = reasoner.run_reasoning()
+    return result.to_dict(), result.version
+
+
+def init_api(ontology, history=None, profiler=None):
     api_bp = Blueprint("api", __name__, url_prefix="/api")
+    instrument(api_bp, profiler)
+    store = get_snapshot_store(ontology)
+    history = history if history is not None else HistoryStore()
+    cache = ResponseCache(store.version)
+    feed = ChangeFeed(store)
+    reasoner = HospitalKPIReasoner(ontology)
+    jobs = JobQueue(lambda: _reason(reasoner), store.version)
+    updater = KPIValueUpdater(ontology, reasoner, history)
 
-    def safe_float(val_list):
-        """Return first float value or None."""
-        try:
-            if val_list and len(val_list) > 0:
-                return float(val_list[0])
-        except Exception:
-            return None
-        return None
+    def warmup():
+        """Build the snapshot, index, graph and aggregates and the first reasoning result ahead of traffic"""
+        get_kpi_index(ontology)
+        get_dependency_graph(ontology)
+        get_aggregates(ontology)
+        job = jobs.submit(inline=True)
+        job.wait()
+        if job.status == FAILED:
+            raise RuntimeError(f"warm-up reasoning failed: {job.error}")
+
+    # Called by the app factory (see create_app in app.py)
+    api_bp.warmup = warmup
+    api_bp.shutdown = jobs.shutdown
 
     # ------------------------------------------------------------
     # /api/kpis
+    #   ?department= &category= &period= &status= &alert_level= &trend=
+    #                            index filters; status matches the "status" field
+    #                            (classified from the current values), alert_level
+    #                            the level stored by the last reasoning run
+    #   ?fields=id,name,status                                   projection
+    #   ?limit=N [&cursor=...]   paginate (ordered by KPI id); the response
+    #                            becomes {"items", "next_cursor", "total"}
     # ------------------------------------------------------------
     @api_bp.route("/kpis")
+    @cache.cached
     def get_kpis():
         try:
-            kpis = []
-            for kpi in ontology.KPI.instances():
-                dept = (
-                    kpi.belongs_to_department[0].dept_name[0]
-                    if getattr(kpi, "belongs_to_department", None)
-                    and kpi.belongs_to_department
-                    and getattr(kpi.belongs_to_department[0], "dept_name", None)
-                    else "N/A"
-                )
-                kpis.append({
-                    "id": kpi.name,
-                    "name": str(kpi.kpi_name[0]) if getattr(kpi, "kpi_name", None) else kpi.name,
-                    "department": dept,
-                    "actual": safe_float(getattr(kpi, "actual_value", [])),
-                    "target": safe_float(getattr(kpi, "target_value", [])),
-                    "trend": str(kpi.trend_direction[0]) if getattr(kpi, "trend_direction", None) else "N/A"
-                })
-            return jsonify(kpis)
+            fields = request.args.get("fields")
+            fields = tuple(f.strip() for f in fields.split(",") if f.strip()) if fields else RECORD_FIELDS
+            unknown = [f for f in fields if f not in RECORD_FIELDS + EXTRA_FIELDS]
+            if unknown:
+                return jsonify({"error": f"Unknown fields: {', '.join(unknown)}"}), 400
+
+            limit, cursor = request.args.get("limit"), request.args.get("cursor")
+            try:
+                limit = None if limit is None else int(limit)
+                after = None if cursor is None else decode_cursor(cursor)
+            except ValueError as e:
+                return jsonify({"error": f"Invalid pagination parameter: {e}"}), 400
+            if limit is not None and not 0 < limit <= MAX_PAGE_SIZE:
+                return jsonify({"error": f"limit must be between 1 and {MAX_PAGE_SIZE}"}), 400
+
+            index = get_kpi_index(ontology)
+            rows = index.rows(**{name: request.args.get(name) for name in KPI_FILTERS})
+            if limit is None and after is None:
+                return jsonify(index.snapshot.project(rows, fields))
+
+            page, last = index.page(rows, after, limit)
+            return jsonify({
+                "items": index.snapshot.project(page, fields),
+                "next_cursor": None if last is None else encode_cursor(last),
+                "total": int(len(rows)),
+            })
         except Exception as e:
             current_app.logger.error("❌ /api/kpis failed:\n%s", traceback.format_exc())
             return jsonify({"error": str(e)}), 500
 
+    # ------------------------------------------------------------
+    # POST /api/kpis/values  [{"id", "actual_value", "period"?}, ...]
+    # ------------------------------------------------------------
+    @api_bp.route("/kpis/values", methods=["POST"])
+    def update_values():
+        payload = request.get_json(silent=True)
+        updates = payload.get("updates") if isinstance(payload, dict) else payload
+        try:
+            result, touched = updater.apply(updates)
+        except InvalidUpdate as e:
+            return jsonify({"error": str(e), "errors": e.errors}), 400
+        except Exception as e:
+            current_app.logger.error("❌ /api/kpis/values failed:\n%s", traceback.format_exc())
+            return jsonify({"error": str(e)}), 500
+        feed.notify()
+        return jsonify({
+            "applied": len(updates),
+            "kpis": len(touched),
+            "version": store.version(),
+            "alerts": result.to_dict()["alerts"],
+        })
+
     # ------------------------------------------------------------
     # /api/summary
+    #   below_target counts any shortfall against target, while status_counts
+    #   use the /api/kpis statuses, where "good" allows a shortfall up to the
+    #   warning threshold; so below_target >= warning + critical
     # ------------------------------------------------------------
     @api_bp.route("/summary")
+    @cache.cached
     def get_summary():
         try:
-            kpis = ontology.KPI.instances()
-            total = len(kpis)
-            if total == 0:
+            snap = store.get()
+            if snap.size == 0:
                 return jsonify({"error": "No KPI data found"}), 500
 
-            below_target = 0
-            ratio_sum = 0
-            valid_count = 0
-
-            for kpi in kpis:
-                actual = safe_float(getattr(kpi, "actual_value", []))
-                target = safe_float(getattr(kpi, "target_value", []))
-                if actual is None or target in (None, 0):
-                    continue
-                valid_count += 1
-                ratio_sum += actual / target
-                if actual > target:
-                    below_target += 1
+            valid = ~np.isnan(snap.actual) & ~np.isnan(snap.target) & (snap.target != 0)
+            actual, target, polarity = snap.actual[valid], snap.target[valid], snap.polarity[valid]
+            valid_count = int(valid.sum())
+            # "Below target" in each KPI's own direction (a wait time above target misses it)
+            below_target = int(worse(actual, target, polarity).sum())
 
             on_target = valid_count - below_target
-            avg_perf = round(ratio_sum / valid_count, 2) if valid_count else 0
+            avg_perf = round(float(attainment(actual, target, polarity).sum()) / valid_count, 2) if valid_count else 0
+            statuses = snap.status_codes[valid]
+            status_counts = np.bincount(statuses[statuses >= 0], minlength=3)
 
             return jsonify({
                 "total_kpis": valid_count,
                 "on_target": on_target,
                 "below_target": below_target,
-                "avg_performance_ratio": avg_perf
+                "avg_performance_ratio": avg_perf,
+                "composite_score": get_scorecards(ontology, snap)["hospital"]["score"],
+                "status_counts": {str(STATUS_NAMES[code]): int(count) for code, count in enumerate(status_counts)},
+                "definitions": {
+                    "below_target": "missing target in the KPI's own direction, by any margin",
+                    "status_counts": "alert status as in /api/kpis; 'good' allows a shortfall up to the warning threshold",
+                },
             })
         except Exception as e:
             current_app.logger.error("❌ /api/summary failed:\n%s", traceback.format_exc())
             return jsonify({"error": str(e)}), 500
 
     # ------------------------------------------------------------
-    # /api/reasoning
+    # /api/departments (?by=category|time_period for other groupings)
+    # ------------------------------------------------------------
+    @api_bp.route("/departments")
+    @cache.cached
+    def get_departments():
+        try:
+            by = request.args.get("by", "department")
+            if by not in GROUPINGS:
+                return jsonify({"error": f"Unknown grouping: {by}"}), 400
+            return jsonify(get_aggregates(ontology)[by])
+        except Exception as e:
+            current_app.logger.error("❌ /api/departments failed:\n%s", traceback.format_exc())
+            return jsonify({"error": str(e)}), 500
+
+    # ------------------------------------------------------------
+    # /api/scorecards (?level=hospital|department|category for one level)
+    # ------------------------------------------------------------
+    @api_bp.route("/scorecards")
+    @cache.cached
+    def scorecards():
+        try:
+            level = request.args.get("level")
+            if level is not None and level not in LEVELS:
+                return jsonify({"error": f"Unknown level: {level}"}), 400
+            cards = get_scorecards(ontology)
+            return jsonify(cards if level is None else cards[level])
+        except Exception as e:
+            current_app.logger.error("❌ /api/scorecards failed:\n%s", traceback.format_exc())
+            return jsonify({"error": str(e)}), 500
+
+    # ------------------------------------------------------------
+    # /api/reasoning (served from background reasoning jobs)
     # ------------------------------------------------------------
     @api_bp.route("/reasoning")
     def reasoning():
+        """
+        Return the last completed reasoning result right away, queueing a
+        refresh when the ontology has changed since. Only the very first call,
+        with nothing to serve yet, waits (up to ?wait= seconds) for the run.
+        """
         try:
-            alerts, recs, logs = [], [], []
-            for kpi in ontology.KPI.instances():
-                name = str(kpi.kpi_name[0]) if getattr(kpi, "kpi_name", None) else kpi.name
-                actual = safe_float(getattr(kpi, "actual_value", []))
-                warn = safe_float(getattr(kpi, "warning_threshold", []))
-                crit = safe_float(getattr(kpi, "critical_threshold", []))
-                trend = str(kpi.trend_direction[0]) if getattr(kpi, "trend_direction", None) else "N/A"
-
-                if actual is None:
-                    continue
-
-                if crit is not None and actual >= crit:
-                    alerts.append({"kpi": name, "message": f"Critical: {actual} ≥ {crit}"})
-                    recs.append(f"Investigate {name} immediately (trend {trend})")
-                    logs.append(f"{name}: CRITICAL")
-                elif warn is not None and actual >= warn:
-                    alerts.append({"kpi": name, "message": f"Warning: {actual} ≥ {warn}"})
-                    recs.append(f"Monitor {name} closely (trend {trend})")
-                    logs.append(f"{name}: WARNING")
-                else:
-                    logs.append(f"{name}: Normal")
+            job = jobs.submit()
+            latest = jobs.latest
+            if latest is None:
+                job.wait(float(request.args.get("wait", current_app.config.get("REASONING_WAIT", DEFAULT_WAIT))))
+                latest = jobs.latest
+            if latest is None:
+                if job.status == FAILED:
+                    return jsonify({"error": job.error, "job": job.to_dict()}), 500
+                return jsonify({"job": job.to_dict()}), 202
 
-            return jsonify({"alerts": alerts, "recommendations": recs, "log": logs})
+            body = dict(latest.result)
+            body["job"] = latest.to_dict(include_result=False)
+            body["stale"] = not jobs.is_current(latest)
+            if job is not latest:
+                body["pending_job"] = job.id
+            return jsonify(body)
         except Exception as e:
             current_app.logger.error("❌ /api/reasoning failed:\n%s", traceback.format_exc())
             return jsonify({"error": str(e)}), 500
 
+    @api_bp.route("/reasoning/jobs", methods=["POST"])
+    def submit_reasoning_job():
+        job = jobs.submit()
+        status = 200 if job.status == DONE else 202
+        return jsonify(job.to_dict(include_result=False)), status, {"Location": f"{api_bp.url_prefix}/reasoning/jobs/{job.id}"}
+
+    @api_bp.route("/reasoning/jobs/<job_id>")
+    def reasoning_job(job_id):
+        job = jobs.get(job_id)
+        if job is None:
+            return jsonify({"error": f"Unknown job: {job_id}"}), 404
+        return jsonify(job.to_dict())
+
+    # ------------------------------------------------------------
+    # /api/stream (Server-Sent Events)
+    # ------------------------------------------------------------
+    @api_bp.route("/stream")
+    def stream():
+        """
+        Push KPI deltas and raised/cleared alerts as they happen. Each event id
+        is a cursor; a reconnecting EventSource sends it back as Last-Event-ID
+        (or pass ?cursor=) and receives only what it missed. A cursor that can
+        no longer be resumed gets a 'reset' event: reload everything, then
+        continue from the cursor it carries.
+
+        Streams are closed after SSE_MAX_DURATION seconds, and turned away at
+        once past SSE_MAX_STREAMS per process; either way the 'retry' field
+        tells the EventSource when to reconnect, so it resumes from its cursor.
+        """
+        cursor = request.headers.get("Last-Event-ID") or request.args.get("cursor")
+        settings = {name: type(default)(current_app.config.get(name, default))
+                    for name, default in SSE_DEFAULTS.items()}
+        heartbeat = settings["SSE_HEARTBEAT"]
+        poll_interval = settings["SSE_POLL_INTERVAL"]
+        max_duration = settings["SSE_MAX_DURATION"]
+        max_streams = settings["SSE_MAX_STREAMS"]
+        retry = settings["SSE_RETRY_MS"]
+        once = request.args.get("once") == "1"  # return after the backlog (tests, curl)
+
+        def message(event, event_id, data):
+            return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+
+        def events():
+            global _open_streams
+            with _stream_lock:
+                admitted = _open_streams < max_streams
+                if admitted:
+                    _open_streams += 1
+            if not admitted:
+                # Jittered so turned-away clients don't all come back together
+                yield f"retry: {retry + random.randrange(retry)}\n\n"
+                return
+            try:
+                yield f"retry: {retry}\n\n"
+                yield from stream_events()
+            finally:
+                with _stream_lock:
+                    _open_streams -= 1
+
+        def stream_events():
+            nonlocal cursor
+            feed.poll()
+            if cursor is None:
+                cursor = feed.cursor()
+                yield message("ready", cursor, {"version": store.version()})
+            started = last_sent = time.monotonic()
+            while True:
+                backlog = feed.since(cursor)
+                if backlog is None:
+                    cursor = feed.cursor()
+                    yield message("reset", cursor, {"version": store.version()})
+                    last_sent = time.monotonic()
+                    backlog = []
+                for cursor, delta in backlog:
+                    yield message("delta", cursor, delta)
+                    last_sent = time.monotonic()
+                if once or time.monotonic() - started >= max_duration:
+                    return
+                if time.monotonic() - last_sent >= heartbeat:
+                    yield ": keep-alive\n\n"
+                    last_sent = time.monotonic()
+                feed.wait(poll_interval)
+                feed.poll()
+
+        return Response(stream_with_context(events()), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    # ------------------------------------------------------------
+    # /api/kpi/<id>  (?hops=N neighborhood depth)
+    # ------------------------------------------------------------
+    @api_bp.route("/kpi/<kpi_id>")
+    @cache.cached
+    def kpi_detail(kpi_id):
+        try:
+            try:
+                hops = int(request.args.get("hops", 1))
+            except ValueError:
+                return jsonify({"error": "hops must be an integer"}), 400
+            if not 1 <= hops <= MAX_HOPS:
+                return jsonify({"error": f"hops must be between 1 and {MAX_HOPS}"}), 400
+
+            index = get_kpi_index(ontology)
+            i = index.row(kpi_id)
+            if i is None:
+                return jsonify({"error": f"Unknown KPI: {kpi_id}"}), 404
+
+            snap = index.snapshot
+            detail = snap.project([i], RECORD_FIELDS + EXTRA_FIELDS)[0]
+            kpi = index.get(kpi_id)
+            detail["description"] = str(kpi.description) if kpi is not None and kpi.description else None
+
+            def related(found):
+                rows, distances = found
+                return [dict(item, hops=int(d))
+                        for item, d in zip(snap.project(rows, ("id", "name", "status")), distances)]
+
+            neighborhood = {name: related(found)
+                            for name, found in get_dependency_graph(ontology).neighborhood(i, hops).items()}
+            neighborhood["comparable_to"] = related(
+                within_hops(snap.comparable_indptr, snap.comparable_indices, i, hops))
+            detail["neighborhood"] = dict(neighborhood, hops=hops)
+            return jsonify(detail)
+        except Exception as e:
+            current_app.logger.error("❌ /api/kpi/%s failed:\n%s", kpi_id, traceback.format_exc())
+            return jsonify({"error": str(e)}), 500
+
+    # ------------------------------------------------------------
+    # /api/benchmarks   peer comparison over comparable_to
+    #   (?department= &category= ... same filters as /api/kpis)
+    #   percentile_rank / z_score: higher is better whatever the KPI's polarity.
+    #   Peers are KPIs of this hospital only; hospitals (tenants) and
+    #   facilities are never compared with each other.
+    # ------------------------------------------------------------
+    @api_bp.route("/benchmarks")
+    @cache.cached
+    def benchmarks():
+        try:
+            index = get_kpi_index(ontology)
+            rows = index.rows(**{name: request.args.get(name) for name in KPI_FILTERS})
+            found = get_benchmarks(ontology).records(rows)
+            items = index.snapshot.project(list(found), ("id", "name", "department", "actual", "status", "polarity"))
+            return jsonify([dict(item, **record) for item, record in zip(items, found.values())])
+        except Exception as e:
+            current_app.logger.error("❌ /api/benchmarks failed:\n%s", traceback.format_exc())
+            return jsonify({"error": str(e)}), 500
+
+    # ------------------------------------------------------------
+    # /api/kpi/<id>/benchmark   one KPI against its peers (peers in value order)
+    # ------------------------------------------------------------
+    @api_bp.route("/kpi/<kpi_id>/benchmark")
+    @cache.cached
+    def kpi_benchmark(kpi_id):
+        try:
+            index = get_kpi_index(ontology)
+            i = index.row(kpi_id)
+            if i is None:
+                return jsonify({"error": f"Unknown KPI: {kpi_id}"}), 404
+
+            table = get_benchmarks(ontology)
+            snap = index.snapshot
+            detail = snap.project([i], ("id", "name", "department", "actual", "polarity"))[0]
+            detail["benchmark"] = table.record(i)
+            peers = table.peers(i)
+            detail["peers"] = [dict(item, percentile_rank=as_float(table.percentile[row]))
+                               for item, row in zip(snap.project(peers, ("id", "name", "department", "actual")),
+                                                    peers)]
+            return jsonify(detail)
+        except Exception as e:
+            current_app.logger.error("❌ /api/kpi/%s/benchmark failed:\n%s", kpi_id, traceback.format_exc())
+            return jsonify({"error": str(e)}), 500
+
+    # ------------------------------------------------------------
+    # /api/root-causes   ranked upstream causes of every critical KPI
+    # /api/kpi/<id>/root-causes   the same for one KPI, whatever its status
+    #   (?limit=N causes per KPI)
+    # ------------------------------------------------------------
+    def cause_limit():
+        limit = int(request.args.get("limit", DEFAULT_LIMIT))
+        if not 1 <= limit <= MAX_CAUSES:
+            raise ValueError(f"limit must be between 1 and {MAX_CAUSES}")
+        return limit
+
+    @api_bp.route("/root-causes")
+    @cache.cached
+    def root_causes():
+        try:
+            try:
+                limit = cause_limit()
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            analysis = get_root_causes(ontology)
+            return jsonify({
+                "kpis": analysis.report(limit),
+                "cycles": [[str(kpi_id) for kpi_id in analysis.snapshot.ids[rows]]
+                           for rows in analysis.graph.cycles()],
+            })
+        except Exception as e:
+            current_app.logger.error("❌ /api/root-causes failed:\n%s", traceback.format_exc())
+            return jsonify({"error": str(e)}), 500
+
+    @api_bp.route("/kpi/<kpi_id>/root-causes")
+    @cache.cached
+    def kpi_root_causes(kpi_id):
+        try:
+            try:
+                limit = cause_limit()
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            index = get_kpi_index(ontology)
+            i = index.row(kpi_id)
+            if i is None:
+                return jsonify({"error": f"Unknown KPI: {kpi_id}"}), 404
+            return jsonify(get_root_causes(ontology, index.snapshot).explain(i, limit))
+        except Exception as e:
+            current_app.logger.error("❌ /api/kpi/%s/root-causes failed:\n%s", kpi_id, traceback.format_exc())
+            return jsonify({"error": str(e)}), 500
+
+    # ------------------------------------------------------------
+    # /api/kpi/<id>/history
+    # ------------------------------------------------------------
+    @api_bp.route("/kpi/<kpi_id>/history")
+    def kpi_history(kpi_id):
+        try:
+            index = get_kpi_index(ontology)
+            i = index.row(kpi_id)
+            if i is None:
+                return jsonify({"error": f"Unknown KPI: {kpi_id}"}), 404
+
+            snap = index.snapshot
+            period = snap.period_names[snap.period_codes[i]]
+            bucket = request.args.get("bucket")
+            if bucket == "period":
+                bucket = PERIOD_BUCKETS.get(period)
+            start, end = request.args.get("start"), request.args.get("end")
+            try:
+                if bucket:
+                    times, values = history.downsample(kpi_id, bucket, start, end,
+                                                       request.args.get("agg", "mean"))
+                else:
+                    times, values = history.range(kpi_id, start, end)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+
+            return jsonify({
+                "id": snap.ids[i],
+                "time_period": period,
+                "bucket": bucket,
+                "trend": snap.trends[i],
+                "points": [{"t": t, "value": as_float(v)}
+                           for t, v in zip(np.datetime_as_string(times).tolist(), values)]
+            })
+        except Exception as e:
+            current_app.logger.error("❌ /api/kpi/%s/history failed:\n%s", kpi_id, traceback.format_exc())
+            return jsonify({"error": str(e)}), 500
+
+    # ------------------------------------------------------------
+    # /api/metrics   Prometheus text exposition (this worker's counters)
+    # ------------------------------------------------------------
+    @api_bp.route("/metrics")
+    def metrics():
+        snap = store.get()
+        gauges = {
+            "kpis": snap.size,
+            "snapshot_build_seconds": snap.build_seconds,
+            "reasoning_history": len(reasoner.history),
+            "stream_events": len(feed.events),
+        }
+        return Response(REGISTRY.render(gauges), mimetype="text/plain; version=0.0.4")
+
     return api_bp
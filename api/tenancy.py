@@ -0,0 +1,69 @@
+import json
+import traceback
+
+from werkzeug.wsgi import ClosingIterator
+
+from ontology.tenants import UnknownTenant
+
+# '/t/<tenant>/api/...' addresses a hospital by URL prefix
+TENANT_PREFIX = '/t'
+# ...or any request carrying this header
+TENANT_HEADER = 'X-Hospital-Tenant'
+
+
+class TenantDispatcher:
+    """
+    WSGI middleware in front of the default app: requests addressed to a
+    hospital go to that tenant's own app (attached to tenant.app by the
+    registry's setup hook), with the prefix moved into SCRIPT_NAME; everything
+    else reaches the default app unchanged. The tenant stays acquired until
+    the response has been fully sent, so streaming responses keep it loaded;
+    /api/stream ends after SSE_MAX_DURATION, releasing it, and the client
+    reconnects (reloading it if it was evicted meanwhile).
+    """
+
+    def __init__(self, app, registry, prefix=TENANT_PREFIX, header=TENANT_HEADER):
+        self.app = app
+        self.registry = registry
+        self.prefix = prefix.rstrip('/')
+        self.environ_key = 'HTTP_' + header.upper().replace('-', '_')
+
+    def route(self, environ):
+        """Return (tenant id, path for the tenant app, script name), or None for the default app"""
+        path = environ.get('PATH_INFO', '')
+        script_name = environ.get('SCRIPT_NAME', '')
+        if path.startswith(self.prefix + '/'):
+            tenant_id, _, rest = path[len(self.prefix) + 1:].partition('/')
+            return tenant_id, '/' + rest, f"{script_name}{self.prefix}/{tenant_id}"
+        tenant_id = environ.get(self.environ_key)
+        if tenant_id:
+            return tenant_id.strip(), path, script_name
+        return None
+
+    def __call__(self, environ, start_response):
+        routed = self.route(environ)
+        if routed is None:
+            return self.app(environ, start_response)
+
+        tenant_id, path, script_name = routed
+        try:
+            tenant = self.registry.acquire(tenant_id)
+        except UnknownTenant:
+            return _json_error(start_response, '404 NOT FOUND', f"Unknown hospital: {tenant_id}")
+        except Exception as e:
+            print(f"❌ Loading hospital {tenant_id} failed:\n{traceback.format_exc()}")
+            return _json_error(start_response, '503 SERVICE UNAVAILABLE', f"Hospital {tenant_id} unavailable: {e}")
+
+        environ = dict(environ, PATH_INFO=path, SCRIPT_NAME=script_name)
+        try:
+            body = tenant.app(environ, start_response)
+        except Exception:
+            self.registry.release(tenant)
+            raise
+        return ClosingIterator(body, lambda: self.registry.release(tenant))
+
+
+def _json_error(start_response, status, message):
+    body = json.dumps({'error': message}).encode()
+    start_response(status, [('Content-Type', 'application/json'), ('Content-Length', str(len(body)))])
+    return [body]
@@ -1,49 +1,238 @@
 from flask import Flask, render_template, jsonify
-from ontology.data import load_kpi_data
-from api.routes import init_api
-
-
-from flask import Flask, render_template, jsonify
-from ontology.data import load_kpi_data
-from api.routes import init_api
+import atexit
 import os
+import threading
+import time
+
+from services.metrics import REGISTRY
 
 # Get the absolute path to this file's directory
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
-app = Flask(__name__,
-            template_folder=os.path.join(BASE_DIR, 'templates'),
-            static_folder=os.path.join(BASE_DIR, 'static'))
+# KPI_TENANTS_DIR enables per-hospital ontologies (see ontology/tenants.py),
+# kept within KPI_TENANT_MEMORY_MB per worker
+DEFAULT_TENANT_MEMORY_MB = 512
 
-# server = app  # for Gunicorn compatibility
+# KPI_WARMUP: 'sync' (default) warms caches before the app is returned, 'background'
+# serves liveness (and the API, cold) while warming on a thread (in each worker
+# under gunicorn's preload, see KPI_WARMUP_AFTER_FORK), 'off' skips it
+WARMUP_MODES = ('sync', 'background', 'off')
 
+# /api/stream limits taken from the environment into app.config (defaults: SSE_DEFAULTS
+# in api/routes.py; under gunicorn SSE_MAX_STREAMS follows its threads, see gunicorn.conf.py)
+SSE_SETTINGS = {
+    'SSE_MAX_STREAMS': int,
+    'SSE_MAX_DURATION': float,
+    'SSE_HEARTBEAT': float,
+    'SSE_POLL_INTERVAL': float,
+    'SSE_RETRY_MS': int,
+}
 
-# DEMO: Hardcoded secret key for demo purposes only
-# In production, use environment variable: os.environ.get('SECRET_KEY')
-app.config['SECRET_KEY'] = 'demo-key-change-in-production'
 
-# Load ontology
-print("🏥 Loading Hospital KPI Ontology...")
-ontology = load_kpi_data()
+class AppState:
+    """Loaded ontology plus warm-up progress, reported by /api/health/ready"""
 
-# Register API routes
-api_bp = init_api(ontology)
-app.register_blueprint(api_bp)
+    def __init__(self, ontology, history):
+        self.ontology = ontology
+        self.history = history
+        self.warmup = 'pending'
+        self.warmup_seconds = None
+        self.error = None
+        self.ready = threading.Event()
+        self.tenants = None
+        # Background warm-up waiting for the worker fork (see gunicorn.conf.py)
+        self.deferred = None
 
-@app.route('/')
-def dashboard():
-    """Main dashboard page"""
-    return render_template('dashboard.html', title='Hospital KPI Ontology Dashboard')
+    def start_warmup(self, warmup):
+        threading.Thread(target=self.run_warmup, args=(warmup,), name='kpi-warmup', daemon=True).start()
 
-@app.route('/api/health')
-def health_check():
-    """Health check endpoint for Render"""
-    return jsonify({'status': 'healthy', 'ontology_loaded': True})
+    def run_warmup(self, warmup):
+        self.warmup = 'running'
+        started = time.perf_counter()
+        try:
+            warmup()
+        except Exception as e:
+            print(f"❌ Warm-up failed: {e}")
+            self.warmup, self.error = 'failed', str(e)
+            return
+        self.warmup_seconds = round(time.perf_counter() - started, 3)
+        self.warmup = 'done'
+        self.ready.set()
+        print(f"🔥 Warm-up finished in {self.warmup_seconds}s")
 
-if __name__ == '__main__':
-    port = int(__import__('os').environ.get('PORT', 10000))
-    debug = __import__('os').environ.get('FLASK_ENV') == 'development'
-    app.run(host='0.0.0.0', port=port, debug=debug)
 
+def ontology_builder(history=None):
+    """The builder for the configured sources: KPI_DEFINITIONS_FILE / KPI_VALUES_FILE, else the demo data"""
+    definitions_file = os.environ.get('KPI_DEFINITIONS_FILE')
+    if definitions_file:
+        from ontology.ingest import FileBuilder  # pulls in pandas, only needed for file loads
+        return FileBuilder(definitions_file, os.environ.get('KPI_VALUES_FILE'), history=history)
+    from ontology.data import load_kpi_data
+    return load_kpi_data
+
+
+def load_ontology(history):
+    """
+    Load the ontology (from a persisted quadstore when KPI_ONTOLOGY_STORE is set,
+    bulk-loaded from KPI_DEFINITIONS_FILE / KPI_VALUES_FILE when those are set)
+    """
+    from ontology.data import load_demo_history
+    from ontology.store import load_persistent_kpi_data
+
+    print("🏥 Loading Hospital KPI Ontology...")
+    store_path = os.environ.get('KPI_ONTOLOGY_STORE')
+    definitions_file = os.environ.get('KPI_DEFINITIONS_FILE')
+    builder = ontology_builder(history)
+    with REGISTRY.timer('ontology_load_seconds'):
+        onto = load_persistent_kpi_data(store_path, builder) if store_path else builder()
+    if not definitions_file:
+        # The demo KPIs come with recent readings, so their trends are derived from data
+        load_demo_history(onto, history)
+    return onto
+
+
+def create_tenant_app(tenant, config, profiler=None, warmup='sync'):
+    """API-only app for one hospital, built when its TenantRegistry loads it"""
+    from api.routes import init_api
+
+    app = Flask(__name__)
+    app.config.update(config)
+    api_bp = init_api(tenant.ontology, tenant.history, profiler)
+    app.register_blueprint(api_bp)
+    tenant.on_close.append(api_bp.shutdown)
+    if warmup != 'off':
+        api_bp.warmup()
+
+    @app.route('/api/health')
+    def health_check():
+        return jsonify({'status': 'healthy', 'ontology_loaded': True, 'ready': True, 'hospital': tenant.id})
+
+    tenant.app = app
+    return app
+
+
+def create_app(ontology=None, history=None, warmup=None, tenants_dir=None):
+    """
+    Build the Flask app: load the ontology (unless one is given), register the
+    API and warm its caches according to warmup (default: KPI_WARMUP or 'sync').
+    With tenants_dir (default: KPI_TENANTS_DIR), '/t/<hospital>/api/...' and
+    requests with an X-Hospital-Tenant header are served from that hospital's
+    own ontology, loaded on first use.
+    """
+    from ontology.history import HistoryStore
+    from ontology.snapshot import set_snapshot_store
+    from ontology.shared import SharedSnapshotStore
+    from api.routes import init_api
+    from api.instrumentation import RequestProfiler
+    from api.tenancy import TenantDispatcher
+    from ontology.tenants import TenantRegistry
+
+    warmup = warmup or os.environ.get('KPI_WARMUP', 'sync')
+    if warmup not in WARMUP_MODES:
+        raise ValueError(f"Unknown warm-up mode {warmup!r}; expected one of {', '.join(WARMUP_MODES)}")
+
+    app = Flask(__name__,
+                template_folder=os.path.join(BASE_DIR, 'templates'),
+                static_folder=os.path.join(BASE_DIR, 'static'))
 
+    # DEMO: Hardcoded secret key for demo purposes only
+    # In production, use environment variable: os.environ.get('SECRET_KEY')
+    app.config['SECRET_KEY'] = 'demo-key-change-in-production'
 
+    for name, convert in SSE_SETTINGS.items():
+        if name in os.environ:
+            try:
+                app.config[name] = convert(os.environ[name])
+            except ValueError:
+                raise ValueError(f"{name} must be a number, got {os.environ[name]!r}") from None
+
+    if history is None:
+        # KPI time-series history: on disk, and shared by the gunicorn workers, when
+        # KPI_HISTORY_DIR is set; otherwise in memory, so each worker keeps its own
+        history = HistoryStore(os.environ.get('KPI_HISTORY_DIR'))
+    if ontology is None:
+        ontology = load_ontology(history)
+
+    # Serve KPI snapshots published by the gunicorn master, and publish value
+    # updates to the other workers (see gunicorn.conf.py)
+    shared_prefix = os.environ.get('KPI_SHARED_SNAPSHOT')
+    if shared_prefix:
+        set_snapshot_store(ontology, SharedSnapshotStore(ontology, shared_prefix))
+
+    # Register API routes (KPI_PROFILE_RATE / KPI_PROFILE_HEADER enable the sampling profiler)
+    profiler = RequestProfiler.from_env()
+    api_bp = init_api(ontology, history, profiler)
+    app.register_blueprint(api_bp)
+
+    state = app.extensions['hospital_kpi'] = AppState(ontology, history)
+    if warmup == 'sync':
+        state.run_warmup(api_bp.warmup)
+    elif warmup == 'background' and os.environ.get('KPI_WARMUP_AFTER_FORK') == '1':
+        # Preloaded by gunicorn: a thread started here would not survive fork(),
+        # so post_fork starts the warm-up in each worker instead
+        state.deferred = api_bp.warmup
+    elif warmup == 'background':
+        state.start_warmup(api_bp.warmup)
+    else:
+        state.warmup = 'skipped'
+        state.ready.set()
+
+    tenants_dir = tenants_dir or os.environ.get('KPI_TENANTS_DIR')
+    if tenants_dir:
+        budget = int(os.environ.get('KPI_TENANT_MEMORY_MB', DEFAULT_TENANT_MEMORY_MB)) * 2 ** 20
+        state.tenants = TenantRegistry(
+            tenants_dir, budget,
+            setup=lambda tenant: create_tenant_app(tenant, app.config, profiler, warmup))
+        app.wsgi_app = TenantDispatcher(app.wsgi_app, state.tenants)
+        # Write back tenants still loaded when the worker exits
+        atexit.register(state.tenants.close)
+
+    @app.route('/')
+    def dashboard():
+        """Main dashboard page"""
+        return render_template('dashboard.html', title='Hospital KPI Ontology Dashboard')
+
+    @app.route('/kpi/<kpi_id>')
+    def kpi_detail(kpi_id):
+        """KPI drill-down page (data from /api/kpi/<id>)"""
+        return render_template('kpi_detail.html', title='KPI Details')
+
+    @app.route('/api/health')
+    def health_check():
+        """Liveness: the process is up and the ontology is loaded"""
+        return jsonify({'status': 'healthy', 'ontology_loaded': True, 'ready': state.ready.is_set()})
+
+    @app.route('/api/hospitals')
+    def hospitals():
+        """Hospitals this deployment can serve, and which are loaded in this worker"""
+        if state.tenants is None:
+            return jsonify({'hospitals': [], 'loaded': []})
+        return jsonify({'hospitals': state.tenants.tenants(), 'loaded': state.tenants.loaded(),
+                        'memory_bytes': state.tenants.memory(), 'memory_budget': state.tenants.memory_budget})
+
+    @app.route('/api/health/ready')
+    def readiness_check():
+        """Readiness: 503 until the warm-up has finished"""
+        body = {'ready': state.ready.is_set(), 'warmup': state.warmup,
+                'warmup_seconds': state.warmup_seconds}
+        if state.error:
+            body['error'] = state.error
+        return jsonify(body), 200 if state.ready.is_set() else 503
+
+    return app
+
+
+def __getattr__(name):
+    # `gunicorn app:app` (and `from app import app`) build the app on first access,
+    # so importing this module stays cheap; prefer `gunicorn 'app:create_app()'`
+    if name == 'app':
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+if __name__ == '__main__':
+    port = int(os.environ.get('PORT', 10000))
+    debug = os.environ.get('FLASK_ENV') == 'development'
+    create_app().run(host='0.0.0.0', port=port, debug=debug)
@@ -0,0 +1,228 @@
+"""
+Benchmark ontology load, reasoning, analytics and the /api endpoints on a
+synthetic hospital, reporting p50/p99 latency and memory, and compare the
+result with a stored baseline.
+
+Usage:
+    python -m benchmarks.run [--kpis 2000] [--departments 12] [--density 1.5] [--history 12]
+                             [--repeat 20] [--baseline benchmarks/baseline.json] [--save-baseline]
+
+Exits with status 1 when a metric's p50 regressed by more than --tolerance
+against the baseline recorded for the same scenario.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+from flask import Flask
+from owlready2 import World
+
+from ontology.history import HistoryStore
+from ontology.snapshot import KPISnapshot, get_snapshot_store
+from services.aggregation import compute_aggregates
+from services.analytics import KPIAnalytics
+from services.reasoning_engine import HospitalKPIReasoner
+from services.updates import KPIValueUpdater
+from api.routes import init_api
+from .synthetic import SyntheticHospital
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+DEFAULT_TOLERANCE = 0.25
+# Differences below this are timer noise, whatever the ratio
+MIN_REGRESSION_MS = 0.2
+
+ENDPOINTS = (
+    '/api/kpis',
+    '/api/kpis?limit=100&fields=id,status',
+    '/api/kpis?department=Department 000',
+    '/api/summary',
+    '/api/scorecards',
+    '/api/departments',
+    '/api/reasoning',
+    '/api/kpi/KPI_000000?hops=2',
+    '/api/kpi/KPI_000000/history?bucket=Q',
+    '/api/benchmarks',
+    '/api/kpi/KPI_000000/benchmark',
+)
+
+
+def summarize(seconds):
+    ms = np.asarray(seconds) * 1000
+    return {
+        'n': len(ms),
+        'p50_ms': round(float(np.percentile(ms, 50)), 3),
+        'p99_ms': round(float(np.percentile(ms, 99)), 3),
+        'mean_ms': round(float(ms.mean()), 3),
+    }
+
+
+def measure(fn, repeat, setup=None):
+    """Time fn() repeat times; setup() runs before each call, outside the timing"""
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return summarize(times)
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # not available on Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def scenario_key(hospital):
+    return ','.join(f"{name}={value}" for name, value in hospital.params().items())
+
+
+def run_benchmark(hospital, repeat=20):
+    """Build the hospital in a fresh World and time every stage; returns a results dict"""
+    history = HistoryStore()
+    hospital.history_store = history
+    metrics, memory = {}, {}
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    onto = hospital(World())
+    metrics['load'] = summarize([time.perf_counter() - start])
+    memory['load_python_peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+    tracemalloc.stop()
+
+    metrics['snapshot_build'] = measure(lambda: KPISnapshot(onto), min(repeat, 5))
+    snapshot = get_snapshot_store(onto).get()
+    memory['snapshot_arrays_mb'] = round(sum(
+        value.nbytes for value in vars(snapshot).values() if isinstance(value, np.ndarray)) / 2 ** 20, 2)
+
+    reasoner = HospitalKPIReasoner(onto)
+    metrics['reasoning_first'] = measure(reasoner.run_reasoning, 1)
+    metrics['reasoning'] = measure(reasoner.run_reasoning, repeat)
+
+    kpi = onto['KPI_000000']
+    base_value = kpi.actual_value
+    flips = iter(range(10 ** 9))
+
+    def touch():
+        # Alternate one KPI's value so the ontology version moves
+        kpi.actual_value = base_value + (next(flips) % 2) * 0.01
+
+    metrics['reasoning_incremental'] = measure(lambda: reasoner.run_incremental([kpi.name]), repeat, touch)
+    # The API's write path: the snapshot is patched rather than rebuilt
+    updater = KPIValueUpdater(onto, reasoner, history)
+    metrics['update_incremental'] = measure(
+        lambda: updater.apply([{'id': kpi.name, 'actual_value': base_value + (next(flips) % 2) * 0.01}]), repeat)
+    metrics['aggregation'] = measure(lambda: compute_aggregates(get_snapshot_store(onto).get()), repeat)
+    analytics = KPIAnalytics(onto)
+    metrics['dashboard_dataframe'] = measure(analytics.get_dashboard_data, repeat)
+
+    app = Flask(__name__)
+    app.register_blueprint(init_api(onto, history))
+    with app.test_client() as client:
+        def get(path):
+            response = client.get(path)
+            if response.status_code != 200:
+                raise RuntimeError(f"{path} returned {response.status_code}")
+
+        for path in ENDPOINTS:
+            get(path)
+            metrics[f"GET {path} (cached)"] = measure(lambda: get(path), repeat)
+            metrics[f"GET {path} (after change)"] = measure(lambda: get(path), repeat, touch)
+    kpi.actual_value = base_value
+
+    memory['peak_rss_mb'] = peak_rss_mb()
+    return {'scenario': scenario_key(hospital), 'params': hospital.params(), 'repeat': repeat,
+            'metrics': metrics, 'memory': memory}
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Return [(metric, baseline p50, current p50)] for metrics that got slower than tolerance allows"""
+    reference = baseline.get(results['scenario'])
+    if reference is None:
+        return []
+    regressions = []
+    for name, stats in results['metrics'].items():
+        before = reference['metrics'].get(name)
+        if before is None:
+            continue
+        now, then = stats['p50_ms'], before['p50_ms']
+        if now > then * (1 + tolerance) and now - then > MIN_REGRESSION_MS:
+            regressions.append((name, then, now))
+    return regressions
+
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_baseline(path, results):
+    baseline = load_baseline(path)
+    baseline[results['scenario']] = {'metrics': results['metrics'], 'memory': results['memory']}
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def report(results, baseline):
+    reference = baseline.get(results['scenario'], {}).get('metrics', {})
+    print(f"\n📊 Scenario: {results['scenario']} (repeat={results['repeat']})")
+    print(f"{'metric':<58}{'p50 ms':>10}{'p99 ms':>10}{'baseline':>10}")
+    for name, stats in results['metrics'].items():
+        then = reference.get(name, {}).get('p50_ms')
+        print(f"{name:<58}{stats['p50_ms']:>10.3f}{stats['p99_ms']:>10.3f}"
+              f"{'' if then is None else f'{then:.3f}':>10}")
+    for name, value in results['memory'].items():
+        print(f"{name:<58}{value!s:>10}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Hospital KPI stack on a synthetic hospital")
+    parser.add_argument('--departments', type=int, default=12)
+    parser.add_argument('--kpis', type=int, default=2000)
+    parser.add_argument('--density', type=float, default=1.5, help="mean affects edges per KPI")
+    parser.add_argument('--comparable', type=float, default=1.0, help="mean comparable_to peers per KPI")
+    parser.add_argument('--history', type=int, default=12, help="monthly history points per KPI")
+    parser.add_argument('--history-end', default='2024-01', help="month the synthetic history runs up to")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help="record this run as the scenario's baseline")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument('--output', help="also write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    hospital = SyntheticHospital(args.departments, args.kpis, args.density, args.comparable,
+                                 args.history, args.seed, history_end=args.history_end)
+    results = run_benchmark(hospital, args.repeat)
+    baseline = load_baseline(args.baseline)
+    report(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        save_baseline(args.baseline, results)
+        print(f"💾 Baseline saved to {args.baseline}")
+        return 0
+
+    regressions = compare(results, baseline, args.tolerance)
+    for name, then, now in regressions:
+        print(f"❌ Regression: {name} p50 {then:.3f} ms -> {now:.3f} ms")
+    if not regressions and results['scenario'] in baseline:
+        print("✅ No regressions against baseline")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
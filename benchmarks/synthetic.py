@@ -0,0 +1,117 @@
+"""
+Synthetic hospitals for benchmarking: any number of departments and KPIs,
+built through the ontology.models schema with a random affects graph,
+comparable_to pairs within each category and optional per-KPI history.
+"""
+import numpy as np
+
+from ontology.models import create_hospital_kpi_ontology
+
+DEPARTMENT_CLASSES = ('EmergencyDepartment', 'ICU', 'Surgery', 'Radiology', 'Pharmacy', 'HospitalAdministration')
+CATEGORY_CLASSES = ('Efficiency', 'QualityOfCare', 'Safety', 'Financial', 'PatientSatisfaction', 'Operational')
+UNITS = ('Percentage', 'Minutes', 'Ratio', 'Days', 'Count')
+PERIODS = ('Weekly', 'Monthly', 'Quarterly')
+TRENDS = ('up', 'down', 'stable')
+
+
+class SyntheticHospital:
+    """
+    Ontology builder (callable with an optional World, like load_kpi_data).
+    density is the mean number of affects edges per KPI, comparable the mean
+    number of comparable_to peers; history appends that many monthly points
+    per KPI, ending the month before history_end, to history_store when one
+    is given. The same parameters always yield the same hospital.
+    """
+
+    def __init__(self, departments=8, kpis=1000, density=1.5, comparable=1.0, history=0,
+                 seed=0, history_store=None, history_end='2024-01'):
+        self.departments = departments
+        self.kpis = kpis
+        self.density = density
+        self.comparable = comparable
+        self.history = history
+        self.seed = seed
+        self.history_store = history_store
+        self.history_end = history_end
+
+    def params(self):
+        return {'departments': self.departments, 'kpis': self.kpis, 'density': self.density,
+                'comparable': self.comparable, 'history': self.history, 'history_end': self.history_end,
+                'seed': self.seed}
+
+    def __call__(self, world=None):
+        rng = np.random.default_rng(self.seed)
+        onto = create_hospital_kpi_ontology(world)
+        n = self.kpis
+
+        target = rng.uniform(10, 100, n).round(2)
+        actual = (target * rng.normal(1.0, 0.06, n)).round(2)
+        dept_of = rng.integers(0, self.departments, n)
+        category_of = rng.integers(0, len(CATEGORY_CLASSES), n)
+        unit_of = rng.integers(0, len(UNITS), n)
+        period_of = rng.integers(0, len(PERIODS), n)
+        trend_of = rng.integers(0, len(TRENDS), n)
+        weight = rng.uniform(0.5, 1.0, n).round(2)
+
+        with onto:
+            units = [onto.Unit(name) for name in UNITS]
+            periods = [onto.TimePeriod(name) for name in PERIODS]
+            categories = [getattr(onto, name)(f"{name}_Category") for name in CATEGORY_CLASSES]
+            departments = []
+            for d in range(self.departments):
+                cls = getattr(onto, DEPARTMENT_CLASSES[d % len(DEPARTMENT_CLASSES)])
+                dept = cls(f"Dept_{d:03d}")
+                dept.dept_name = f"Department {d:03d}"
+                departments.append(dept)
+
+            kpis = []
+            for i in range(n):
+                kpi = onto.KPI(f"KPI_{i:06d}")
+                kpi.kpi_name = f"Synthetic KPI {i}"
+                kpi.actual_value = float(actual[i])
+                kpi.target_value = float(target[i])
+                kpi.warning_threshold = float(round(target[i] * 1.1, 2))
+                kpi.critical_threshold = float(round(target[i] * 1.25, 2))
+                kpi.weight = float(weight[i])
+                kpi.trend_direction = TRENDS[trend_of[i]]
+                kpi.belongs_to_department = [departments[dept_of[i]]]
+                kpi.belongs_to_category = [categories[category_of[i]]]
+                kpi.is_measured_in = [units[unit_of[i]]]
+                kpi.has_time_period = [periods[period_of[i]]]
+                kpis.append(kpi)
+
+            for a, b in self._edges(rng, n, self.density):
+                kpis[a].affects.append(kpis[b])
+            for a, b in self._peers(rng, category_of, self.comparable):
+                kpis[a].comparable_to.append(kpis[b])
+
+        if self.history and self.history_store is not None:
+            months = np.arange(-self.history, 0) + np.datetime64(self.history_end, 'M')
+            noise = rng.normal(1.0, 0.05, (n, self.history))
+            for i, kpi in enumerate(kpis):
+                for month, factor in zip(months, noise[i]):
+                    self.history_store.append(kpi.name, month.astype('datetime64[D]'), actual[i] * factor)
+        return onto
+
+    @staticmethod
+    def _edges(rng, n, density):
+        """Random affects edges, mostly pointing forward so the graph stays shallow"""
+        count = int(n * density)
+        if n < 2 or count == 0:
+            return []
+        a = rng.integers(0, n, count)
+        b = (a + rng.integers(1, min(n, 50), count)) % n  # never a self-loop
+        return sorted(set(zip(a.tolist(), b.tolist())))
+
+    @staticmethod
+    def _peers(rng, category_of, comparable):
+        """Random comparable_to pairs between KPIs of the same category"""
+        pairs = set()
+        for code in np.unique(category_of):
+            members = np.flatnonzero(category_of == code)
+            count = int(len(members) * comparable / 2)
+            if len(members) < 2 or count == 0:
+                continue
+            a, b = rng.choice(members, count), rng.choice(members, count)
+            pairs.update((int(x), int(y)) for x, y in zip(a, b) if x < y)
+        return sorted(pairs)
@@ -0,0 +1,73 @@
+# Gunicorn settings (picked up automatically by `gunicorn app:app`)
+import gc
+import os
+
+# Build the ontology (and warm its caches, see KPI_WARMUP in app.py) once in the
+# master; workers inherit it copy-on-write. Run with `gunicorn 'app:create_app()'`
+preload_app = True
+
+# Threaded workers; each open /api/stream still holds a thread, so the API admits
+# SSE_MAX_STREAMS per worker and closes them after SSE_MAX_DURATION seconds, and
+# clients reconnect with Last-Event-ID. Unless set, the cap follows the threads,
+# keeping SSE_RESERVED_THREADS free for ordinary requests.
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 16))
+SSE_RESERVED_THREADS = 4
+os.environ.setdefault('SSE_MAX_STREAMS', str(max(1, threads - SSE_RESERVED_THREADS)))
+
+_publisher = None
+
+# With preload_app, a KPI_WARMUP=background thread started in the master would not
+# survive fork() (and could fork with a snapshot lock held); run it in post_fork
+os.environ.setdefault('KPI_WARMUP_AFTER_FORK', '1')
+
+
+def _publish(onto):
+    from ontology.snapshot import KPISnapshot
+    with _publisher.exclusive():  # workers publish their value updates too
+        generation = _publisher.publish(KPISnapshot(onto))
+    print(f"📤 Published KPI snapshot generation {generation}")
+
+
+def when_ready(server):
+    """Master, after the app is preloaded: share the snapshot and freeze the heap"""
+    global _publisher
+    prefix = os.environ.get('KPI_SHARED_SNAPSHOT')
+    if prefix:
+        from ontology.shared import SnapshotPublisher
+        _publisher = SnapshotPublisher(prefix)
+        _publish(server.app.wsgi().extensions['hospital_kpi'].ontology)
+    # Keep the GC from touching (and so copying) preloaded objects in workers
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    """Worker: start the deferred background warm-up in this process"""
+    state = worker.app.wsgi().extensions['hospital_kpi']
+    if state.deferred is not None:
+        state.start_warmup(state.deferred)
+
+
+def on_reload(server):
+    """
+    SIGHUP: rebuild the KPI_ONTOLOGY_STORE quadstore if its sources changed (code,
+    KPI_DEFINITIONS_FILE / KPI_VALUES_FILE) and publish it; workers swap to it on their
+    next request. The rebuilt values replace any that workers have posted, and
+    dated rows in KPI_VALUES_FILE don't reach the workers' history. Adding or removing
+    KPIs needs a restart, since each worker's own ontology keeps the preloaded set.
+    """
+    store_path = os.environ.get('KPI_ONTOLOGY_STORE')
+    if _publisher is None or not store_path:
+        return
+    from app import ontology_builder
+    from ontology.store import load_persistent_kpi_data
+    onto = load_persistent_kpi_data(store_path, ontology_builder())
+    try:
+        _publish(onto)
+    finally:
+        onto.world.close()
+
+
+def on_exit(server):
+    if _publisher is not None:
+        _publisher.close()
@@ -1,13 +1,31 @@
+import numpy as np
 from owlready2 import *
 from .models import create_hospital_kpi_ontology
 
-def load_kpi_data():
+# Recent readings of the demo KPIs, oldest first and ending at their current actual_value,
+# one per month (one per quarter for quarterly KPIs) up to DEMO_HISTORY_END
+DEMO_HISTORY = {
+    'ED_Wait_Time': [32.8, 32.1, 33.0, 32.4, 32.9, 32.5],
+    'ED_LWBS': [2.4, 2.5, 2.7, 2.8, 3.0, 3.2],
+    'ED_Mortality_Rate': [1.5, 1.5, 1.6, 1.7, 1.7, 1.8],
+    'ICU_CLABSI_Rate': [0.55, 0.6, 0.65, 0.7, 0.8, 0.85],
+    'ICU_Occupancy_Rate': [82.0, 83.1, 84.0, 85.2, 86.4, 87.5],
+    'Surgery_SSI_Rate': [2.1, 2.0, 2.1, 2.1, 2.0, 2.1],
+    'Hospital_Operating_Margin': [5.6, 5.3, 5.0, 4.8, 4.5, 4.2],
+    'Patient_Satisfaction_Score': [81.8, 82.3, 81.9, 82.1, 81.7, 82.0],
+    'Hospital_Readmission_Rate': [11.9, 12.0, 12.2, 12.4, 12.6, 12.8],
+}
+DEMO_HISTORY_END = '2024-06'
+
+def load_kpi_data(world=None):
     """
     Load realistic hospital KPI instances and link them to departments, categories, and units.
+    Args:
+        world: owlready2 World to build into (default_world if None)
     Returns:
         onto: A populated hospital KPI ontology.
     """
-    onto = create_hospital_kpi_ontology()
+    onto = create_hospital_kpi_ontology(world)
 
     with onto:
         # ==================== TIME PERIODS & UNITS ====================
@@ -22,18 +40,18 @@ def load_kpi_data():
         # ==================== DEPARTMENTS ====================
         ed = onto.EmergencyDepartment("ED_Department")
         ed.dept_name = "Emergency Department"
-        ed.bed_capacity = [45]
-        ed.staff_count = [85]
+        ed.bed_capacity = 45
+        ed.staff_count = 85
 
         icu = onto.ICU("ICU_Department")
         icu.dept_name = "Intensive Care Unit"
-        icu.bed_capacity = [24]
-        icu.staff_count = [60]
+        icu.bed_capacity = 24
+        icu.staff_count = 60
 
         surgery = onto.Surgery("Surgery_Department")
         surgery.dept_name = "Surgery Department"
-        surgery.bed_capacity = [30]
-        surgery.staff_count = [50]
+        surgery.bed_capacity = 30
+        surgery.staff_count = 50
 
         admin = onto.HospitalAdministration("Admin_Department")
         admin.dept_name = "Hospital Administration"
@@ -42,135 +60,166 @@ def load_kpi_data():
         ed_wait = onto.KPI("ED_Wait_Time")
         ed_wait.kpi_name = "Door-to-Doctor Time"
         ed_wait.description = "Average time from patient arrival to first physician contact"
-        ed_wait.actual_value = [32.5]
-        ed_wait.target_value = [30.0]
-        ed_wait.warning_threshold = [35.0]
-        ed_wait.critical_threshold = [45.0]
+        ed_wait.actual_value = 32.5
+        ed_wait.target_value = 30.0
+        ed_wait.warning_threshold = 35.0
+        ed_wait.critical_threshold = 45.0
         ed_wait.is_measured_in = [minutes]
         ed_wait.belongs_to_category = [onto.Efficiency()]
         ed_wait.belongs_to_department = [ed]
-        ed_wait.weight = [0.85]
+        ed_wait.weight = 0.85
         ed_wait.has_time_period = [monthly]
-        ed_wait.trend_direction = ["stable"]
+        ed_wait.trend_direction = "stable"
+        ed_wait.polarity = "lower_is_better"
 
         ed_lwbs = onto.KPI("ED_LWBS")
         ed_lwbs.kpi_name = "Left Without Being Seen Rate"
         ed_lwbs.description = "Percentage of patients who left before being seen by provider"
-        ed_lwbs.actual_value = [3.2]
-        ed_lwbs.target_value = [2.0]
-        ed_lwbs.warning_threshold = [3.0]
-        ed_lwbs.critical_threshold = [5.0]
+        ed_lwbs.actual_value = 3.2
+        ed_lwbs.target_value = 2.0
+        ed_lwbs.warning_threshold = 3.0
+        ed_lwbs.critical_threshold = 5.0
         ed_lwbs.is_measured_in = [percent]
         ed_lwbs.belongs_to_category = [onto.QualityOfCare(), onto.PatientSatisfaction()]
         ed_lwbs.belongs_to_department = [ed]
-        ed_lwbs.weight = [0.95]
+        ed_lwbs.weight = 0.95
         ed_lwbs.has_time_period = [monthly]
-        ed_lwbs.trend_direction = ["up"]
+        ed_lwbs.trend_direction = "up"
+        ed_lwbs.polarity = "lower_is_better"
 
         ed_mortality = onto.KPI("ED_Mortality_Rate")
         ed_mortality.kpi_name = "ED Mortality Rate"
         ed_mortality.description = "Mortality rate in emergency department"
-        ed_mortality.actual_value = [1.8]
-        ed_mortality.target_value = [1.5]
-        ed_mortality.warning_threshold = [2.0]
-        ed_mortality.critical_threshold = [2.5]
+        ed_mortality.actual_value = 1.8
+        ed_mortality.target_value = 1.5
+        ed_mortality.warning_threshold = 2.0
+        ed_mortality.critical_threshold = 2.5
         ed_mortality.is_measured_in = [percent]
         ed_mortality.belongs_to_category = [onto.Safety(), onto.QualityOfCare()]
         ed_mortality.belongs_to_department = [ed]
-        ed_mortality.weight = [0.98]
+        ed_mortality.weight = 0.98
         ed_mortality.has_time_period = [monthly]
-        ed_mortality.trend_direction = ["up"]
+        ed_mortality.trend_direction = "up"
+        ed_mortality.polarity = "lower_is_better"
 
         # ==================== ICU KPIs ====================
         icu_clabsi = onto.KPI("ICU_CLABSI_Rate")
         icu_clabsi.kpi_name = "CLABSI Rate (per 1000 line days)"
         icu_clabsi.description = "Central Line-Associated Bloodstream Infection rate"
-        icu_clabsi.actual_value = [0.85]
-        icu_clabsi.target_value = [0.5]
-        icu_clabsi.warning_threshold = [1.0]
-        icu_clabsi.critical_threshold = [1.5]
+        icu_clabsi.actual_value = 0.85
+        icu_clabsi.target_value = 0.5
+        icu_clabsi.warning_threshold = 1.0
+        icu_clabsi.critical_threshold = 1.5
         icu_clabsi.is_measured_in = [ratio]
         icu_clabsi.belongs_to_category = [onto.Safety(), onto.QualityOfCare()]
         icu_clabsi.belongs_to_department = [icu]
-        icu_clabsi.weight = [0.94]
+        icu_clabsi.weight = 0.94
         icu_clabsi.has_time_period = [quarterly]
-        icu_clabsi.trend_direction = ["up"]
+        icu_clabsi.trend_direction = "up"
+        icu_clabsi.polarity = "lower_is_better"
 
         icu_occupancy = onto.KPI("ICU_Occupancy_Rate")
         icu_occupancy.kpi_name = "ICU Bed Occupancy Rate"
         icu_occupancy.description = "Percentage of ICU beds occupied"
-        icu_occupancy.actual_value = [87.5]
-        icu_occupancy.target_value = [85.0]
-        icu_occupancy.warning_threshold = [90.0]
-        icu_occupancy.critical_threshold = [95.0]
+        icu_occupancy.actual_value = 87.5
+        icu_occupancy.target_value = 85.0
+        icu_occupancy.warning_threshold = 90.0
+        icu_occupancy.critical_threshold = 95.0
         icu_occupancy.is_measured_in = [percent]
         icu_occupancy.belongs_to_category = [onto.Operational(), onto.Efficiency()]
         icu_occupancy.belongs_to_department = [icu]
-        icu_occupancy.weight = [0.80]
+        icu_occupancy.weight = 0.80
         icu_occupancy.has_time_period = [monthly]
-        icu_occupancy.trend_direction = ["up"]
+        icu_occupancy.trend_direction = "up"
+        icu_occupancy.polarity = "lower_is_better"
 
         # ==================== SURGERY KPIs ====================
         surgery_ssi = onto.KPI("Surgery_SSI_Rate")
         surgery_ssi.kpi_name = "Surgical Site Infection Rate"
         surgery_ssi.description = "Infections within 30 days of surgery"
-        surgery_ssi.actual_value = [2.1]
-        surgery_ssi.target_value = [2.0]
-        surgery_ssi.warning_threshold = [2.5]
-        surgery_ssi.critical_threshold = [3.0]
+        surgery_ssi.actual_value = 2.1
+        surgery_ssi.target_value = 2.0
+        surgery_ssi.warning_threshold = 2.5
+        surgery_ssi.critical_threshold = 3.0
         surgery_ssi.is_measured_in = [percent]
         surgery_ssi.belongs_to_category = [onto.Safety(), onto.QualityOfCare()]
         surgery_ssi.belongs_to_department = [surgery]
-        surgery_ssi.weight = [0.96]
+        surgery_ssi.weight = 0.96
         surgery_ssi.has_time_period = [quarterly]
-        surgery_ssi.trend_direction = ["stable"]
+        surgery_ssi.trend_direction = "stable"
+        surgery_ssi.polarity = "lower_is_better"
 
         # ==================== ADMINISTRATION KPIs ====================
         admin_margin = onto.KPI("Hospital_Operating_Margin")
         admin_margin.kpi_name = "Operating Margin"
         admin_margin.description = "Revenue minus expenses divided by revenue"
-        admin_margin.actual_value = [4.2]
-        admin_margin.target_value = [5.0]
-        admin_margin.warning_threshold = [3.0]
-        admin_margin.critical_threshold = [1.0]
+        admin_margin.actual_value = 4.2
+        admin_margin.target_value = 5.0
+        admin_margin.warning_threshold = 3.0
+        admin_margin.critical_threshold = 1.0
         admin_margin.is_measured_in = [percent]
         admin_margin.belongs_to_category = [onto.Financial()]
         admin_margin.belongs_to_department = [admin]
-        admin_margin.weight = [1.0]
+        admin_margin.weight = 1.0
         admin_margin.has_time_period = [quarterly]
-        admin_margin.trend_direction = ["down"]
+        admin_margin.trend_direction = "down"
+        admin_margin.polarity = "higher_is_better"
 
         admin_satisfaction = onto.KPI("Patient_Satisfaction_Score")
         admin_satisfaction.kpi_name = "Patient Satisfaction Score"
         admin_satisfaction.description = "Overall HCAHPS composite score"
-        admin_satisfaction.actual_value = [82.0]
-        admin_satisfaction.target_value = [85.0]
-        admin_satisfaction.warning_threshold = [80.0]
-        admin_satisfaction.critical_threshold = [75.0]
+        admin_satisfaction.actual_value = 82.0
+        admin_satisfaction.target_value = 85.0
+        admin_satisfaction.warning_threshold = 80.0
+        admin_satisfaction.critical_threshold = 75.0
         admin_satisfaction.is_measured_in = [percent]
         admin_satisfaction.belongs_to_category = [onto.PatientSatisfaction(), onto.QualityOfCare()]
         admin_satisfaction.belongs_to_department = [admin]
-        admin_satisfaction.weight = [0.92]
+        admin_satisfaction.weight = 0.92
         admin_satisfaction.has_time_period = [monthly]
-        admin_satisfaction.trend_direction = ["stable"]
+        admin_satisfaction.trend_direction = "stable"
+        admin_satisfaction.polarity = "higher_is_better"
 
         admin_readmission = onto.KPI("Hospital_Readmission_Rate")
         admin_readmission.kpi_name = "30-Day Readmission Rate"
         admin_readmission.description = "Percentage of patients readmitted within 30 days"
-        admin_readmission.actual_value = [12.8]
-        admin_readmission.target_value = [11.0]
-        admin_readmission.warning_threshold = [13.0]
-        admin_readmission.critical_threshold = [15.0]
+        admin_readmission.actual_value = 12.8
+        admin_readmission.target_value = 11.0
+        admin_readmission.warning_threshold = 13.0
+        admin_readmission.critical_threshold = 15.0
         admin_readmission.is_measured_in = [percent]
         admin_readmission.belongs_to_category = [onto.QualityOfCare(), onto.Financial()]
         admin_readmission.belongs_to_department = [admin]
-        admin_readmission.weight = [0.91]
+        admin_readmission.weight = 0.91
         admin_readmission.has_time_period = [monthly]
-        admin_readmission.trend_direction = ["up"]
+        admin_readmission.trend_direction = "up"
+        admin_readmission.polarity = "lower_is_better"
 
         # ==================== RELATIONSHIPS ====================
         ed_wait.affects = [ed_lwbs, admin_satisfaction]
         ed_lwbs.depends_on = [ed_wait]
         icu_occupancy.affects = [icu_clabsi]
+        # Peer group for /api/benchmarks: the Safety KPIs of the clinical departments
+        ed_mortality.comparable_to = [icu_clabsi, surgery_ssi]
+        icu_clabsi.comparable_to = [surgery_ssi]
 
     return onto
+
+
+def load_demo_history(onto, history):
+    """
+    Append DEMO_HISTORY to a HistoryStore and derive trend_direction from it,
+    replacing the hand-set trends above. KPIs that already have history
+    (e.g. in a persistent KPI_HISTORY_DIR) are left as they are.
+    """
+    end = np.datetime64(DEMO_HISTORY_END, 'M')
+    for kpi in onto.KPI.instances():
+        values = DEMO_HISTORY.get(kpi.name)
+        if values is None or history.series(kpi.name) is not None:
+            continue
+        step = 3 if any(period.name == 'Quarterly' for period in kpi.has_time_period) else 1
+        months = end - step * np.arange(len(values) - 1, -1, -1)
+        for month, value in zip(months, values):
+            history.append(kpi.name, month.astype('datetime64[D]'), value)
+    with onto:
+        return history.refresh_trends(onto)
@@ -0,0 +1,191 @@
+import threading
+
+import numpy as np
+
+from .snapshot import get_snapshot_store
+
+
+def _transpose(indptr, indices, size):
+    """Reverse a CSR adjacency (affects -> depends_on)"""
+    sources = np.repeat(np.arange(size), np.diff(indptr))
+    order = np.argsort(indices, kind='stable')
+    rev_indptr = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(indices, minlength=size), out=rev_indptr[1:])
+    return rev_indptr, sources[order]
+
+
+def within_hops(indptr, indices, start, hops):
+    """
+    Breadth-first search over a CSR adjacency: return (rows, distances) for
+    every row reachable from start in 1..hops steps, nearest first.
+    """
+    distance = np.full(len(indptr) - 1, -1, dtype=np.int64)
+    distance[start] = 0
+    frontier = np.array([start], dtype=np.int64)
+    for hop in range(1, hops + 1):
+        if not len(frontier):
+            break
+        reached = np.unique(np.concatenate([indices[indptr[r]:indptr[r + 1]] for r in frontier]))
+        frontier = reached[distance[reached] < 0]
+        distance[frontier] = hop
+    rows = np.flatnonzero(distance > 0)
+    order = np.argsort(distance[rows], kind='stable')
+    return rows[order], distance[rows][order]
+
+
+def strongly_connected(indptr, indices, size):
+    """Strongly connected component label per row of a CSR digraph (iterative Tarjan)"""
+    indptr, indices = indptr.tolist(), indices.tolist()
+    order = [-1] * size
+    low = [0] * size
+    on_stack = [False] * size
+    labels = np.full(size, -1, dtype=np.int64)
+    stack, counter, label = [], 0, 0
+    for root in range(size):
+        if order[root] >= 0:
+            continue
+        order[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = True
+        work = [(root, indptr[root])]
+        while work:
+            v, i = work[-1]
+            if i < indptr[v + 1]:
+                work[-1] = (v, i + 1)
+                w = indices[i]
+                if order[w] < 0:
+                    order[w] = low[w] = counter
+                    counter += 1
+                    stack.append(w)
+                    on_stack[w] = True
+                    work.append((w, indptr[w]))
+                elif on_stack[w]:
+                    low[v] = min(low[v], order[w])
+                continue
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[v])
+            if low[v] == order[v]:
+                while True:
+                    w = stack.pop()
+                    on_stack[w] = False
+                    labels[w] = label
+                    if w == v:
+                        break
+                label += 1
+    return labels
+
+
+class DependencyGraph:
+    """
+    The affects/depends_on graph over snapshot rows, as CSR arrays.
+    Transitive closures (downstream and upstream) are computed once per KPI
+    and memoized; traversal keeps a visited set, so cycles are harmless, and
+    cycles() reports them.
+    """
+
+    def __init__(self, snapshot):
+        self.size = snapshot.size
+        self.ids = snapshot.ids
+        self.indptr = snapshot.affects_indptr
+        self.indices = snapshot.affects_indices
+        self.rev_indptr, self.rev_indices = _transpose(self.indptr, self.indices, self.size)
+        self._downstream = {}
+        self._upstream = {}
+        self._components = None
+        self._lock = threading.Lock()
+
+    def same_structure(self, snapshot):
+        """True if the snapshot has the same KPIs and affects edges as this graph"""
+        return (np.array_equal(self.indptr, snapshot.affects_indptr)
+                and np.array_equal(self.indices, snapshot.affects_indices)
+                and np.array_equal(self.ids, snapshot.ids))
+
+    def affects(self, row):
+        return self.indices[self.indptr[row]:self.indptr[row + 1]]
+
+    def depends_on(self, row):
+        return self.rev_indices[self.rev_indptr[row]:self.rev_indptr[row + 1]]
+
+    def neighborhood(self, row, hops=1):
+        """Rows within hops steps downstream (affects) and upstream (depends_on), with distances"""
+        return {
+            'affects': within_hops(self.indptr, self.indices, row, hops),
+            'depends_on': within_hops(self.rev_indptr, self.rev_indices, row, hops),
+        }
+
+    def downstream(self, row):
+        """Rows transitively affected by row (excluding row unless it sits on a cycle)"""
+        closure = self._downstream.get(row)
+        if closure is None:
+            closure = self._reach(row, self.indptr, self.indices)
+            with self._lock:
+                self._downstream[row] = closure
+        return closure
+
+    def upstream(self, row):
+        """(rows, hops) for everything row transitively depends on, nearest first"""
+        found = self._upstream.get(row)
+        if found is None:
+            found = within_hops(self.rev_indptr, self.rev_indices, row, self.size)
+            with self._lock:
+                self._upstream[row] = found
+        return found
+
+    def components(self):
+        """Strongly connected component label per row, computed once per graph"""
+        if self._components is None:
+            labels = strongly_connected(self.indptr, self.indices, self.size)
+            sizes = np.bincount(labels, minlength=self.size)
+            sources = np.repeat(np.arange(self.size), np.diff(self.indptr))
+            cyclic = sizes[labels] > 1
+            cyclic[sources[self.indices == sources]] = True
+            self._components = (labels, cyclic)
+        return self._components
+
+    def cycle(self, row):
+        """Rows on a dependency cycle through row (row included), or an empty array"""
+        labels, cyclic = self.components()
+        if not cyclic[row]:
+            return np.empty(0, dtype=np.int64)
+        return np.flatnonzero(labels == labels[row])
+
+    def cycles(self):
+        """Every dependency cycle, as arrays of rows"""
+        labels, cyclic = self.components()
+        return [np.flatnonzero(labels == label) for label in np.unique(labels[cyclic])]
+
+    def closure(self, rows):
+        """The given rows plus everything they transitively affect"""
+        rows = np.asarray(rows, dtype=np.int64)
+        parts = [rows] + [self.downstream(int(row)) for row in rows]
+        return np.unique(np.concatenate(parts))
+
+    def _reach(self, start, indptr, indices):
+        seen = np.zeros(self.size, dtype=bool)
+        stack = list(indices[indptr[start]:indptr[start + 1]])
+        while stack:
+            row = stack.pop()
+            if seen[row]:
+                continue
+            seen[row] = True
+            stack.extend(indices[indptr[row]:indptr[row + 1]])
+        return np.flatnonzero(seen)
+
+
+def get_dependency_graph(onto, snapshot=None):
+    """
+    Return the DependencyGraph for the ontology's current snapshot (or the one
+    given). Value-only changes rebuild the snapshot but keep the previous graph
+    and its memoized closures, since the edges did not move.
+    """
+    store = get_snapshot_store(onto)
+
+    def build(snapshot):
+        graph = store.carried.get('dependency_graph')
+        if graph is None or not graph.same_structure(snapshot):
+            graph = store.carried['dependency_graph'] = DependencyGraph(snapshot)
+        return graph
+    return store.derive('dependency_graph', build, snapshot)
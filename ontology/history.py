@@ -0,0 +1,260 @@
+import contextlib
+import fcntl
+import os
+import re
+import threading
+
+import numpy as np
+
+# On-disk / in-memory record layout: seconds since epoch, value
+RECORD = np.dtype([('t', '<i8'), ('v', '<f8')])
+
+# TimePeriod individual -> default downsampling bucket
+PERIOD_BUCKETS = {'Weekly': 'W', 'Monthly': 'M', 'Quarterly': 'Q'}
+BUCKETS = ('D', 'W', 'M', 'Q', 'Y')
+AGGREGATES = ('mean', 'min', 'max', 'last')
+
+# Trend detection: slope over the last TREND_WINDOW points, relative to their mean
+TREND_WINDOW = 6
+TREND_TOLERANCE = 0.02
+
+
+def to_seconds(when):
+    """Convert a date/datetime/ISO string/np.datetime64 to epoch seconds"""
+    return int(np.datetime64(when, 's').astype(np.int64))
+
+
+def parse_period(text):
+    """Parse an ISO date/datetime string from user input to datetime64[s]; ValueError for anything else"""
+    if not isinstance(text, str):
+        raise ValueError(f"period must be an ISO date string, got {text!r}")
+    try:
+        when = np.datetime64(text, 's')
+    except ValueError:
+        when = np.datetime64('NaT')
+    if np.isnat(when):
+        raise ValueError(f"period {text!r} is not a date")
+    return when
+
+
+def compute_trend(values, window=TREND_WINDOW, tolerance=TREND_TOLERANCE):
+    """
+    Classify the recent direction of a series as 'up', 'down' or 'stable'.
+    Fits a least-squares line through the last `window` points; the change it
+    predicts across the window must exceed `tolerance` of the mean level.
+    Returns None when there are fewer than three points.
+    """
+    values = np.asarray(values, dtype=float)[-window:]
+    values = values[~np.isnan(values)]
+    if len(values) < 3:
+        return None
+    x = np.arange(len(values), dtype=float)
+    slope = np.polyfit(x, values, 1)[0]
+    scale = abs(values.mean()) or 1.0
+    change = slope * (len(values) - 1) / scale
+    if change > tolerance:
+        return 'up'
+    if change < -tolerance:
+        return 'down'
+    return 'stable'
+
+
+# Resolution of the bucket start dates downsample() returns, where it differs from the bucket
+BUCKET_UNITS = {'W': 'D', 'Q': 'M'}
+
+
+def _bucket_keys(seconds, bucket):
+    """Map epoch seconds to the start of their calendar bucket (ISO weeks start on Monday)"""
+    times = seconds.astype('datetime64[s]')
+    if bucket == 'Q':
+        months = times.astype('datetime64[M]').astype(np.int64)
+        return (months - months % 3).astype('datetime64[M]')
+    if bucket == 'W':
+        # datetime64[W] counts weeks from the epoch, a Thursday
+        days = times.astype('datetime64[D]').astype(np.int64)
+        return (days - (days + 3) % 7).astype('datetime64[D]')
+    return times.astype(f'datetime64[{bucket}]')
+
+
+class Series:
+    """
+    Append-optimized (timestamp, value) array for one KPI. In-memory series grow
+    by doubling; file-backed series append raw records to disk and are read
+    back through a read-only memory map, re-checked against the file on every
+    read so appends from other processes (gunicorn workers) show up.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._map = None
+        self._file = None  # (inode, size) the map was made for
+        if path is None:
+            self._buffer = np.empty(16, dtype=RECORD)
+            self._size = 0
+        else:
+            self._buffer = None
+            self._refresh()
+
+    def _refresh(self):
+        """Pick up the file's current size, remapping if it grew or was replaced"""
+        try:
+            stat = os.stat(self.path)
+            current = (stat.st_ino, stat.st_size)
+        except FileNotFoundError:
+            current = (None, 0)
+        if current != self._file:
+            self._file, self._map = current, None
+            self._size = current[1] // RECORD.itemsize
+
+    def __len__(self):
+        if self.path is not None:
+            self._refresh()
+        return self._size
+
+    def records(self):
+        """Structured array view of every record, sorted by time"""
+        if self.path is None:
+            return self._buffer[:self._size]
+        self._refresh()
+        if self._size == 0:
+            return np.empty(0, dtype=RECORD)
+        if self._map is None:
+            self._map = np.memmap(self.path, dtype=RECORD, mode='r', shape=(self._size,))
+        return self._map
+
+    def append(self, seconds, value):
+        """Add a point. Later timestamps append in O(1); an existing timestamp is overwritten."""
+        records = self.records()
+        if self._size and seconds <= records['t'][-1]:
+            i = int(np.searchsorted(records['t'], seconds))
+            if records['t'][i] == seconds:
+                self._overwrite(i, value)
+            else:
+                self._rewrite(np.insert(np.array(records), i, (seconds, value)))
+            return
+        if self.path is None:
+            if self._size == len(self._buffer):
+                self._buffer = np.resize(self._buffer, 2 * len(self._buffer))
+            self._buffer[self._size] = (seconds, value)
+        else:
+            with open(self.path, 'ab') as f:
+                f.write(np.array([(seconds, value)], dtype=RECORD).tobytes())
+        self._size += 1
+
+    def _overwrite(self, i, value):
+        if self.path is None:
+            self._buffer['v'][i] = value
+        else:
+            self._map = None
+            with open(self.path, 'r+b') as f:
+                f.seek(i * RECORD.itemsize)
+                f.write(np.array([(self.records()['t'][i], value)], dtype=RECORD).tobytes())
+
+    def _rewrite(self, records):
+        if self.path is None:
+            self._buffer = np.resize(records, max(16, 2 * len(records)))
+        else:
+            self._map = None
+            tmp_path = f"{self.path}.tmp"
+            records.tofile(tmp_path)
+            os.replace(tmp_path, self.path)
+        self._size = len(records)
+
+
+class HistoryStore:
+    """
+    Per-KPI time-series history. With a directory, each KPI's series lives in
+    '<directory>/<kpi id>.ts' and survives restarts, and every process using
+    the directory sees the others' appends (writes are serialized with a flock
+    on '<directory>/.lock'); without one it is kept in memory, per process.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _path(self, kpi_id):
+        if not self.directory:
+            return None
+        return os.path.join(self.directory, re.sub(r'[^\w.-]', '_', kpi_id) + '.ts')
+
+    def series(self, kpi_id, create=False):
+        """Return the Series for a KPI, or None if it has no history and create is False"""
+        series = self._series.get(kpi_id)
+        if series is None:
+            path = self._path(kpi_id)
+            if not create and (path is None or not os.path.exists(path)):
+                return None
+            series = self._series.setdefault(kpi_id, Series(path))
+        return series
+
+    @contextlib.contextmanager
+    def _exclusive(self):
+        """Hold the cross-process write lock (nothing to hold for in-memory history)"""
+        if not self.directory:
+            yield
+            return
+        with open(os.path.join(self.directory, '.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def append(self, kpi_id, when, value):
+        with self._lock, self._exclusive():
+            self.series(kpi_id, create=True).append(to_seconds(when), float(value))
+
+    def range(self, kpi_id, start=None, end=None):
+        """Return (times as datetime64[s], values) with start <= time <= end"""
+        series = self.series(kpi_id)
+        if series is None:
+            return np.empty(0, dtype='datetime64[s]'), np.empty(0)
+        with self._lock:
+            records = series.records()
+            lo = 0 if start is None else int(np.searchsorted(records['t'], to_seconds(start), 'left'))
+            hi = len(records) if end is None else int(np.searchsorted(records['t'], to_seconds(end), 'right'))
+            window = np.array(records[lo:hi])
+        return window['t'].astype('datetime64[s]'), window['v']
+
+    def downsample(self, kpi_id, bucket, start=None, end=None, how='mean'):
+        """Aggregate a range into calendar buckets (D/W/M/Q/Y); returns (bucket starts, values)"""
+        if bucket not in BUCKETS:
+            raise ValueError(f"Unknown bucket {bucket!r}; expected one of {', '.join(BUCKETS)}")
+        if how not in AGGREGATES:
+            raise ValueError(f"Unknown aggregate {how!r}; expected one of {', '.join(AGGREGATES)}")
+        times, values = self.range(kpi_id, start, end)
+        if len(times) == 0:
+            return np.empty(0, dtype=f'datetime64[{BUCKET_UNITS.get(bucket, bucket)}]'), values
+        keys = _bucket_keys(times.astype(np.int64), bucket)
+        starts = np.concatenate(([0], np.flatnonzero(keys[1:] != keys[:-1]) + 1))
+        if how == 'mean':
+            counts = np.diff(np.append(starts, len(values)))
+            aggregated = np.add.reduceat(values, starts) / counts
+        elif how == 'min':
+            aggregated = np.minimum.reduceat(values, starts)
+        elif how == 'max':
+            aggregated = np.maximum.reduceat(values, starts)
+        else:
+            aggregated = values[np.append(starts[1:], len(values)) - 1]
+        return keys[starts], aggregated
+
+    def trend(self, kpi_id, window=TREND_WINDOW):
+        series = self.series(kpi_id)
+        if series is None:
+            return None
+        with self._lock:
+            return compute_trend(series.records()['v'][-window:], window)
+
+    def refresh_trends(self, onto, window=TREND_WINDOW, kpis=None):
+        """Recompute trend_direction from history (for kpis, default all), writing only KPIs whose trend changed"""
+        changed = 0
+        for kpi in onto.KPI.instances() if kpis is None else kpis:
+            trend = self.trend(kpi.name, window)
+            if trend is not None and kpi.trend_direction != trend:
+                kpi.trend_direction = trend
+                changed += 1
+        return changed
@@ -0,0 +1,101 @@
+import numpy as np
+
+from .snapshot import get_snapshot_store, ALERT_LABELS, STATUS_NAMES
+
+
+def _group(codes, labels):
+    """Map each label to the sorted snapshot rows carrying its code."""
+    order = np.argsort(codes, kind='stable')
+    bounds = np.flatnonzero(np.diff(codes[order])) + 1
+    groups = {}
+    for rows in np.split(order, bounds):
+        if len(rows):
+            groups[labels[codes[rows[0]]]] = rows
+    return groups
+
+
+class KPIIndex:
+    """
+    Name/IRI -> KPI lookup plus department, category, time-period, status,
+    alert-level and trend row indexes for one snapshot. Rebuilt together with
+    the snapshot, so it is invalidated by any ontology mutation. Status is the
+    live classification of each KPI's values (the 'status' field); alert level
+    is the level the reasoner last stored (the 'alert_level' field), and is
+    'unknown' for KPIs it hasn't classified yet.
+    """
+
+    def __init__(self, onto, snapshot):
+        self.snapshot = snapshot
+        self.version = snapshot.version
+        self._world = onto.world
+        self._kpis = {}
+        self._iri_rows = {iri: i for i, iri in enumerate(snapshot.iris)}
+
+        self.by_department = _group(snapshot.dept_codes, snapshot.dept_names)
+        self.by_period = _group(snapshot.period_codes, snapshot.period_names)
+        entry_rows = np.repeat(np.arange(snapshot.size), np.diff(snapshot.category_indptr))
+        self.by_category = {
+            snapshot.category_names[code]: np.unique(entry_rows[snapshot.category_codes == code])
+            for code in np.unique(snapshot.category_codes)
+        }
+        self.by_status = _group(snapshot.status_codes, STATUS_NAMES)
+        self.by_alert_level = _group(snapshot.alert_codes, ALERT_LABELS)
+        trend_labels, trend_codes = np.unique(np.asarray(snapshot.trends, dtype=str), return_inverse=True)
+        self.by_trend = _group(trend_codes, trend_labels)
+
+        # Rows in KPI id order, for keyset pagination
+        self.id_order = np.argsort(np.asarray(snapshot.ids, dtype=str), kind='stable')
+        self.id_rank = np.empty(snapshot.size, dtype=np.int64)
+        self.id_rank[self.id_order] = np.arange(snapshot.size)
+
+    def row(self, key):
+        """Return the snapshot row for a KPI name or IRI, or None."""
+        i = self.snapshot.index.get(key)
+        return self._iri_rows.get(key) if i is None else i
+
+    def get(self, key):
+        """Return the KPI individual for a name or IRI, or None."""
+        i = self.row(key)
+        if i is None:
+            return None
+        kpi = self._kpis.get(i)
+        if kpi is None:
+            kpi = self._kpis[i] = self._world[self.snapshot.iris[i]]
+        return kpi
+
+    def rows(self, department=None, category=None, period=None, alert_level=None, trend=None, status=None):
+        """Return the sorted rows matching every given filter."""
+        rows = None
+        for groups, label in ((self.by_department, department),
+                              (self.by_category, category),
+                              (self.by_period, period),
+                              (self.by_status, status and status.lower()),
+                              (self.by_alert_level, alert_level and alert_level.lower()),
+                              (self.by_trend, trend)):
+            if label is None:
+                continue
+            matched = groups.get(label, np.empty(0, dtype=np.int64))
+            rows = matched if rows is None else np.intersect1d(rows, matched, assume_unique=True)
+        return np.arange(self.snapshot.size) if rows is None else rows
+
+    def page(self, rows, after=None, limit=None):
+        """
+        Order rows by KPI id and return (page rows, id of the last row or None
+        when nothing follows). after is the id the previous page ended with.
+        """
+        rows = rows[np.argsort(self.id_rank[rows])]
+        if after is not None:
+            ids = np.asarray(self.snapshot.ids, dtype=str)[rows]
+            rows = rows[np.searchsorted(ids, after, 'right'):]
+        if limit is None or len(rows) <= limit:
+            return rows, None
+        rows = rows[:limit]
+        return rows, str(self.snapshot.ids[rows[-1]])
+
+    def kpis(self, department=None, category=None, period=None):
+        return [self.get(self.snapshot.ids[i]) for i in self.rows(department, category, period)]
+
+
+def get_kpi_index(onto):
+    """Return the KPIIndex for the ontology's current snapshot."""
+    return get_snapshot_store(onto).derive('kpi_index', lambda snapshot: KPIIndex(onto, snapshot))
@@ -0,0 +1,241 @@
+"""
+Bulk KPI ingestion from CSV or Parquet extracts.
+
+Definition files have one row per KPI:
+    id, name, description, department, categories, unit, time_period,
+    actual_value, target_value, warning_threshold, critical_threshold,
+    weight, trend_direction, polarity
+(only id is required; categories are '|'-separated KPICategory class names).
+
+Value files have one row per measurement:
+    id, actual_value[, period]
+and are applied in file order, so the last row per KPI wins. Rows with an
+unknown id or a non-numeric value are skipped and reported. With a
+HistoryStore, rows that carry a period are also appended to the KPI's
+history (rows whose period is not a date are skipped as well) and
+trend_direction is recomputed from it.
+
+Usage:
+    python -m ontology.ingest definitions.csv [--values values.csv] [--store kpis.sqlite3] [--history DIR]
+"""
+import argparse
+import math
+import re
+
+from owlready2 import ThingClass
+
+from .models import create_hospital_kpi_ontology
+from .history import HistoryStore, parse_period, to_seconds
+from .snapshot import get_snapshot_store, ontology_version
+
+DEFAULT_CHUNKSIZE = 10000
+# Rejected value rows listed in the load summary
+MAX_REPORTED_REJECTS = 10
+
+FLOAT_COLUMNS = ('actual_value', 'target_value', 'warning_threshold', 'critical_threshold', 'weight')
+TEXT_COLUMNS = {'name': 'kpi_name', 'description': 'description', 'trend_direction': 'trend_direction',
+                'polarity': 'polarity'}
+
+
+def read_chunks(path, chunksize=DEFAULT_CHUNKSIZE):
+    """Yield DataFrame chunks from a CSV or Parquet file without loading it whole"""
+    import pandas as pd  # deferred so importing FileBuilder stays cheap
+    if str(path).endswith(('.parquet', '.pq')):
+        import pyarrow.parquet as pq  # optional, only needed for Parquet input
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunksize, dtype={'id': str})
+
+
+def _present(value):
+    return value is not None and not (isinstance(value, float) and math.isnan(value))
+
+
+def _entity_name(label):
+    """Turn a free-text label into a valid individual name"""
+    return re.sub(r'\W+', '_', str(label).strip()).strip('_')
+
+
+class BulkLoader:
+    """
+    Stream KPI rows into an ontology. Departments, categories, units and time
+    periods are resolved through lookup tables, so each is created at most once
+    and every KPI links to the same shared individual.
+    """
+
+    def __init__(self, onto, chunksize=DEFAULT_CHUNKSIZE, history=None):
+        self.onto = onto
+        self.chunksize = chunksize
+        self.history = history
+        self.kpis = {kpi.name: kpi for kpi in onto.KPI.instances()}
+        self.departments = {}
+        for dept in onto.Department.instances():
+            self.departments[dept.name] = dept
+            if dept.dept_name:
+                self.departments[dept.dept_name] = dept
+        self.units = {unit.name: unit for unit in onto.Unit.instances()}
+        self.periods = {period.name: period for period in onto.TimePeriod.instances()}
+        self.categories = {}
+        # (row number, id, reason) for every value row load_values() skipped
+        self.rejected = []
+
+    def load_definitions(self, path):
+        """Create or update KPI individuals from a definitions file; returns rows loaded"""
+        count = 0
+        with self.onto:
+            for chunk in read_chunks(path, self.chunksize):
+                for row in chunk.to_dict('records'):
+                    self._load_definition(row)
+                count += len(chunk)
+        return count
+
+    def load_values(self, path):
+        """
+        Apply actual values from a measurements file; returns rows applied.
+        Rows that cannot be applied (unknown id, non-numeric value, bad
+        period) are skipped without writing anything for them, and recorded in
+        self.rejected with their 1-based data row number. The new values and
+        trends are patched into the ontology's current snapshot, if any.
+        """
+        count = row = 0
+        applied = {}
+        store = get_snapshot_store(self.onto)
+        with store.write_lock, store.write_batch(), self.onto:
+            before = ontology_version(self.onto)
+            for chunk in read_chunks(path, self.chunksize):
+                periods = chunk['period'] if 'period' in chunk else [None] * len(chunk)
+                for kpi_id, value, period in zip(chunk['id'], chunk['actual_value'], periods):
+                    row += 1
+                    kpi = self.kpis.get(str(kpi_id))
+                    if kpi is None:
+                        self.rejected.append((row, kpi_id, "unknown KPI id"))
+                        continue
+                    if not _present(value):
+                        continue
+                    try:
+                        value = float(value)
+                    except (TypeError, ValueError):
+                        self.rejected.append((row, kpi_id, f"actual_value {value!r} is not a number"))
+                        continue
+                    seconds = None
+                    if self.history is not None and _present(period):
+                        try:
+                            seconds = to_seconds(parse_period(str(period)))
+                        except ValueError as e:
+                            self.rejected.append((row, kpi_id, str(e)))
+                            continue
+                    kpi.actual_value = value
+                    applied[kpi.name] = value
+                    if seconds is not None:
+                        self.history.append(kpi.name, seconds, value)
+                    count += 1
+            store.patch(before, actual=applied)
+            if self.history is not None:
+                before = ontology_version(self.onto)
+                self.history.refresh_trends(self.onto)
+                store.patch(before, trends={name: kpi.trend_direction or 'N/A' for name, kpi in self.kpis.items()})
+        if self.rejected:
+            listed = ', '.join(f"row {n} ({kpi_id}: {reason})"
+                               for n, kpi_id, reason in self.rejected[:MAX_REPORTED_REJECTS])
+            more = len(self.rejected) - MAX_REPORTED_REJECTS
+            print(f"⚠️ Skipped {len(self.rejected)} value row(s) in {path}: {listed}"
+                  + (f" and {more} more" if more > 0 else ""))
+        return count
+
+    def _load_definition(self, row):
+        kpi_id = row.get('id')
+        if not _present(kpi_id):
+            raise ValueError(f"KPI definition without id: {row}")
+        kpi_id = str(kpi_id)
+        kpi = self.kpis.get(kpi_id)
+        if kpi is None:
+            kpi = self.kpis[kpi_id] = self.onto.KPI(kpi_id)
+
+        for column, prop in TEXT_COLUMNS.items():
+            if _present(row.get(column)):
+                setattr(kpi, prop, str(row[column]))
+        for column in FLOAT_COLUMNS:
+            if _present(row.get(column)):
+                setattr(kpi, column, float(row[column]))
+
+        if _present(row.get('department')):
+            kpi.belongs_to_department = [self._department(row['department'])]
+        if _present(row.get('categories')):
+            kpi.belongs_to_category = [self._category(name) for name in str(row['categories']).split('|')]
+        if _present(row.get('unit')):
+            kpi.is_measured_in = [self._lookup(self.units, self.onto.Unit, row['unit'])]
+        if _present(row.get('time_period')):
+            kpi.has_time_period = [self._lookup(self.periods, self.onto.TimePeriod, row['time_period'])]
+
+    def _department(self, label):
+        label = str(label)
+        dept = self.departments.get(label)
+        if dept is None:
+            dept = self.onto.Department(_entity_name(label))
+            dept.dept_name = label
+            self.departments[label] = self.departments[dept.name] = dept
+        return dept
+
+    def _category(self, class_name):
+        class_name = class_name.strip()
+        category = self.categories.get(class_name)
+        if category is None:
+            cls = getattr(self.onto, class_name, None)
+            if not isinstance(cls, ThingClass) or not issubclass(cls, self.onto.KPICategory):
+                raise ValueError(f"Unknown KPI category: {class_name}")
+            name = f"{class_name}_Category"
+            category = self.onto[name] or cls(name)
+            self.categories[class_name] = category
+        return category
+
+    def _lookup(self, table, cls, label):
+        name = _entity_name(label)
+        individual = table.get(name)
+        if individual is None:
+            individual = table[name] = cls(name)
+        return individual
+
+
+class FileBuilder:
+    """Ontology builder for ontology.store: schema plus bulk-loaded KPI files"""
+
+    def __init__(self, definitions, values=None, chunksize=DEFAULT_CHUNKSIZE, history=None):
+        self.definitions = definitions
+        self.values = values
+        self.chunksize = chunksize
+        self.history = history
+        # Input files feed the persisted store's fingerprint
+        self.sources = [path for path in (definitions, values) if path]
+
+    def __call__(self, world=None):
+        onto = create_hospital_kpi_ontology(world)
+        loader = BulkLoader(onto, self.chunksize, self.history)
+        loader.load_definitions(self.definitions)
+        if self.values:
+            loader.load_values(self.values)
+        return onto
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk-load KPI definitions and values into the ontology")
+    parser.add_argument('definitions', help="CSV or Parquet file of KPI definitions")
+    parser.add_argument('--values', help="CSV or Parquet file of KPI measurements")
+    parser.add_argument('--store', help="write the populated ontology to this SQLite quadstore")
+    parser.add_argument('--history', help="append dated values to the KPI history in this directory")
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE)
+    args = parser.parse_args(argv)
+
+    history = HistoryStore(args.history) if args.history else None
+    builder = FileBuilder(args.definitions, args.values, args.chunksize, history)
+    if args.store:
+        from .store import build_store
+        build_store(args.store, builder)
+        print(f"✅ Wrote ontology quadstore to {args.store}")
+    else:
+        onto = builder()
+        print(f"✅ Loaded {len(list(onto.KPI.instances()))} KPIs")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,17 @@
 from owlready2 import *
 
-def create_hospital_kpi_ontology():
+ONTOLOGY_IRI = "http://hospital-kpis.org/hospital-kpi-ontology.owl"
+
+def create_hospital_kpi_ontology(world=None):
     """
     Create a comprehensive Hospital KPI ontology with all core classes,
     object properties, and data properties.
+    Args:
+        world: owlready2 World to create the ontology in (default_world if None)
     Returns:
         Ontology instance (owlready2.Ontology)
     """
-    onto = get_ontology("http://hospital-kpis.org/hospital-kpi-ontology.owl")
+    onto = (world or default_world).get_ontology(ONTOLOGY_IRI)
 
     with onto:
         # ==================== CLASSES ====================
@@ -147,6 +151,11 @@ def create_hospital_kpi_ontology():
             domain = [KPI]
             range = [str]
 
+        class polarity(DataProperty, FunctionalProperty):
+            domain = [KPI]
+            range = [str]
+            comment = ["higher_is_better or lower_is_better"]
+
         class dept_name(DataProperty, FunctionalProperty):
             domain = [Department]
             range = [str]
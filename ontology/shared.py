@@ -0,0 +1,333 @@
+import contextlib
+import fcntl
+import json
+import os
+import struct
+import tempfile
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from .snapshot import (KPISnapshot, SnapshotStore, ALERT_LEVEL_NAMES, PATCHABLE_FIELDS, next_layout,
+                       ontology_version)
+
+# Columns copied into shared memory; string columns become fixed-width unicode
+NUMERIC_FIELDS = (
+    'actual', 'target', 'warning', 'critical', 'weight',
+    'dept_codes', 'unit_codes', 'period_codes',
+    'category_indptr', 'category_codes', 'primary_category',
+    'alert_codes', 'status_codes', 'polarity',
+    'affects_indptr', 'affects_indices', 'comparable_indptr', 'comparable_indices',
+)
+STRING_FIELDS = (
+    'ids', 'iris', 'names', 'trends',
+    'dept_names', 'unit_names', 'period_names', 'category_names',
+)
+
+_HEADER = struct.Struct('<Q')  # manifest length
+_CONTROL = struct.Struct('<q')  # current generation
+_ALIGN = 64
+
+# Ontology properties the worker-side catch-up copies from a published snapshot
+SYNCED_PROPERTIES = (
+    ('actual', 'actual_value'), ('target', 'target_value'), ('warning', 'warning_threshold'),
+    ('critical', 'critical_threshold'), ('weight', 'weight'),
+)
+
+
+@contextlib.contextmanager
+def _untracked():
+    """Python < 3.13 registers every segment, and the tracker would then unlink it when this process exits"""
+    register, unregister = resource_tracker.register, resource_tracker.unregister
+    resource_tracker.register = resource_tracker.unregister = lambda name, rtype: None
+    try:
+        yield
+    finally:
+        resource_tracker.register, resource_tracker.unregister = register, unregister
+
+
+class _Segment(shared_memory.SharedMemory):
+    """
+    A SharedMemory whose mapping is released by reference counting rather
+    than by close(): the numpy arrays of a SharedSnapshot keep only the mmap
+    alive, and unmapping it under them (SharedMemory.__del__ does) makes
+    their next read crash the process, e.g. a carried PeerGroups comparing
+    against an older generation.
+    """
+
+    def close(self):
+        self._mmap = None
+        super().close()
+
+
+def _attach(name, create=False, size=0):
+    """
+    Attach to (or create) a segment without handing it to this process's
+    resource tracker: segments outlive the worker that published them and
+    are unlinked by name by later publishes and the master's close().
+    """
+    try:
+        return _Segment(name=name, create=create, size=size, track=False)
+    except TypeError:
+        with _untracked():
+            return _Segment(name=name, create=create, size=size)
+
+
+def _release(shm):
+    shm.close()
+    with _untracked():
+        shm.unlink()
+
+
+def _unlink(name):
+    try:
+        shm = _attach(name)
+    except FileNotFoundError:
+        return
+    _release(shm)
+
+
+def _create(name, size):
+    """Create a segment, replacing one left over from a crashed process"""
+    try:
+        return _attach(name, create=True, size=size)
+    except FileExistsError:
+        _unlink(name)
+        return _attach(name, create=True, size=size)
+
+
+class _SortedLookup:
+    """dict-like name -> row lookup backed by a sorted key array (no per-process dict)"""
+
+    def __init__(self, keys):
+        self.keys = keys
+        self.order = np.argsort(keys, kind='stable')
+        self.sorted = keys[self.order]
+
+    def get(self, key, default=None):
+        i = int(np.searchsorted(self.sorted, key))
+        if i < len(self.sorted) and self.sorted[i] == key:
+            return int(self.order[i])
+        return default
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        return len(self.keys)
+
+
+class SharedSnapshot(KPISnapshot):
+    """A KPISnapshot whose arrays are read-only views into a shared memory segment"""
+
+    def __init__(self, shm, generation):
+        self._shm = shm
+        self.version = generation
+        self.layout = next_layout()
+        self.derived = {}
+        (length,) = _HEADER.unpack_from(shm.buf, 0)
+        manifest = json.loads(bytes(shm.buf[_HEADER.size:_HEADER.size + length]))
+        for field, dtype, shape, offset in manifest:
+            array = np.ndarray(tuple(shape), dtype=np.dtype(dtype), buffer=shm.buf, offset=offset)
+            array.flags.writeable = False
+            setattr(self, field, array)
+        self.size = len(self.ids)
+        self.index = _SortedLookup(self.ids)
+
+
+def segment_name(prefix, generation):
+    return f"{prefix}-{generation}"
+
+
+class SnapshotPublisher:
+    """
+    Copy KPISnapshots into named shared memory segments and flip a small
+    control segment to the newest generation; readers pick it up on their
+    next request. The master creates the control segment (create=True); each
+    worker that writes publishes through its own publisher. Publishes from
+    different processes are serialized by exclusive(), and only the current
+    and previous generations are kept.
+    """
+
+    def __init__(self, prefix, create=True):
+        self.prefix = prefix
+        self.generation = 0
+        self._lock_path = os.path.join(tempfile.gettempdir(), f"{prefix}.lock")
+        if create:
+            self._control = _create(f"{prefix}-control", _CONTROL.size)
+            _CONTROL.pack_into(self._control.buf, 0, 0)
+        else:
+            self._control = _attach(f"{prefix}-control")
+
+    @contextlib.contextmanager
+    def exclusive(self):
+        """Hold the cross-process publish lock (a flock on a file next to the segments)"""
+        with open(self._lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def current(self):
+        return _CONTROL.unpack_from(self._control.buf, 0)[0]
+
+    def publish(self, snapshot):
+        """Copy a snapshot into a new segment and make it current; returns its generation. Call within exclusive()."""
+        columns = [(field, np.ascontiguousarray(getattr(snapshot, field))) for field in NUMERIC_FIELDS]
+        columns += [(field, np.asarray(getattr(snapshot, field), dtype=str)) for field in STRING_FIELDS]
+
+        layout, offset = [], 0
+        for field, array in columns:
+            layout.append((field, array.dtype.str, list(array.shape), offset))
+            offset += -(-array.nbytes // _ALIGN) * _ALIGN
+        # Data starts after the manifest, whose size depends on the offsets it lists
+        start = _ALIGN
+        while True:
+            manifest = [[field, dtype, shape, start + at] for field, dtype, shape, at in layout]
+            blob = json.dumps(manifest).encode()
+            if _HEADER.size + len(blob) <= start:
+                break
+            start = -(-(_HEADER.size + len(blob)) // _ALIGN) * _ALIGN
+
+        generation = self.current() + 1
+        shm = _create(segment_name(self.prefix, generation), max(start + offset, 1))
+        try:
+            _HEADER.pack_into(shm.buf, 0, len(blob))
+            shm.buf[_HEADER.size:_HEADER.size + len(blob)] = blob
+            for (field, array), (_, _, _, at) in zip(columns, manifest):
+                target = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf, offset=at)
+                target[...] = array
+                del target
+        finally:
+            shm.close()
+
+        # Single aligned 8-byte store: readers see either the old or the new generation
+        _CONTROL.pack_into(self._control.buf, 0, generation)
+        self.generation = generation
+        # Readers that already mapped it keep their mapping
+        _unlink(segment_name(self.prefix, generation - 2))
+        return generation
+
+    def close(self):
+        """Master only: unlink the control segment and the generations still kept"""
+        generation = self.current()
+        for name in (segment_name(self.prefix, generation), segment_name(self.prefix, generation - 1)):
+            _unlink(name)
+        _release(self._control)
+
+
+class SharedSnapshotStore(SnapshotStore):
+    """
+    Worker-side half. Snapshots are always built from this worker's own
+    ontology: with preload_app the master's warmed snapshot, index and
+    aggregates are shared copy-on-write, which measured smaller per worker
+    than serving mapped segments and rebuilding their derived state in every
+    process. Published generations carry writes between processes instead:
+    before serving, a worker takes up a newer generation by copying its
+    values, trends and alert levels into its ontology (and patching its
+    snapshot when only those changed), then lets the segment go.
+    """
+
+    def __init__(self, onto, prefix):
+        super().__init__(onto)
+        self.prefix = prefix
+        self._control = None
+        self._publisher = None
+        self._synced = 0  # generation this ontology is in line with
+
+    def _generation(self):
+        if self._control is None:
+            try:
+                self._control = _attach(f"{self.prefix}-control")
+            except FileNotFoundError:
+                return 0
+        return _CONTROL.unpack_from(self._control.buf, 0)[0]
+
+    def _catch_up(self):
+        """Take up the newest generation if this ontology hasn't yet"""
+        if self._generation() == self._synced:
+            return
+        # Syncing writes to the ontology, so it waits for writers like any other write
+        with self.write_lock, self._lock:
+            while True:
+                generation = self._generation()
+                if generation == self._synced:
+                    return
+                try:
+                    shm = _attach(segment_name(self.prefix, generation))
+                except FileNotFoundError:
+                    if self._generation() == generation:  # the publisher is gone
+                        return
+                    continue  # replaced by a newer publish in the meantime
+                try:
+                    self._sync(SharedSnapshot(shm, generation))
+                finally:
+                    shm.close()
+                self._synced = generation
+                return
+
+    def _sync(self, shared):
+        """Write the published values, trends and alert levels that differ into the local ontology"""
+        local = SnapshotStore.get(self)
+        rows = np.array([shared.index.get(kpi_id, -1) for kpi_id in local.ids], dtype=np.int64)
+        found = rows >= 0
+        mine, theirs = np.flatnonzero(found), rows[found]
+        levels = {code: name for name, code in ALERT_LEVEL_NAMES.items()}
+        before = ontology_version(self.onto)
+        patch = {}
+
+        def differ(a, b):
+            return ~((a == b) | (np.isnan(a) & np.isnan(b)))
+
+        with self.onto:
+            for field, prop in SYNCED_PROPERTIES:
+                a, b = getattr(local, field)[mine], getattr(shared, field)[theirs]
+                for i in np.flatnonzero(differ(a, b)):
+                    value = float(b[i])
+                    setattr(self.onto.world[local.iris[mine[i]]], prop, None if value != value else value)
+                    patch.setdefault(field, {})[str(local.ids[mine[i]])] = value
+            for i in np.flatnonzero(local.trends[mine] != shared.trends[theirs]):
+                trend = str(shared.trends[theirs[i]])
+                self.onto.world[local.iris[mine[i]]].trend_direction = None if trend == 'N/A' else trend
+                patch.setdefault('trends', {})[str(local.ids[mine[i]])] = trend
+            for i in np.flatnonzero(local.alert_codes[mine] != shared.alert_codes[theirs]):
+                code = int(shared.alert_codes[theirs[i]])
+                name = levels.get(code)
+                level = None if name is None else self.onto[f"{name}_Level"]
+                if name is not None and level is None:
+                    level = getattr(self.onto, name)(f"{name}_Level")
+                self.onto.world[local.iris[mine[i]]].has_alert_level = [] if level is None else [level]
+                patch.setdefault('alert_codes', {})[str(local.ids[mine[i]])] = code
+        # Threshold or weight changes (a reload) need the full rebuild
+        if patch and set(patch) <= set(PATCHABLE_FIELDS):
+            self.patch(before, **patch)
+
+    def version(self):
+        self._catch_up()
+        return super().version()
+
+    def get(self):
+        self._catch_up()
+        return super().get()
+
+    @contextlib.contextmanager
+    def writing(self):
+        """
+        Serialize a write with every other process's: take up the newest
+        generation first, then publish the ontology once the write is done.
+        """
+        if not self._generation():  # nothing published: a plain local write
+            yield
+            return
+        if self._publisher is None:
+            self._publisher = SnapshotPublisher(self.prefix, create=False)
+        with self._publisher.exclusive():
+            self._catch_up()
+            before = ontology_version(self.onto)
+            yield
+            # Held until the generation is recorded, so no later write counts as published
+            with self.write_lock:
+                if ontology_version(self.onto) != before:
+                    # The local snapshot, patched in place by value-only writes
+                    self._synced = self._publisher.publish(SnapshotStore.get(self))
@@ -0,0 +1,364 @@
+import contextlib
+import copy
+import itertools
+import threading
+import time
+import weakref
+
+import numpy as np
+
+from .thresholds import (ALERT_UNKNOWN, ALERT_NORMAL, ALERT_WARNING, ALERT_CRITICAL,
+                         POLARITY_LABELS, evaluate, infer_polarity, parse_polarity)
+
+ALERT_LEVEL_NAMES = {'Normal': ALERT_NORMAL, 'Warning': ALERT_WARNING, 'Critical': ALERT_CRITICAL}
+# Dashboard status labels indexed by alert code (ALERT_UNKNOWN picks the last)
+STATUS_NAMES = np.array(['good', 'warning', 'critical', 'unknown'], dtype=object)
+# Ontology alert level labels, indexed the same way
+ALERT_LABELS = np.array(['normal', 'warning', 'critical', 'unknown'], dtype=object)
+
+# Columns a value-only write can change without a rebuild (see KPISnapshot.patched)
+PATCHABLE_FIELDS = ('actual', 'trends', 'alert_codes')
+
+# Fields record() returns, followed by the extra fields project() can add
+RECORD_FIELDS = ('id', 'name', 'department', 'category', 'unit', 'actual', 'target', 'weight', 'status', 'trend')
+EXTRA_FIELDS = ('iri', 'categories', 'time_period', 'alert_level', 'warning', 'critical', 'polarity')
+
+_layouts = itertools.count(1)
+
+
+def next_layout():
+    """Return a fresh KPISnapshot.layout token"""
+    return next(_layouts)
+
+
+def ontology_version(onto):
+    """
+    Return a counter that moves whenever the ontology's quadstore is written.
+    Every owlready2 mutation ends up as a SQLite write, so the connection's
+    total_changes is a free, monotonic version number.
+    """
+    return onto.world.graph.db.total_changes
+
+
+def as_float(value):
+    """Convert a snapshot cell to a JSON-friendly float (NaN -> None)."""
+    value = float(value)
+    return None if value != value else value
+
+
+class _Codes:
+    """Assign small integer codes to repeated labels (departments, units, ...)."""
+
+    def __init__(self):
+        self.labels = []
+        self._codes = {}
+
+    def code(self, label):
+        code = self._codes.get(label)
+        if code is None:
+            code = self._codes[label] = len(self.labels)
+            self.labels.append(label)
+        return code
+
+    def table(self):
+        return np.array(self.labels + ['N/A'], dtype=object)
+
+
+class KPISnapshot:
+    """
+    Columnar, read-only view of every KPI individual in an ontology.
+    Row i of every array describes the same KPI; string columns are stored as
+    integer codes into small label tables. layout identifies the row order:
+    snapshots that share it (see follow()) have the same KPIs in the same rows.
+    """
+
+    def __init__(self, onto, version=None):
+        started = time.perf_counter()
+        self.version = ontology_version(onto) if version is None else version
+        self.layout = next_layout()
+        kpis = list(onto.KPI.instances())
+        n = self.size = len(kpis)
+        self.position = {kpi.storid: i for i, kpi in enumerate(kpis)}
+        self.derived = {}
+
+        self.ids = np.array([kpi.name for kpi in kpis], dtype=object)
+        self.index = {name: i for i, name in enumerate(self.ids)}
+        self.iris = np.array([kpi.iri for kpi in kpis], dtype=object)
+        self.names = self.ids.copy()
+        for kpi, value in onto.kpi_name.get_relations():
+            i = self.position.get(kpi.storid)
+            if i is not None:
+                self.names[i] = str(value)
+        self.trends = np.full(n, 'N/A', dtype=object)
+        for kpi, value in onto.trend_direction.get_relations():
+            i = self.position.get(kpi.storid)
+            if i is not None:
+                self.trends[i] = str(value)
+
+        self.actual = self._float_column(onto.actual_value)
+        self.target = self._float_column(onto.target_value)
+        self.warning = self._float_column(onto.warning_threshold)
+        self.critical = self._float_column(onto.critical_threshold)
+        self.weight = self._float_column(onto.weight)
+
+        self.dept_codes, self.dept_names = self._object_column(
+            onto.belongs_to_department, lambda dept: str(dept.dept_name or dept.name))
+        self.unit_codes, self.unit_names = self._object_column(
+            onto.is_measured_in, lambda unit: unit.name)
+        self.period_codes, self.period_names = self._object_column(
+            onto.has_time_period, lambda period: period.name)
+
+        # Categories are multi-valued: CSR layout plus the first one for display
+        categories = _Codes()
+        per_kpi = [[] for _ in range(n)]
+        for kpi, category in onto.belongs_to_category.get_relations():
+            i = self.position.get(kpi.storid)
+            if i is not None:
+                per_kpi[i].append(categories.code(category.is_a[0].name))
+        self.category_indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum([len(codes) for codes in per_kpi], out=self.category_indptr[1:])
+        self.category_codes = np.array([c for codes in per_kpi for c in codes], dtype=np.int32)
+        self.category_names = categories.table()
+        missing = len(categories.labels)
+        self.primary_category = np.array([codes[0] if codes else missing for codes in per_kpi], dtype=np.int32)
+
+        self.alert_codes = np.full(n, ALERT_UNKNOWN, dtype=np.int8)
+        for kpi, level in onto.has_alert_level.get_relations():
+            i = self.position.get(kpi.storid)
+            if i is not None:
+                self.alert_codes[i] = ALERT_LEVEL_NAMES.get(level.is_a[0].name, ALERT_UNKNOWN)
+
+        # One direction-aware classification per version, shared by every layer (see thresholds.py)
+        explicit = np.zeros(n, dtype=np.int8)
+        if onto.polarity is not None:  # absent from quadstores built before the property existed
+            for kpi, value in onto.polarity.get_relations():
+                i = self.position.get(kpi.storid)
+                if i is not None:
+                    explicit[i] = parse_polarity(value)
+        self.polarity = infer_polarity(self.target, self.warning, self.critical, explicit)
+        self.status_codes = evaluate(self.actual, self.target, self.warning, self.critical, self.polarity)
+
+        # KPI -> KPI relations as CSR adjacency (row i's targets are indices[indptr[i]:indptr[i+1]])
+        self.affects_indptr, self.affects_indices = self._edge_column(
+            (onto.affects, False), (onto.depends_on, True))
+        self.comparable_indptr, self.comparable_indices = self._edge_column(
+            (onto.comparable_to, False), (onto.comparable_to, True))
+        self.build_seconds = time.perf_counter() - started
+
+    def _float_column(self, prop):
+        values = np.full(self.size, np.nan)
+        for kpi, value in prop.get_relations():
+            i = self.position.get(kpi.storid)
+            if i is not None:
+                values[i] = float(value)
+        values.flags.writeable = False
+        return values
+
+    def _object_column(self, prop, label):
+        codes = _Codes()
+        column = np.full(self.size, -1, dtype=np.int32)
+        for kpi, value in prop.get_relations():
+            i = self.position.get(kpi.storid)
+            if i is not None and column[i] < 0:
+                column[i] = codes.code(label(value))
+        column[column < 0] = len(codes.labels)
+        return column, codes.table()
+
+    def _edge_column(self, *props):
+        """Collect (prop, reversed) relations into deduplicated CSR arrays"""
+        edges = set()
+        for prop, reverse in props:
+            for a, b in prop.get_relations():
+                i, j = self.position.get(a.storid), self.position.get(b.storid)
+                if i is not None and j is not None:
+                    edges.add((j, i) if reverse else (i, j))
+        edges = np.array(sorted(edges), dtype=np.int64).reshape(-1, 2)
+        indptr = np.zeros(self.size + 1, dtype=np.int64)
+        np.cumsum(np.bincount(edges[:, 0], minlength=self.size), out=indptr[1:])
+        return indptr, edges[:, 1].copy()
+
+    def patched(self, version, **columns):
+        """
+        Return a copy at version with some KPIs' actual values, trends or alert
+        codes replaced, given as {column: {kpi id: value}} (see
+        PATCHABLE_FIELDS). Only the changed columns are copied, status is
+        re-evaluated when actual values change, and the rows keep their layout.
+        """
+        snapshot = copy.copy(self)
+        snapshot.version = version
+        snapshot.derived = {}
+        for field, changes in columns.items():
+            if field not in PATCHABLE_FIELDS:
+                raise ValueError(f"{field} cannot be patched")
+            column = getattr(self, field).copy()
+            rows = np.array([self.index[kpi_id] for kpi_id in changes], dtype=np.int64)
+            column[rows] = list(changes.values())
+            setattr(snapshot, field, column)
+        if 'actual' in columns:
+            snapshot.status_codes = evaluate(snapshot.actual, snapshot.target, snapshot.warning,
+                                             snapshot.critical, snapshot.polarity)
+        return snapshot
+
+    def follow(self, previous):
+        """Take over previous's layout when the rows hold the same KPIs; returns self"""
+        if previous is not None and np.array_equal(previous.ids, self.ids):
+            self.layout = previous.layout
+        return self
+
+    # ------------------------------------------------------------
+    # Serialization
+    # ------------------------------------------------------------
+    def record(self, i):
+        """Return the /api/kpis representation of row i."""
+        return {
+            'id': self.ids[i],
+            'name': self.names[i],
+            'department': self.dept_names[self.dept_codes[i]],
+            'category': self.category_names[self.primary_category[i]],
+            'unit': self.unit_names[self.unit_codes[i]],
+            'actual': as_float(self.actual[i]),
+            'target': as_float(self.target[i]),
+            'weight': as_float(self.weight[i]),
+            'status': STATUS_NAMES[self.status_codes[i]],
+            'trend': self.trends[i],
+        }
+
+    def records(self, rows=None):
+        rows = range(self.size) if rows is None else rows
+        return [self.record(i) for i in rows]
+
+    def project(self, rows, fields=RECORD_FIELDS):
+        """Column-wise records() for the given rows, limited to fields (see RECORD_FIELDS/EXTRA_FIELDS)."""
+        rows = np.asarray(rows, dtype=np.int64)
+        columns = [self._field(field, rows) for field in fields]
+        return [dict(zip(fields, values)) for values in zip(*columns)]
+
+    def _field(self, field, rows):
+        floats = {'actual': self.actual, 'target': self.target, 'weight': self.weight,
+                  'warning': self.warning, 'critical': self.critical}
+        if field in floats:
+            values = floats[field][rows]
+            return np.where(np.isnan(values), None, values).tolist()
+        if field == 'categories':
+            names = self.category_names
+            return [[str(names[c]) for c in self.category_codes[self.category_indptr[i]:self.category_indptr[i + 1]]]
+                    for i in rows]
+        labelled = {
+            'department': (self.dept_names, self.dept_codes),
+            'category': (self.category_names, self.primary_category),
+            'unit': (self.unit_names, self.unit_codes),
+            'time_period': (self.period_names, self.period_codes),
+            'status': (STATUS_NAMES, self.status_codes),
+            'alert_level': (ALERT_LABELS, self.alert_codes),
+            'polarity': (POLARITY_LABELS, self.polarity),
+        }
+        if field in labelled:
+            names, codes = labelled[field]
+            return [str(name) for name in np.asarray(names, dtype=object)[codes[rows]]]
+        plain = {'id': self.ids, 'name': self.names, 'iri': self.iris, 'trend': self.trends}
+        return [str(value) for value in plain[field][rows]]
+
+
+class SnapshotStore:
+    """Hand out the current KPISnapshot, rebuilding it only after the ontology changes."""
+
+    def __init__(self, onto):
+        self.onto = onto
+        # Re-entrant so a writer can patch() inside its write_batch()
+        self._lock = threading.RLock()
+        # Serializes every write to the ontology: reasoner write-backs, value
+        # updates, bulk loads and SharedSnapshotStore syncs. Re-entrant so a caller
+        # applying a batch can hold it across the follow-up incremental run. Take
+        # it before _lock (write_batch), never after.
+        self.write_lock = threading.RLock()
+        self._snapshot = None
+        # State a consumer carries from one snapshot's derived value to the
+        # next (e.g. the previous BenchmarkTable); dropped with the store.
+        self.carried = {}
+
+    def version(self):
+        """Cheap token that changes whenever get() would return a different snapshot"""
+        return ontology_version(self.onto)
+
+    def get(self):
+        version = ontology_version(self.onto)
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is None or snapshot.version != version:
+                snapshot = self._snapshot = KPISnapshot(self.onto, version).follow(snapshot)
+            return snapshot
+
+    def nbytes(self):
+        """Bytes held by the current snapshot's numpy columns (0 before the first build)"""
+        snapshot = self._snapshot
+        if snapshot is None:
+            return 0
+        return sum(value.nbytes for value in vars(snapshot).values() if isinstance(value, np.ndarray))
+
+    @contextlib.contextmanager
+    def write_batch(self):
+        """Hold off snapshot rebuilds while a batch of writes is applied, so no snapshot sees half of it."""
+        with self._lock:
+            yield
+
+    def patch(self, before, **columns):
+        """
+        Follow a write that only changed KPIs' actual values, trends or alert
+        levels ({column: {kpi id: new value}}, see KPISnapshot.patched): if the
+        snapshot was current at version before, swap in a patched copy rather
+        than rebuilding it from the ontology on the next get(). Call with the
+        writer's locks still held, so that before..now covers only this write.
+        """
+        with self._lock:
+            snapshot = self._snapshot
+            if (snapshot is None or snapshot.version != before
+                    or any(kpi_id not in snapshot.index for changes in columns.values() for kpi_id in changes)):
+                return False
+            self._snapshot = snapshot.patched(ontology_version(self.onto), **columns)
+            return True
+
+    @contextlib.contextmanager
+    def writing(self):
+        """Wrap a write that other processes must see (see SharedSnapshotStore); nothing to do here."""
+        yield
+
+    def derive(self, key, build, snapshot=None):
+        """Return build(snapshot) for the current snapshot (or the one given), computed once per version."""
+        if snapshot is None:
+            snapshot = self.get()
+        value = snapshot.derived.get(key)
+        if value is None:
+            value = snapshot.derived[key] = build(snapshot)
+        return value
+
+
+_stores = weakref.WeakKeyDictionary()
+_stores_lock = threading.Lock()
+
+
+def get_snapshot_store(onto):
+    """Return the SnapshotStore shared by every consumer of this ontology."""
+    with _stores_lock:
+        store = _stores.get(onto)
+        if store is None:
+            store = _stores[onto] = SnapshotStore(onto)
+        return store
+
+
+def discard_snapshot_store(onto):
+    """
+    Forget the ontology's SnapshotStore once the ontology is closed (e.g. an
+    evicted tenant). The store, and what its snapshot derived, refer back to
+    the ontology, so the weak key alone would never let it be collected.
+    """
+    with _stores_lock:
+        _stores.pop(onto, None)
+
+
+def set_snapshot_store(onto, store):
+    """Make every consumer of this ontology read snapshots from store (e.g. a SharedSnapshotStore)."""
+    with _stores_lock:
+        _stores[onto] = store
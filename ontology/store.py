@@ -0,0 +1,134 @@
+import hashlib
+import os
+import sqlite3
+
+from owlready2 import World
+from owlready2.sparql.parser import CURRENT_TRANSLATOR
+
+from .models import ONTOLOGY_IRI
+from .data import load_kpi_data
+
+# Files whose contents define the populated ontology; editing any of them
+# invalidates a persisted quadstore.
+SOURCE_FILES = [
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+    for name in ('models.py', 'data.py')
+]
+
+_META_TABLE = 'hospital_kpi_store_meta'
+
+
+def source_fingerprint(builder=load_kpi_data):
+    """
+    Hash the ontology source files, the builder's name and any input files it
+    declares (builder.sources) into a store fingerprint.
+    """
+    name = getattr(builder, '__qualname__', type(builder).__qualname__)
+    digest = hashlib.sha256(f"{builder.__module__}.{name}".encode())
+    for path in SOURCE_FILES + list(getattr(builder, 'sources', ())):
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def stored_fingerprint(path):
+    """Return the fingerprint recorded in a persisted quadstore, or None"""
+    if not os.path.exists(path):
+        return None
+    try:
+        db = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            row = db.execute(f"SELECT fingerprint FROM {_META_TABLE}").fetchone()
+        finally:
+            db.close()
+    except sqlite3.Error:
+        return None
+    return row[0] if row else None
+
+
+def build_store(path, builder=load_kpi_data):
+    """
+    Populate a fresh in-memory world and write it to an SQLite quadstore at path.
+    The file is written under a temporary name and renamed into place, so
+    concurrently booting workers never see a half-written store.
+    """
+    world = World()
+    builder(world)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    world.set_backend(filename=tmp_path, exclusive=False)
+    world.graph.db.execute(f"CREATE TABLE {_META_TABLE} (fingerprint TEXT)")
+    world.graph.db.execute(f"INSERT INTO {_META_TABLE} VALUES (?)", (source_fingerprint(builder),))
+    world.save()
+    world.close()
+    os.replace(tmp_path, path)
+
+
+def open_store(path):
+    """
+    Open a persisted quadstore. The file is copied into a private in-memory
+    SQLite database with the backup API, so each worker can write alert levels
+    without touching the shared file.
+    """
+    memory = sqlite3.connect(":memory:", check_same_thread=False)
+    source = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        source.backup(memory)
+    finally:
+        source.close()
+    world = World(filename=None)
+    world.set_backend(filename=path, connection=memory, exclusive=False)
+    return world.get_ontology(ONTOLOGY_IRI)
+
+
+def close_store(onto):
+    """
+    Close an ontology opened with open_store() so it can be collected.
+    owlready2 caches prepared SPARQL queries (used by instances()) per World
+    in a class-wide LRU, and leaves the last query translator in a context
+    variable; either would otherwise keep the closed World alive. Only the
+    calling thread's context can be cleared, so another thread that last
+    queried this World keeps it until its next query.
+    """
+    translator = CURRENT_TRANSLATOR.get(None)
+    if translator is not None and translator.world is onto.world:
+        CURRENT_TRANSLATOR.set(None)
+    onto.world.close()
+    prepare = getattr(World, '_prepare_sparql', None)
+    if hasattr(prepare, 'cache_clear'):
+        prepare.cache_clear()
+
+
+def save_store(onto, path):
+    """
+    Write an ontology opened with open_store() back to the quadstore at path,
+    through a temporary file renamed into place like build_store().
+    """
+    onto.world.save()
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    target = sqlite3.connect(tmp_path)
+    try:
+        onto.world.graph.db.backup(target)
+    finally:
+        target.close()
+    os.replace(tmp_path, path)
+
+
+def store_bytes(onto):
+    """Size of the ontology's SQLite quadstore (the in-memory copy, for open_store() ontologies)"""
+    db = onto.world.graph.db
+    return db.execute("PRAGMA page_count").fetchone()[0] * db.execute("PRAGMA page_size").fetchone()[0]
+
+
+def load_persistent_kpi_data(path, builder=load_kpi_data, rebuild=False):
+    """
+    Return the populated ontology from the quadstore at path, rebuilding the
+    store first if it is missing or was built from different source data.
+    """
+    if rebuild or stored_fingerprint(path) != source_fingerprint(builder):
+        print(f"🏗️ Building ontology quadstore at {path}...")
+        build_store(path, builder)
+    return open_store(path)
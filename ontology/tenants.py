@@ -0,0 +1,256 @@
+"""
+Per-hospital ontologies for a network of facilities.
+
+Each tenant's ontology lives in its own quadstore, '<directory>/<tenant>.sqlite3'
+(built with build_store() or `python -m ontology.ingest ... --store`), with its
+history under '<directory>/<tenant>.history/'. A TenantRegistry opens a tenant
+on first use in a World of its own, keeps recently used tenants in an LRU
+bounded by a memory budget, and evicts cold ones back to their quadstore.
+
+Each worker holds its own copies. A tenant is written back on eviction only
+if its KPI data changed, under a lock file next to the quadstore, and only
+if no other worker has saved it since this copy was opened; otherwise this
+worker's changes are dropped (and reported) rather than overwriting newer data.
+"""
+import contextlib
+import fcntl
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from .history import HistoryStore
+from .snapshot import get_snapshot_store, discard_snapshot_store, ontology_version
+from .store import build_store, close_store, open_store, save_store, store_bytes
+
+TENANT_ID = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_-]{0,63}$')
+
+DEFAULT_MEMORY_BUDGET = 512 * 2 ** 20
+
+
+class UnknownTenant(KeyError):
+    """No quadstore (and no builder) for this tenant id"""
+
+
+def _stamp(path):
+    """Identify the quadstore file on disk; every save_store() replaces it"""
+    stat = os.stat(path)
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+@contextlib.contextmanager
+def _locked(path):
+    """Hold an exclusive lock on '<path>.lock' while a tenant's quadstore is built, opened or saved"""
+    with open(f"{path}.lock", 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+class Tenant:
+    """One hospital's loaded ontology and history, plus what the registry's setup hook attached"""
+
+    def __init__(self, tenant_id, ontology, history, path, stamp=None):
+        self.id = tenant_id
+        self.ontology = ontology
+        self.history = history
+        self.path = path
+        # The quadstore file this copy was opened from (see _stamp)
+        self.stamp = stamp
+        self.mark_clean()
+        self.app = None
+        # Callables run before the tenant is saved and closed (e.g. stopping its job pool)
+        self.on_close = []
+        self.refs = 0
+        self.nbytes = 0
+        self.last_used = time.monotonic()
+
+    def mark_clean(self):
+        """Take the current KPI data as what the quadstore holds"""
+        self.loaded_version = ontology_version(self.ontology)
+        self.loaded_digest = self._digest()
+
+    def _digest(self):
+        """Hash of every KPI's values, trend and alert level"""
+        snapshot = get_snapshot_store(self.ontology).get()
+        digest = hashlib.sha1()
+        for column in (snapshot.ids, snapshot.trends):
+            digest.update('\0'.join(map(str, column)).encode())
+        for column in (snapshot.actual, snapshot.target, snapshot.warning, snapshot.critical,
+                       snapshot.weight, snapshot.alert_codes):
+            digest.update(np.ascontiguousarray(column).tobytes())
+        return digest.hexdigest()
+
+    @property
+    def dirty(self):
+        """Whether the KPI data changed since the tenant was loaded and set up"""
+        return ontology_version(self.ontology) != self.loaded_version and self._digest() != self.loaded_digest
+
+    def measure(self):
+        """Approximate resident size: the in-memory quadstore plus the snapshot's columns"""
+        self.nbytes = store_bytes(self.ontology) + get_snapshot_store(self.ontology).nbytes()
+        return self.nbytes
+
+
+class TenantRegistry:
+    """
+    Lazily loaded tenants in an LRU bounded by memory_budget bytes. Tenants in
+    use (acquire()d and not yet release()d) are never evicted, nor is the most
+    recently used one, so the budget is a target rather than a hard cap.
+    builder(tenant_id), if given, returns an ontology builder for tenants that
+    have no quadstore yet; setup(tenant) runs once after each load, and what
+    it writes (e.g. the warm-up's alert levels) is not saved unless the data
+    changes afterwards.
+    """
+
+    def __init__(self, directory, memory_budget=DEFAULT_MEMORY_BUDGET, builder=None, setup=None):
+        self.directory = directory
+        self.memory_budget = memory_budget
+        self.builder = builder
+        self.setup = setup
+        os.makedirs(directory, exist_ok=True)
+        self._loaded = OrderedDict()
+        self._load_locks = {}
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.evictions = 0
+
+    def path(self, tenant_id):
+        return os.path.join(self.directory, f"{tenant_id}.sqlite3")
+
+    def tenants(self):
+        """Ids of every tenant with a quadstore on disk"""
+        return sorted(name[:-len('.sqlite3')] for name in os.listdir(self.directory)
+                      if name.endswith('.sqlite3') and TENANT_ID.match(name[:-len('.sqlite3')]))
+
+    def loaded(self):
+        """Ids of the tenants currently in memory, least recently used first"""
+        with self._lock:
+            return list(self._loaded)
+
+    def memory(self):
+        with self._lock:
+            return sum(tenant.nbytes for tenant in self._loaded.values())
+
+    def acquire(self, tenant_id):
+        """Return the loaded Tenant, opening it if needed; pair every call with release()"""
+        if not isinstance(tenant_id, str) or not TENANT_ID.match(tenant_id):
+            raise UnknownTenant(tenant_id)
+        with self._lock:
+            tenant = self._loaded.get(tenant_id)
+            if tenant is not None:
+                return self._use(tenant)
+            load_lock = self._load_locks.setdefault(tenant_id, threading.Lock())
+        with load_lock:
+            with self._lock:
+                tenant = self._loaded.get(tenant_id)
+                if tenant is not None:
+                    return self._use(tenant)
+            tenant = self._load(tenant_id)
+            with self._lock:
+                self._loaded[tenant_id] = tenant
+                self._use(tenant)
+        self._evict_over_budget()
+        return tenant
+
+    def release(self, tenant):
+        tenant.measure()
+        with self._lock:
+            tenant.refs -= 1
+            tenant.last_used = time.monotonic()
+        self._evict_over_budget()
+
+    def _use(self, tenant):
+        self._loaded.move_to_end(tenant.id)
+        tenant.refs += 1
+        return tenant
+
+    def _load(self, tenant_id):
+        path = self.path(tenant_id)
+        if not os.path.exists(path) and self.builder is None:
+            raise UnknownTenant(tenant_id)
+        with _locked(path):
+            if not os.path.exists(path):
+                builder = self.builder(tenant_id)
+                if builder is None:
+                    raise UnknownTenant(tenant_id)
+                print(f"🏗️ Building quadstore for hospital {tenant_id}...")
+                build_store(path, builder)
+            started = time.perf_counter()
+            stamp = _stamp(path)
+            ontology = open_store(path)
+        tenant = Tenant(tenant_id, ontology, HistoryStore(os.path.join(self.directory, f"{tenant_id}.history")),
+                        path, stamp)
+        if self.setup is not None:
+            self.setup(tenant)
+            tenant.mark_clean()
+        tenant.measure()
+        self.loads += 1
+        print(f"🏥 Loaded hospital {tenant_id} in {time.perf_counter() - started:.2f}s "
+              f"({tenant.nbytes / 2 ** 20:.1f} MB)")
+        return tenant
+
+    def _evict_over_budget(self):
+        victims = []
+        with self._lock:
+            total = sum(tenant.nbytes for tenant in self._loaded.values())
+            # Least recently used first, never the most recent one
+            for tenant in list(self._loaded.values())[:-1]:
+                if total <= self.memory_budget:
+                    break
+                load_lock = self._load_locks[tenant.id]
+                # A busy load lock means the tenant is being (re)opened; leave it for next time
+                if tenant.refs or not load_lock.acquire(blocking=False):
+                    continue
+                del self._loaded[tenant.id]
+                total -= tenant.nbytes
+                victims.append((tenant, load_lock))
+        for tenant, load_lock in victims:
+            try:
+                self._close(tenant)
+            finally:
+                load_lock.release()
+
+    def evict(self, tenant_id):
+        """Save and close one idle tenant; returns False if it is not loaded or still in use"""
+        with self._lock:
+            tenant = self._loaded.get(tenant_id)
+            load_lock = self._load_locks.get(tenant_id)
+            if tenant is None or tenant.refs or not load_lock.acquire(blocking=False):
+                return False
+            del self._loaded[tenant_id]
+        try:
+            self._close(tenant)
+        finally:
+            load_lock.release()
+        return True
+
+    def close(self):
+        """Save and close every idle tenant (e.g. at worker exit)"""
+        for tenant_id in self.loaded():
+            self.evict(tenant_id)
+
+    def _close(self, tenant):
+        try:
+            for hook in tenant.on_close:
+                hook()
+            if tenant.dirty:
+                with _locked(tenant.path):
+                    if os.path.exists(tenant.path) and _stamp(tenant.path) != tenant.stamp:
+                        print(f"⚠️ Hospital {tenant.id} was saved by another worker since it was loaded; "
+                              f"dropping this worker's changes instead of overwriting it")
+                    else:
+                        save_store(tenant.ontology, tenant.path)
+        except Exception as e:
+            print(f"❌ Saving hospital {tenant.id} failed: {e}")
+        finally:
+            close_store(tenant.ontology)
+            discard_snapshot_store(tenant.ontology)
+        self.evictions += 1
+        print(f"💤 Evicted hospital {tenant.id}")
@@ -0,0 +1,86 @@
+"""
+The one threshold model every layer classifies KPIs with.
+
+Each KPI has a polarity: +1 when higher values are better (operating margin,
+satisfaction), -1 when lower are (wait times, infection rates). It comes from
+the KPI's `polarity` property when set, otherwise from the side of target its
+critical (else warning) threshold sits on, otherwise higher.
+
+A KPI is critical when its value is strictly beyond its critical threshold
+in the bad direction, warning when beyond its warning threshold, and normal
+otherwise. A missing warning threshold falls back to the target, and a
+missing critical threshold to 95% attainment of the target, which keeps the
+old 100%/95% ratio cutoffs for KPIs that only have a target.
+"""
+import numpy as np
+
+# Alert level codes (stored in KPISnapshot.alert_codes and status_codes)
+ALERT_UNKNOWN = -1
+ALERT_NORMAL = 0
+ALERT_WARNING = 1
+ALERT_CRITICAL = 2
+
+HIGHER_IS_BETTER = 1
+LOWER_IS_BETTER = -1
+# Values of the `polarity` data property
+POLARITY_NAMES = {'higher_is_better': HIGHER_IS_BETTER, 'lower_is_better': LOWER_IS_BETTER}
+# Labels indexed by polarity (+1 -> [1], -1 -> [-1])
+POLARITY_LABELS = np.array([None, 'higher_is_better', 'lower_is_better'], dtype=object)
+
+# Attainment below this is critical when a KPI has no critical threshold
+CRITICAL_ATTAINMENT = 0.95
+
+
+def parse_polarity(value):
+    """HIGHER_IS_BETTER / LOWER_IS_BETTER for a polarity property value, 0 when unset or unrecognised"""
+    if value is None:
+        return 0
+    return POLARITY_NAMES.get(str(value).strip().lower().replace('-', '_').replace(' ', '_'), 0)
+
+
+def infer_polarity(target, warning, critical, explicit=None):
+    """
+    Per-KPI polarity: explicit (0 where unset), else lower-is-better when the
+    critical (else warning) threshold sits above target, else higher.
+    """
+    bound = np.where(np.isnan(critical), warning, critical)
+    inferred = np.where(bound > target, LOWER_IS_BETTER, HIGHER_IS_BETTER).astype(np.int8)
+    if explicit is None:
+        return inferred
+    return np.where(explicit != 0, explicit, inferred).astype(np.int8)
+
+
+def attainment(actual, target, polarity):
+    """actual/target where higher is better, target/actual where lower is (1 at zero); NaN when unknown"""
+    actual = np.asarray(actual, dtype=float)
+    target = np.asarray(target, dtype=float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(polarity > 0, actual / target, np.where(actual > 0, target / actual, 1.0))
+
+
+def worse(actual, bound, polarity):
+    """True where actual is strictly beyond bound in the bad direction"""
+    with np.errstate(invalid='ignore'):
+        return np.where(polarity > 0, actual < bound, actual > bound)
+
+
+def effective_bounds(target, warning, critical, polarity):
+    """The (warning, critical) bounds KPIs are classified against, with the fallbacks above filled in"""
+    target = np.asarray(target, dtype=float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        fallback = np.where(polarity > 0, target * CRITICAL_ATTAINMENT, target / CRITICAL_ATTAINMENT)
+    warning = np.where(np.isnan(warning), target, warning)
+    critical = np.where(np.isnan(critical), fallback, critical)
+    return warning, critical
+
+
+def evaluate(actual, target, warning, critical, polarity):
+    """Classify every KPI in one vectorized pass; returns ALERT_* codes (ALERT_UNKNOWN without a value or bounds)"""
+    actual = np.asarray(actual, dtype=float)
+    warning, critical = effective_bounds(target, warning, critical, polarity)
+
+    codes = np.full(actual.shape, ALERT_NORMAL, dtype=np.int8)
+    codes[worse(actual, warning, polarity)] = ALERT_WARNING
+    codes[worse(actual, critical, polarity)] = ALERT_CRITICAL
+    codes[np.isnan(actual) | (np.isnan(warning) & np.isnan(critical))] = ALERT_UNKNOWN
+    return codes
@@ -0,0 +1,61 @@
+import numpy as np
+
+from ontology.snapshot import ALERT_NORMAL, ALERT_WARNING, ALERT_CRITICAL, get_snapshot_store
+
+# Credit each status earns towards a group's health score
+STATUS_SCORES = {ALERT_NORMAL: 1.0, ALERT_WARNING: 0.5, ALERT_CRITICAL: 0.0}
+GROUPINGS = ('department', 'category', 'time_period')
+
+
+def _group_stats(rows, codes, labels, status, weight):
+    """
+    Aggregate KPI rows into groups with bincount. rows/codes are parallel:
+    KPI row rows[k] belongs to group codes[k] (a KPI may appear in several groups).
+    """
+    n = len(labels)
+    st = status[rows]
+    w = np.nan_to_num(weight[rows], nan=1.0)
+    total = np.bincount(codes, minlength=n)
+    counts = {level: np.bincount(codes[st == level], minlength=n) for level in STATUS_SCORES}
+
+    scored = st >= 0
+    credit = np.zeros(len(rows))
+    for level, score in STATUS_SCORES.items():
+        credit[st == level] = score
+    weight_sum = np.bincount(codes[scored], weights=w[scored], minlength=n)
+    credit_sum = np.bincount(codes[scored], weights=(w * credit)[scored], minlength=n)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        health = np.where(weight_sum > 0, 100 * credit_sum / weight_sum, 0.0)
+
+    return {
+        str(labels[g]): {
+            'total_kpis': int(total[g]),
+            'good_count': int(counts[ALERT_NORMAL][g]),
+            'warning_count': int(counts[ALERT_WARNING][g]),
+            'critical_count': int(counts[ALERT_CRITICAL][g]),
+            'weight': round(float(weight_sum[g]), 3),
+            'health_score': round(float(health[g]), 1),
+        }
+        for g in np.flatnonzero(total)
+    }
+
+
+def compute_aggregates(snapshot):
+    """
+    Weighted health summaries per department, category and time period in one
+    vectorized pass over the snapshot. health_score is the weight-averaged
+    status credit (good 1, warning 0.5, critical 0) scaled to 0-100.
+    """
+    rows = np.arange(snapshot.size)
+    status, weight = snapshot.status_codes, snapshot.weight
+    category_rows = np.repeat(rows, np.diff(snapshot.category_indptr))
+    return {
+        'department': _group_stats(rows, snapshot.dept_codes, snapshot.dept_names, status, weight),
+        'category': _group_stats(category_rows, snapshot.category_codes, snapshot.category_names, status, weight),
+        'time_period': _group_stats(rows, snapshot.period_codes, snapshot.period_names, status, weight),
+    }
+
+
+def get_aggregates(onto):
+    """Return compute_aggregates() for the ontology's current snapshot, cached until the next change"""
+    return get_snapshot_store(onto).derive('aggregates', compute_aggregates)
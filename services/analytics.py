@@ -1,32 +1,44 @@
-import pandas as pd
-from owlready2 import *
+import numpy as np
+
+from ontology.index import get_kpi_index
+from ontology.snapshot import get_snapshot_store, STATUS_NAMES
+from services.aggregation import get_aggregates, GROUPINGS
 
 class KPIAnalytics:
     def __init__(self, ontology):
         self.onto = ontology
     
     def get_dashboard_data(self):
-        """Prepare data for dashboard"""
-        kpis = []
-        for kpi in self.onto.KPI.instances():
-            kpis.append({
-                'id': kpi.name,
-                'name': kpi.kpi_name,
-                'department': kpi.belongs_to_department[0].dept_name if kpi.belongs_to_department else 'Unknown',
-                'category': kpi.belongs_to_category[0].__class__.__name__ if kpi.belongs_to_category else 'Unknown',
-                'actual': kpi.actual_value,
-                'target': kpi.target_value,
-                'status': self._get_status(kpi),
-                'trend': kpi.trend_direction,
-                'weight': kpi.weight
-            })
-        
-        return pd.DataFrame(kpis)
-    
-    def _get_status(self, kpi):
-        ratio = (kpi.actual_value / kpi.target_value) * 100
-        if ratio >= 100:
-            return 'good'
-        elif ratio >= 95:
-            return 'warning'
-        return 'critical'
\ No newline at end of file
+        """Prepare data for dashboard, built column-wise from the KPI snapshot"""
+        import pandas as pd  # deferred: only reports and notebooks need a DataFrame
+        snap = get_snapshot_store(self.onto).get()
+        return pd.DataFrame({
+            'id': snap.ids,
+            'name': snap.names,
+            'department': np.asarray(snap.dept_names, dtype=object)[snap.dept_codes],
+            'category': np.asarray(snap.category_names, dtype=object)[snap.primary_category],
+            'actual': snap.actual,
+            'target': snap.target,
+            'status': np.asarray(STATUS_NAMES, dtype=object)[snap.status_codes],
+            'trend': snap.trends,
+            'weight': snap.weight
+        })
+
+    def get_summary(self, by='department'):
+        """Per-group KPI counts and weighted health score; by is 'department', 'category' or 'time_period'"""
+        if by not in GROUPINGS:
+            raise ValueError(f"Unknown grouping {by!r}; expected one of {', '.join(GROUPINGS)}")
+        return get_aggregates(self.onto)[by]
+
+    def get_department_summary(self):
+        return self.get_summary('department')
+
+    def get_category_summary(self):
+        return self.get_summary('category')
+
+    def get_period_summary(self):
+        return self.get_summary('time_period')
+
+    def get_kpis(self, department=None, category=None, period=None):
+        """Return KPI individuals matching the filters, resolved through the KPI index"""
+        return get_kpi_index(self.onto).kpis(department, category, period)
\ No newline at end of file
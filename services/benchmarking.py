@@ -0,0 +1,191 @@
+import numpy as np
+
+from ontology.snapshot import get_snapshot_store, as_float
+
+
+def connected_components(size, indptr, indices):
+    """Component label per row of an undirected CSR graph (min-label propagation with pointer jumping)"""
+    labels = np.arange(size)
+    sources = np.repeat(np.arange(size), np.diff(indptr))
+    targets = np.asarray(indices, dtype=np.int64)
+    while True:
+        previous = labels.copy()
+        np.minimum.at(labels, sources, labels[targets])
+        np.minimum.at(labels, targets, labels[sources])
+        labels = labels[labels]
+        if np.array_equal(labels, previous):
+            return labels
+
+
+class PeerGroups:
+    """
+    KPIs that can be benchmarked together: connected components of the
+    comparable_to graph with at least two members. group[i] is row i's peer
+    group (-1 if it has no peers); members lists rows group by group, sliced
+    by indptr.
+    """
+
+    def __init__(self, snapshot):
+        self.size = snapshot.size
+        self.ids = snapshot.ids
+        self.edge_indptr = snapshot.comparable_indptr
+        self.edge_indices = snapshot.comparable_indices
+        labels = connected_components(self.size, self.edge_indptr, self.edge_indices)
+        _, component, sizes = np.unique(labels, return_inverse=True, return_counts=True)
+        grouped = sizes[component] > 1
+        _, self.group = np.unique(np.where(grouped, labels, -1), return_inverse=True)
+        self.group = self.group.astype(np.int64) - (0 if grouped.all() else 1)
+        self.count = int(self.group.max()) + 1 if self.size else 0
+        self.members = np.flatnonzero(self.group >= 0)
+        self.members = self.members[np.argsort(self.group[self.members], kind='stable')]
+        self.indptr = np.zeros(self.count + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.group[self.members], minlength=self.count), out=self.indptr[1:])
+
+    def same_structure(self, snapshot):
+        """True if the snapshot has the same KPIs and comparable_to edges as these groups"""
+        return (np.array_equal(self.edge_indptr, snapshot.comparable_indptr)
+                and np.array_equal(self.edge_indices, snapshot.comparable_indices)
+                and np.array_equal(self.ids, snapshot.ids))
+
+
+class BenchmarkTable:
+    """
+    Peer statistics for one set of KPI values: per-row percentile rank (the
+    share of peers doing worse, counting ties as half), z-score against the
+    peer mean (positive is better), and per-group median/mean/std. Both are
+    flipped for rows whose polarity (see ontology/thresholds.py) is
+    lower-is-better; without polarity, higher is better. ranked holds each
+    group's members in value order (missing values last), in PeerGroups.indptr
+    slices.
+
+    Given the previous table over the same groups, only groups whose values
+    changed are re-sorted and re-ranked; the rest is carried over.
+    """
+
+    def __init__(self, groups, values, previous=None, polarity=None):
+        self.groups = groups
+        self.values = values
+        self.polarity = np.ones(groups.size, dtype=np.int8) if polarity is None else polarity
+        n = groups.size
+        if previous is None or previous.groups is not groups:
+            self.ranked = groups.members[np.lexsort((values[groups.members], groups.group[groups.members]))]
+            self.percentile = np.full(n, np.nan)
+            self.z_score = np.full(n, np.nan)
+            self.median, self.mean, self.std = (np.full(groups.count, np.nan) for _ in range(3))
+            self.valid = np.zeros(groups.count, dtype=np.int64)
+            self._rank(self.ranked)
+            return
+
+        changed = np.flatnonzero((values != previous.values)
+                                 & ~(np.isnan(values) & np.isnan(previous.values)))
+        dirty = np.unique(groups.group[changed])
+        dirty = dirty[dirty >= 0]
+        self.ranked = previous.ranked
+        self.percentile, self.z_score = previous.percentile, previous.z_score
+        self.median, self.mean, self.std, self.valid = previous.median, previous.mean, previous.std, previous.valid
+        if not len(dirty):
+            return
+
+        self.ranked = previous.ranked.copy()
+        self.percentile, self.z_score = previous.percentile.copy(), previous.z_score.copy()
+        self.median, self.mean, self.std = previous.median.copy(), previous.mean.copy(), previous.std.copy()
+        self.valid = previous.valid.copy()
+        segments = []
+        for g in dirty:
+            start, end = groups.indptr[g], groups.indptr[g + 1]
+            rows = self.ranked[start:end]
+            rows = self.ranked[start:end] = rows[np.argsort(values[rows], kind='stable')]
+            segments.append(rows)
+        self._rank(np.concatenate(segments))
+
+    def _rank(self, ranked):
+        """Fill the statistics for ranked: whole groups, each in value order with NaNs last"""
+        if not len(ranked):
+            return
+        values = self.values[ranked]
+        group = self.groups.group[ranked]
+        k = len(ranked)
+        positions = np.arange(k)
+        new_group = np.r_[True, group[1:] != group[:-1]]
+        new_run = new_group | np.r_[True, values[1:] != values[:-1]]
+        group_start = np.maximum.accumulate(np.where(new_group, positions, 0))
+        run_start = np.maximum.accumulate(np.where(new_run, positions, 0))
+        run_end = np.append(np.flatnonzero(new_run)[1:], k)[np.cumsum(new_run) - 1]
+
+        present = ~np.isnan(values)
+        groups = np.unique(group)
+        count = np.bincount(group[present], minlength=self.groups.count)
+        total = np.bincount(group[present], weights=values[present], minlength=self.groups.count)
+        squares = np.bincount(group[present], weights=values[present] ** 2, minlength=self.groups.count)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = total / count
+            std = np.sqrt(np.maximum(squares / count - mean ** 2, 0.0))
+
+        n = count[group]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            percentile = 100.0 * ((run_start - group_start) + 0.5 * (run_end - run_start)) / n
+            z_score = np.where(std[group] > 0, (values - mean[group]) / std[group], 0.0)
+        lower = self.polarity[ranked] < 0
+        # For lower-is-better KPIs the peers doing worse are the ones above
+        percentile = np.where(lower, 100.0 - percentile, percentile)
+        z_score = np.where(lower, -z_score, z_score)
+        self.percentile[ranked] = np.where(present, percentile, np.nan)
+        self.z_score[ranked] = np.where(present, z_score, np.nan)
+
+        starts = np.flatnonzero(new_group)
+        valid = count[groups]
+        lo = starts + np.maximum(valid - 1, 0) // 2
+        hi = starts + valid // 2
+        self.median[groups] = np.where(valid > 0, (values[lo] + values[hi]) / 2, np.nan)
+        self.mean[groups] = mean[groups]
+        self.std[groups] = std[groups]
+        self.valid[groups] = valid
+
+    def peers(self, row):
+        """Row's peer group members in value order (row included), or an empty array"""
+        g = self.groups.group[row]
+        if g < 0:
+            return np.empty(0, dtype=np.int64)
+        return self.ranked[self.groups.indptr[g]:self.groups.indptr[g + 1]]
+
+    def record(self, row):
+        """Benchmark of one row, or None if it has no peers"""
+        g = int(self.groups.group[row])
+        if g < 0:
+            return None
+        return {
+            'peer_group': g,
+            'peer_count': int(self.groups.indptr[g + 1] - self.groups.indptr[g]) - 1,
+            'peer_median': as_float(self.median[g]),
+            'peer_mean': as_float(self.mean[g]),
+            'percentile_rank': as_float(self.percentile[row]),
+            'z_score': as_float(self.z_score[row]),
+        }
+
+    def records(self, rows):
+        """Benchmarks for the rows that have peers, as {row: record}"""
+        rows = np.asarray(rows, dtype=np.int64)
+        return {int(row): self.record(row) for row in rows[self.groups.group[rows] >= 0]}
+
+
+def get_benchmarks(onto):
+    """
+    Return the BenchmarkTable for the ontology's current snapshot. Peer groups
+    are kept while comparable_to is unchanged, and value changes update the
+    previous table incrementally instead of re-ranking everything.
+
+    Peers are the comparable_to KPIs of this one ontology: each tenant
+    (hospital) is benchmarked on its own, never against other tenants.
+    """
+    store = get_snapshot_store(onto)
+
+    def build(snapshot):
+        previous = store.carried.get('benchmarks')
+        if (previous is not None and previous.groups.same_structure(snapshot)
+                and np.array_equal(previous.polarity, snapshot.polarity)):
+            table = BenchmarkTable(previous.groups, snapshot.actual, previous, snapshot.polarity)
+        else:
+            table = BenchmarkTable(PeerGroups(snapshot), snapshot.actual, polarity=snapshot.polarity)
+        store.carried['benchmarks'] = table
+        return table
+    return store.derive('benchmarks', build)
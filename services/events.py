@@ -0,0 +1,145 @@
+import threading
+import uuid
+from collections import deque
+
+import numpy as np
+
+from ontology.snapshot import STATUS_NAMES, ALERT_WARNING, ALERT_CRITICAL
+
+# Columns whose change makes a KPI part of a delta (everything record() reports)
+VALUE_COLUMNS = ('actual', 'target', 'weight')
+LABEL_COLUMNS = (('dept_codes', 'dept_names'), ('unit_codes', 'unit_names'),
+                 ('primary_category', 'category_names'))
+
+DEFAULT_MAX_EVENTS = 1024
+DEFAULT_POLL_INTERVAL = 1.0
+
+
+def _alerting(status):
+    return (status == ALERT_WARNING) | (status == ALERT_CRITICAL)
+
+
+def _row_map(old, new):
+    """old-snapshot row for every new-snapshot row (-1 for KPIs that are new)"""
+    if len(old.ids) == len(new.ids) and np.array_equal(old.ids, new.ids):
+        return np.arange(new.size)
+    return np.array([old.index.get(name, -1) for name in new.ids], dtype=np.int64)
+
+
+def diff_snapshots(old, new):
+    """
+    Compare two snapshots and return the delta payload streamed to clients:
+    changed/added KPI records, removed KPI ids, and alerts raised or cleared
+    (a KPI entering or leaving warning/critical status). Returns None when
+    nothing a client can see has changed.
+    """
+    previous = _row_map(old, new)
+    common = np.flatnonzero(previous >= 0)
+    prev = previous[common]
+
+    changed = np.zeros(len(common), dtype=bool)
+    for column in VALUE_COLUMNS:
+        a, b = getattr(old, column)[prev], getattr(new, column)[common]
+        changed |= (a != b) & ~(np.isnan(a) & np.isnan(b))
+    changed |= old.status_codes[prev] != new.status_codes[common]
+    changed |= np.asarray(old.trends)[prev] != np.asarray(new.trends)[common]
+    # Label tables are rebuilt per snapshot, so compare labels rather than codes
+    for codes, names in LABEL_COLUMNS:
+        old_labels = np.asarray(getattr(old, names), dtype=object)[getattr(old, codes)[prev]]
+        new_labels = np.asarray(getattr(new, names), dtype=object)[getattr(new, codes)[common]]
+        changed |= old_labels != new_labels
+
+    added = np.flatnonzero(previous < 0)
+    kept = np.zeros(old.size, dtype=bool)
+    kept[prev] = True
+    removed = [str(name) for name in np.asarray(old.ids)[~kept]]
+
+    old_status, new_status = old.status_codes[prev], new.status_codes[common]
+    moved = old_status != new_status
+    raised = common[moved & _alerting(new_status)]
+    cleared = common[moved & ~_alerting(new_status) & _alerting(old_status)]
+    before = dict(zip(common.tolist(), old_status.tolist()))
+
+    rows = np.concatenate((common[changed], added))
+    if not len(rows) and not removed:
+        return None
+    return {
+        'version': new.version,
+        'kpis': new.records(rows),
+        'removed': removed,
+        'alerts': {
+            'raised': [{'kpi': str(new.ids[i]), 'status': STATUS_NAMES[new.status_codes[i]],
+                        'previous': STATUS_NAMES[before[i]]} for i in raised]
+                      + [{'kpi': str(new.ids[i]), 'status': STATUS_NAMES[new.status_codes[i]],
+                          'previous': None} for i in added if _alerting(new.status_codes[i])],
+            'cleared': [{'kpi': str(new.ids[i]), 'status': STATUS_NAMES[new.status_codes[i]],
+                         'previous': STATUS_NAMES[before[i]]} for i in cleared],
+        },
+    }
+
+
+class ChangeFeed:
+    """
+    Ordered log of KPI deltas for streaming clients. poll() diffs the store's
+    current snapshot against the last one it saw and records a numbered event
+    when something changed; clients resume from the cursor of the last event
+    they received. Cursors carry a per-feed token, so a cursor issued by
+    another process (or before a restart) is recognised and answered with a
+    reset instead of a wrong resume.
+    """
+
+    def __init__(self, store, max_events=DEFAULT_MAX_EVENTS):
+        self.store = store
+        self.token = uuid.uuid4().hex[:12]
+        self.events = deque(maxlen=max_events)
+        self.sequence = 0
+        self._snapshot = None
+        self._changed = threading.Condition()
+
+    def cursor(self, sequence=None):
+        return f"{self.token}:{self.sequence if sequence is None else sequence}"
+
+    def parse_cursor(self, cursor):
+        """Sequence number of a cursor issued by this feed, or None"""
+        token, _, sequence = (cursor or '').partition(':')
+        if token != self.token or not sequence.isdigit():
+            return None
+        return int(sequence)
+
+    def poll(self):
+        """Record a delta event if the store's snapshot changed since the last poll"""
+        snapshot = self.store.get()
+        with self._changed:
+            previous = self._snapshot
+            if previous is snapshot:
+                return self.sequence
+            self._snapshot = snapshot
+            delta = diff_snapshots(previous, snapshot) if previous is not None else None
+            if delta is not None:
+                self.sequence += 1
+                self.events.append((self.sequence, delta))
+                self._changed.notify_all()
+            return self.sequence
+
+    def since(self, cursor):
+        """
+        Events after cursor as (cursor, delta) pairs, or None when the cursor
+        cannot be resumed (unknown token, or older than the retained events).
+        """
+        sequence = self.parse_cursor(cursor)
+        with self._changed:
+            if sequence is None or sequence > self.sequence:
+                return None
+            if sequence < self.sequence and sequence < self.events[0][0] - 1:
+                return None
+            return [(self.cursor(n), delta) for n, delta in self.events if n > sequence]
+
+    def wait(self, timeout=DEFAULT_POLL_INTERVAL):
+        """Block until notify() is called or timeout elapses"""
+        with self._changed:
+            self._changed.wait(timeout)
+
+    def notify(self):
+        """Wake waiting streams so they poll right away (call after in-process KPI writes)"""
+        with self._changed:
+            self._changed.notify_all()
@@ -0,0 +1,114 @@
+import threading
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+DEFAULT_MAX_JOBS = 100
+DEFAULT_WAIT = 30
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+
+class Job:
+    """One background run; key identifies the input it was submitted for"""
+
+    def __init__(self, key):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.status = QUEUED
+        self.submitted = datetime.now().isoformat()
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.error = None
+        self.version = None  # input version the result is valid for
+        self._done = threading.Event()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def to_dict(self, include_result=True):
+        data = {
+            'id': self.id,
+            'status': self.status,
+            'submitted': self.submitted,
+            'started': self.started,
+            'finished': self.finished,
+        }
+        if self.error is not None:
+            data['error'] = self.error
+        if include_result and self.status == DONE:
+            data['result'] = self.result
+        return data
+
+
+class JobQueue:
+    """
+    Run a callable on a background thread pool and track each run as a Job.
+    run returns (result, version the result is valid for). Submissions for
+    the same input version share one queued/running job, and a completed job
+    stays current until the version moves on. Threads rather
+    than processes: runs write their results back into this process's
+    ontology.
+    """
+
+    def __init__(self, run, version, max_workers=1, max_jobs=DEFAULT_MAX_JOBS):
+        self.run = run
+        self.version = version
+        self.max_jobs = max_jobs
+        self.latest = None
+        self._jobs = OrderedDict()
+        self._active = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix='kpi-job')
+
+    def submit(self, inline=False):
+        """
+        Return the job that covers the current version, queueing one if needed.
+        inline runs a new job in the calling thread instead (e.g. to warm up in
+        the gunicorn master, whose pool threads would not survive the fork).
+        """
+        key = self.version()
+        with self._lock:
+            job = self._active.get(key)
+            if job is not None:
+                return job
+            if self.latest is not None and self.latest.version == key:
+                return self.latest
+            job = self._active[key] = Job(key)
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.max_jobs:
+                self._jobs.popitem(last=False)
+        if inline:
+            self._execute(job)
+        else:
+            self._executor.submit(self._execute, job)
+        return job
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def is_current(self, job):
+        return job is not None and job.status == DONE and job.version == self.version()
+
+    def _execute(self, job):
+        job.status, job.started = RUNNING, datetime.now().isoformat()
+        try:
+            job.result, version = self.run()
+            job.status = DONE
+        except Exception as e:
+            print(f"❌ Background job {job.id} failed:\n{traceback.format_exc()}")
+            job.error, job.status = str(e), FAILED
+        job.finished = datetime.now().isoformat()
+        with self._lock:
+            self._active.pop(job.key, None)
+            if job.status == DONE:
+                # Not self.version(): an update landing during the run must leave it stale
+                job.version = version
+                self.latest = job
+        job._done.set()
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,147 @@
+import bisect
+import contextlib
+import threading
+import time
+
+# Histogram bucket upper bounds, in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _Timer(contextlib.ContextDecorator):
+    """Observe the wall time of a block (or of every call, when used as a decorator)"""
+
+    def __init__(self, registry, name, labels):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+
+    def _recreate_cm(self):
+        # A fresh timer per decorated call, so concurrent calls don't share a start time
+        return _Timer(self.registry, self.name, self.labels)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
+        self.registry.observe(self.name, self.elapsed, **self.labels)
+        return False
+
+
+class MetricsRegistry:
+    """
+    In-process counters and latency histograms, rendered in the Prometheus text
+    format. Each gunicorn worker keeps its own registry, so a scrape reports
+    the worker that answered it.
+    """
+
+    def __init__(self, prefix='hospital_kpi', buckets=DEFAULT_BUCKETS):
+        self.prefix = prefix
+        self.buckets = tuple(buckets)
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name, text):
+        self._help[name] = text
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * len(self.buckets) + [0, 0.0]
+            i = bisect.bisect_left(self.buckets, seconds)
+            if i < len(self.buckets):
+                histogram[i] += 1
+            histogram[-2] += 1
+            histogram[-1] += seconds
+
+    def timer(self, name, **labels):
+        return _Timer(self, name, labels)
+
+    def value(self, name, **labels):
+        """Current value of a counter (0 if never incremented)"""
+        return self._counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def summary(self, name, **labels):
+        """(count, total seconds) observed by a histogram"""
+        histogram = self._histograms.get((name, tuple(sorted(labels.items()))))
+        return (0, 0.0) if histogram is None else (histogram[-2], histogram[-1])
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render(self, gauges=None):
+        """Prometheus text exposition of every metric, plus gauges {name: value} sampled by the caller"""
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, list(value)) for key, value in self._histograms.items())
+
+        def header(name, kind):
+            full = f"{self.prefix}_{name}"
+            if name in self._help:
+                lines.append(f"# HELP {full} {self._help[name]}")
+            lines.append(f"# TYPE {full} {kind}")
+            return full
+
+        seen = None
+        for (name, labels), value in counters:
+            full = header(name, 'counter') if name != seen else f"{self.prefix}_{name}"
+            seen = name
+            lines.append(f"{full}{_labels(labels)} {_number(value)}")
+
+        seen = None
+        for (name, labels), histogram in histograms:
+            full = header(name, 'histogram') if name != seen else f"{self.prefix}_{name}"
+            seen = name
+            cumulative = 0
+            for bound, count in zip(self.buckets, histogram):
+                cumulative += count
+                lines.append(f"{full}_bucket{_labels(labels + (('le', _number(bound)),))} {cumulative}")
+            lines.append(f"{full}_bucket{_labels(labels + (('le', '+Inf'),))} {histogram[-2]}")
+            lines.append(f"{full}_sum{_labels(labels)} {_number(histogram[-1])}")
+            lines.append(f"{full}_count{_labels(labels)} {histogram[-2]}")
+
+        for name, value in sorted((gauges or {}).items()):
+            if value is None:
+                continue
+            full = header(name, 'gauge')
+            lines.append(f"{full} {_number(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# Process-wide registry used by the reasoner, the API and app start-up
+REGISTRY = MetricsRegistry()
+REGISTRY.describe('http_requests_total', "API requests by endpoint, method and status")
+REGISTRY.describe('http_request_duration_seconds', "API request latency by endpoint")
+REGISTRY.describe('reasoning_phase_duration_seconds', "Time spent in each reasoning phase")
+REGISTRY.describe('reasoning_runs_total', "Reasoning runs by mode (full or incremental)")
+REGISTRY.describe('kpis_processed_total', "KPIs classified by reasoning runs")
+REGISTRY.describe('alerts_raised_total', "Alerts raised by business rules, by level")
+REGISTRY.describe('ontology_load_seconds', "Time to load or build the ontology at start-up")
+REGISTRY.describe('profiles_total', "Requests captured by the sampling profiler")
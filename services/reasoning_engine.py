@@ -1,66 +1,245 @@
-import pandas as pd
+import numpy as np
+from collections import Counter, deque
 from datetime import datetime
 
+from ontology.snapshot import get_snapshot_store, ontology_version, ALERT_UNKNOWN, ALERT_CRITICAL
+from ontology.index import get_kpi_index
+from ontology.graph import get_dependency_graph
+from services.rule_engine import RuleEngine, load_rules
+from services.root_cause import get_root_causes
+from services.metrics import REGISTRY
+
+# AlertLevel subclasses indexed by alert code, each backed by one shared individual
+ALERT_LEVEL_CLASSES = ('Normal', 'Warning', 'Critical')
+
+# Completed runs kept in HospitalKPIReasoner.history
+DEFAULT_HISTORY_SIZE = 50
+
+# Upstream KPIs recommended for investigation per run, most critical KPIs explained first
+MAX_ROOT_CAUSE_RECOMMENDATIONS = 3
+
+
+def _read_only(self, *args, **kwargs):
+    raise TypeError(f"{type(self).__name__} is read-only")
+
+
+class _FrozenList(list):
+    append = extend = insert = remove = pop = clear = sort = reverse = _read_only
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _read_only
+
+
+class _FrozenDict(dict):
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = __ior__ = _read_only
+
+
+class ReasoningResult(_FrozenDict):
+    """
+    Immutable outcome of one reasoning run: the familiar results dict
+    ({'alerts': [...], 'insights': [...], 'recommendations': [...]}), but
+    read-only all the way down. dict(result) or to_dict() gives a mutable copy.
+    """
+
+    def __init__(self, version, alerts=(), insights=(), recommendations=(), started=None, duration=None):
+        super().__init__(
+            alerts=_FrozenList(_FrozenDict(a) for a in alerts),
+            insights=_FrozenList(insights),
+            recommendations=_FrozenList(_FrozenDict(r) for r in recommendations),
+        )
+        self.version = version
+        self.started = started
+        self.duration = duration
+
+    def to_dict(self):
+        """JSON-ready copy including run metadata"""
+        data = {key: [dict(item) if isinstance(item, dict) else item for item in items]
+                for key, items in self.items()}
+        data['version'] = self.version
+        data['started'] = self.started
+        data['duration_ms'] = None if self.duration is None else round(self.duration * 1000, 2)
+        return data
+
+
+class _Run:
+    """Mutable accumulator private to one reasoning run"""
+
+    def __init__(self, snapshot, version):
+        self.snapshot = snapshot
+        self.version = version  # store version the result is valid for
+        self.alert_codes = snapshot.alert_codes.copy()
+        self.alerts = []
+        self.insights = []
+        self.recommendations = []
+        self.started = datetime.now()
+
+    def result(self):
+        return ReasoningResult(self.version, self.alerts, self.insights, self.recommendations,
+                               self.started.isoformat(), (datetime.now() - self.started).total_seconds())
+
+
 class HospitalKPIReasoner:
-    def __init__(self, ontology):
+    """
+    Safe to share between threads: each run reasons over one consistent
+    snapshot, accumulates into its own _Run, and returns a new
+    ReasoningResult. Only the alert-level write-back is serialized (write_lock).
+    """
+
+    def __init__(self, ontology, rules=None, history_size=DEFAULT_HISTORY_SIZE):
         self.onto = ontology
-        self.results = {'alerts': [], 'insights': [], 'recommendations': []}
-    
+        self.rules = RuleEngine(load_rules() if rules is None else rules)
+        self.snapshots = get_snapshot_store(ontology)
+        self.history = deque(maxlen=history_size)
+        # The store's lock for writes to the ontology (see SnapshotStore.write_lock)
+        self.write_lock = self.snapshots.write_lock
+        self._alert_levels = None
+
+    @property
+    def results(self):
+        """The most recent completed result (None before the first run)"""
+        return self.history[-1] if self.history else None
+
+    @REGISTRY.timer('reasoning_phase_duration_seconds', phase='total')
     def run_reasoning(self):
         """Execute reasoning pipeline"""
-        self._semantic_reasoning()
-        self._rule_based_inference()
-        self._generate_recommendations()
-        return self.results
-    
-    def _semantic_reasoning(self):
-        """Classify KPI performance"""
-        for kpi in self.onto.KPI.instances():
-            ratio = (kpi.actual_value / kpi.target_value) * 100
-            
-            if ratio >= 100:
-                kpi.has_alert_level = [self.onto.Normal()]
-            elif ratio >= 95:
-                kpi.has_alert_level = [self.onto.Warning()]
-            else:
-                kpi.has_alert_level = [self.onto.Critical()]
+        # Read the version first: a write in between only makes the result look stale
+        version = self.snapshots.version()
+        run = _Run(self.snapshots.get(), version)
+        self._semantic_reasoning(run)
+        self._rule_based_inference(run)
+        self._generate_recommendations(run)
+        return self._finish(run, 'full')
+
+    @REGISTRY.timer('reasoning_phase_duration_seconds', phase='total_incremental')
+    def run_incremental(self, kpi_names):
+        """
+        Re-run reasoning after the given KPIs were updated. A KPI's alert level
+        depends only on its own values, so just those rows are reclassified;
+        rules are re-checked for everything they transitively affect.
+        """
+        version = self.snapshots.version()
+        index = get_kpi_index(self.onto)
+        run = _Run(index.snapshot, version)
+        rows = np.array([i for i in (index.row(name) for name in kpi_names) if i is not None], dtype=np.int64)
+        closure = get_dependency_graph(self.onto, index.snapshot).closure(rows)
+        self._semantic_reasoning(run, rows)
+        self._rule_based_inference(run, changed=list(index.snapshot.ids[closure]))
+        self._generate_recommendations(run)
+        return self._finish(run, 'incremental')
+
+    def _finish(self, run, mode):
+        REGISTRY.inc('reasoning_runs_total', mode=mode)
+        result = run.result()
+        self.history.append(result)
+        return result
     
-    def _rule_based_inference(self):
-        """Apply business rules"""
-        # Rule 1: ED Crisis
-        if (self._find_kpi('ED_Wait_Time').actual_value > 40 and
-            self._find_kpi('ED_LWBS').actual_value > 3.0):
-            self._create_alert('CRITICAL', 'ED Capacity Crisis', 
-                             'ED wait time >40min + LWBS >3% indicates capacity issues')
-        
-        # Rule 2: Financial Stress
-        if self._find_kpi('Hospital_Operating_Margin').actual_value < 3.0:
-            self._create_alert('WARNING', 'Financial Stress', 
-                             'Operating margin below 3% - review cost structure')
+    @REGISTRY.timer('reasoning_phase_duration_seconds', phase='semantic_reasoning')
+    def _semantic_reasoning(self, run, rows=None):
+        """Write the snapshot's threshold classification (see ontology/thresholds.py) back as alert levels.
+        Only KPIs whose alert level actually changed are written back, and only
+        while the current values still give that level; rows restricts the pass
+        to a subset of snapshot rows."""
+        snapshot = run.snapshot
+        if rows is None:
+            rows = np.arange(snapshot.size)
+        levels = snapshot.status_codes[rows]
+        REGISTRY.inc('kpis_processed_total', len(rows))
+        known = levels != ALERT_UNKNOWN
+        run.alert_codes[rows[known]] = levels[known]
+        changed = np.flatnonzero((levels != snapshot.alert_codes[rows]) & known)
+        if len(changed):
+            index = get_kpi_index(self.onto)
+            with self.write_lock, self.snapshots.write_batch():
+                before = self.snapshots.version()
+                individuals = self._alert_level_individuals()
+                written = ontology_version(self.onto)
+                current = self.snapshots.get()
+                if current.version != snapshot.version:
+                    # Values moved since this run's snapshot was taken (an update and
+                    # its incremental run), so its levels may already be stale
+                    changed = changed[self._still_classified(current, snapshot, rows[changed], levels[changed])]
+                patch = {}
+                for i in changed:
+                    kpi = index.get(snapshot.ids[rows[i]])
+                    level = individuals[levels[i]]
+                    # A concurrent run may already have written it
+                    if kpi is not None and kpi.has_alert_level != [level]:
+                        kpi.has_alert_level = [level]
+                        patch[kpi.name] = levels[i]
+                if patch:
+                    self.snapshots.patch(written, alert_codes=patch)
+                if before == run.version:
+                    # Nothing but this run wrote since it started, so the result
+                    # also holds for the levels it just wrote
+                    run.version = self.snapshots.version()
+        return len(changed)
+
+    @staticmethod
+    def _still_classified(current, snapshot, rows, levels):
+        """Mask of snapshot rows the current snapshot still classifies at levels"""
+        if current.layout == snapshot.layout:
+            now = current.status_codes[rows]
+        else:
+            now = np.array([ALERT_UNKNOWN if row is None else current.status_codes[row]
+                            for row in map(current.index.get, snapshot.ids[rows])], dtype=levels.dtype)
+        return now == levels
+
+    def _alert_level_individuals(self):
+        """Return the shared Normal/Warning/Critical individuals, creating them once"""
+        if self._alert_levels is None:
+            with self.write_lock:
+                if self._alert_levels is None:
+                    levels = []
+                    for cls_name in ALERT_LEVEL_CLASSES:
+                        individual = self.onto[f"{cls_name}_Level"]
+                        if individual is None:
+                            with self.onto:
+                                individual = getattr(self.onto, cls_name)(f"{cls_name}_Level")
+                        levels.append(individual)
+                    self._alert_levels = levels
+        return self._alert_levels
+
+    @REGISTRY.timer('reasoning_phase_duration_seconds', phase='rule_based_inference')
+    def _rule_based_inference(self, run, changed=None):
+        """Apply business rules (see services/business_rules.json)"""
+        for rule in self.rules.evaluate(run.snapshot, changed=changed):
+            self._create_alert(run, rule.level, rule.id, rule.message, rule.title)
     
-    def _generate_recommendations(self):
+    @REGISTRY.timer('reasoning_phase_duration_seconds', phase='generate_recommendations')
+    def _generate_recommendations(self, run):
         """Generate actionable insights"""
-        critical_count = sum(1 for kpi in self.onto.KPI.instances() 
-                           if self.onto.Critical() in kpi.has_alert_level)
+        critical_count = int((run.alert_codes == ALERT_CRITICAL).sum())
         
         if critical_count >= 3:
-            self.results['recommendations'].append({
+            run.recommendations.append({
                 'priority': 'HIGH',
                 'action': 'Executive review required - multiple critical KPIs detected',
                 'owner': 'CEO/COO',
                 'timeline': '24 hours'
             })
+
+        # Point at the upstream KPIs that best explain the critical ones
+        analysis = get_root_causes(self.onto, run.snapshot)
+        explained = Counter()
+        for row in np.flatnonzero(run.alert_codes == ALERT_CRITICAL):
+            causes, _, _ = analysis.causes(row)
+            if len(causes):
+                explained[int(causes[0])] += 1
+        snapshot = run.snapshot
+        for row, count in explained.most_common(MAX_ROOT_CAUSE_RECOMMENDATIONS):
+            department = snapshot.dept_names[snapshot.dept_codes[row]]
+            run.recommendations.append({
+                'priority': 'HIGH' if count > 1 else 'MEDIUM',
+                'action': f"Investigate {snapshot.names[row]} - likely root cause of {count} critical KPI(s)",
+                'owner': f"{department} leadership",
+                'timeline': '1 week',
+                'kpi': str(snapshot.ids[row])
+            })
     
-    def _find_kpi(self, name):
-        for kpi in self.onto.KPI.instances():
-            if kpi.name == name:
-                return kpi
-        return None
-    
-    def _create_alert(self, level, alert_type, message):
-        self.results['alerts'].append({
+    def _create_alert(self, run, level, alert_type, message, title=None):
+        REGISTRY.inc('alerts_raised_total', level=level)
+        run.alerts.append({
             'level': level,
             'type': alert_type,
+            'title': title or alert_type,
             'message': message,
             'timestamp': datetime.now().isoformat()
-        })
\ No newline at end of file
+        })
@@ -0,0 +1,80 @@
+import numpy as np
+
+from ontology.graph import get_dependency_graph
+from ontology.snapshot import get_snapshot_store, as_float, ALERT_CRITICAL
+from ontology.thresholds import attainment
+
+# Each extra hop upstream multiplies a candidate's score by this
+DEFAULT_DECAY = 0.5
+DEFAULT_LIMIT = 5
+
+
+def shortfall(actual, target, polarity):
+    """How far each KPI misses target in its own direction, as 1 - attainment (0 when on target or unknown)"""
+    gap = 1.0 - attainment(actual, target, polarity)
+    return np.clip(np.nan_to_num(gap, nan=0.0, posinf=0.0, neginf=0.0), 0.0, None)
+
+
+class RootCauseAnalysis:
+    """
+    Likely root causes of under-performing KPIs for one snapshot. A KPI's
+    candidates are everything upstream of it (what it transitively depends_on)
+    that is itself below target, scored by weight x shortfall and multiplied
+    by decay for each hop beyond the first. A candidate is a root when none of
+    its own direct dependencies is below target. Upstream reachability comes
+    memoized from the DependencyGraph, which survives value-only changes.
+    """
+
+    def __init__(self, snapshot, graph, decay=DEFAULT_DECAY):
+        self.snapshot = snapshot
+        self.graph = graph
+        self.decay = decay
+        self.shortfall = shortfall(snapshot.actual, snapshot.target, snapshot.polarity)
+        self.weight = np.nan_to_num(snapshot.weight, nan=1.0)
+        self._causes = {}
+
+    def causes(self, row):
+        """(rows, hops, scores) of row's candidate root causes, best first"""
+        found = self._causes.get(row)
+        if found is None:
+            rows, hops = self.graph.upstream(row)
+            keep = self.shortfall[rows] > 0
+            rows, hops = rows[keep], hops[keep]
+            scores = self.weight[rows] * self.shortfall[rows] * self.decay ** (hops - 1)
+            order = np.lexsort((hops, -scores))
+            found = self._causes[row] = (rows[order], hops[order], scores[order])
+        return found
+
+    def is_root(self, row):
+        return not (self.shortfall[self.graph.depends_on(row)] > 0).any()
+
+    def explain(self, row, limit=DEFAULT_LIMIT):
+        """JSON-ready analysis of one KPI"""
+        snap = self.snapshot
+        rows, hops, scores = self.causes(row)
+        rows, hops, scores = rows[:limit], hops[:limit], scores[:limit]
+        causes = snap.project(rows, ("id", "name", "department", "status", "actual", "target"))
+        for cause, r, h, score in zip(causes, rows, hops, scores):
+            cause.update(shortfall=round(float(self.shortfall[r]), 4), weight=as_float(self.weight[r]),
+                         hops=int(h), score=round(float(score), 4), root=self.is_root(r))
+        record = snap.project([row], ("id", "name", "department", "status", "actual", "target"))[0]
+        record["shortfall"] = round(float(self.shortfall[row]), 4)
+        record["cycle"] = [str(kpi_id) for kpi_id in snap.ids[self.graph.cycle(row)]]
+        record["causes"] = causes
+        return record
+
+    def critical(self):
+        """Rows currently classified critical"""
+        return np.flatnonzero(self.snapshot.status_codes == ALERT_CRITICAL)
+
+    def report(self, limit=DEFAULT_LIMIT):
+        """explain() for every critical KPI that has upstream candidates"""
+        found = [self.explain(row, limit) for row in self.critical()]
+        return [record for record in found if record["causes"]]
+
+
+def get_root_causes(onto, snapshot=None):
+    """Return the RootCauseAnalysis for the ontology's current snapshot (or the one given), computed once"""
+    def build(snapshot):
+        return RootCauseAnalysis(snapshot, get_dependency_graph(onto, snapshot))
+    return get_snapshot_store(onto).derive('root_causes', build, snapshot)
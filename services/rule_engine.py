@@ -0,0 +1,169 @@
+import json
+import os
+import threading
+
+import numpy as np
+
+DEFAULT_RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'business_rules.json')
+
+OPERATORS = ('>', '>=', '<', '<=', '==', '!=')
+_OPERATOR_FUNCS = (np.greater, np.greater_equal, np.less, np.less_equal, np.equal, np.not_equal)
+
+# Rule condition field -> KPISnapshot column
+FIELDS = {
+    'actual_value': 'actual',
+    'target_value': 'target',
+    'warning_threshold': 'warning',
+    'critical_threshold': 'critical',
+    'weight': 'weight',
+}
+LEVELS = ('NORMAL', 'WARNING', 'CRITICAL')
+
+
+def load_rules(path=None):
+    """
+    Load business rule definitions from a JSON file (YAML when PyYAML is installed).
+    Defaults to $KPI_RULES_PATH, then the bundled business_rules.json.
+    """
+    path = path or os.environ.get('KPI_RULES_PATH', DEFAULT_RULES_PATH)
+    with open(path, encoding='utf-8') as f:
+        if path.endswith(('.yaml', '.yml')):
+            import yaml  # optional, only needed for YAML rule files
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+class Rule:
+    """One compiled business rule: fires when all (or any) of its conditions hold"""
+
+    def __init__(self, spec):
+        try:
+            self.id = spec['id']
+            self.level = spec.get('level', 'WARNING').upper()
+            self.title = spec.get('title', self.id)
+            self.message = spec['message']
+            self.match = 'any' if 'any' in spec else 'all'
+            self.conditions = [
+                (c['kpi'], c.get('field', 'actual_value'), c['op'], float(c['value']))
+                for c in spec[self.match]
+            ]
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"Invalid rule definition {spec!r}: {e}") from e
+
+        if self.level not in LEVELS:
+            raise ValueError(f"Rule {self.id}: unknown level {self.level}")
+        if not self.conditions:
+            raise ValueError(f"Rule {self.id}: no conditions")
+        for _, field, op, _ in self.conditions:
+            if field not in FIELDS:
+                raise ValueError(f"Rule {self.id}: unknown field {field}")
+            if op not in OPERATORS:
+                raise ValueError(f"Rule {self.id}: unknown operator {op}")
+
+    @property
+    def kpis(self):
+        return {kpi for kpi, _, _, _ in self.conditions}
+
+
+class RuleEngine:
+    """
+    Evaluation plan for a rule set. Conditions of all rules are flattened into
+    arrays (rule i owns a contiguous slice), and a KPI -> rules index lets each
+    evaluation re-check only the rules whose referenced values changed.
+    """
+
+    def __init__(self, specs):
+        self.rules = [spec if isinstance(spec, Rule) else Rule(spec) for spec in specs]
+        seen = set()
+        for rule in self.rules:
+            if rule.id in seen:
+                raise ValueError(f"Duplicate rule id {rule.id}")
+            seen.add(rule.id)
+
+        conditions = [(r, c) for r, rule in enumerate(self.rules) for c in rule.conditions]
+        self._cond_rule = np.array([r for r, _ in conditions], dtype=np.int64)
+        self._cond_kpi = [c[0] for _, c in conditions]
+        fields = [FIELDS[c[1]] for _, c in conditions]
+        self._field_masks = {attr: np.array([f == attr for f in fields], dtype=bool) for attr in set(fields)}
+        self._cond_op = np.array([OPERATORS.index(c[2]) for _, c in conditions], dtype=np.int8)
+        self._cond_value = np.array([c[3] for _, c in conditions], dtype=float)
+        counts = np.array([len(rule.conditions) for rule in self.rules], dtype=np.int64)
+        self._rule_starts = np.concatenate(([0], np.cumsum(counts)[:-1])).astype(np.int64)
+        self._is_any = np.array([rule.match == 'any' for rule in self.rules], dtype=bool)
+
+        self.rules_by_kpi = {}
+        for r, rule in enumerate(self.rules):
+            for kpi in rule.kpis:
+                self.rules_by_kpi.setdefault(kpi, []).append(r)
+
+        self._lock = threading.Lock()
+        self._layout = None
+        self._rows = None
+        self._values = None
+        self._holds = np.zeros(len(self._cond_rule), dtype=bool)
+        self._state = np.zeros(len(self.rules), dtype=bool)
+
+    def affected_rules(self, kpi_names):
+        """Return the indexes of rules that reference any of the given KPIs"""
+        hits = set()
+        for name in kpi_names:
+            hits.update(self.rules_by_kpi.get(name, ()))
+        return np.array(sorted(hits), dtype=np.int64)
+
+    def evaluate(self, snapshot, changed=None):
+        """
+        Return the rules currently firing for this snapshot.
+        Only rules whose condition values moved since the previous call are
+        re-evaluated; pass changed=[kpi names] to skip the diff entirely.
+        """
+        if not self.rules:
+            return []
+        with self._lock:
+            if self._layout != snapshot.layout:
+                self._bind(snapshot)
+                dirty = np.ones(len(self.rules), dtype=bool)
+                values = self._condition_values(snapshot)
+                self._values = values.copy()
+            elif changed is not None:
+                dirty = np.zeros(len(self.rules), dtype=bool)
+                dirty[self.affected_rules(changed)] = True
+                values = self._condition_values(snapshot)
+            else:
+                values = self._condition_values(snapshot)
+                moved = (values != self._values) & ~(np.isnan(values) & np.isnan(self._values))
+                dirty = np.zeros(len(self.rules), dtype=bool)
+                dirty[self._cond_rule[moved]] = True
+
+            if dirty.any():
+                # Only the conditions just re-tested are absorbed; any other value that
+                # moved still differs from _values and is picked up by the next diff
+                cond_dirty = dirty[self._cond_rule]
+                self._values[cond_dirty] = values[cond_dirty]
+                self._state[dirty] = self._evaluate(values, dirty)[dirty]
+            return [self.rules[r] for r in np.flatnonzero(self._state)]
+
+    def _bind(self, snapshot):
+        """Resolve every condition's KPI name to a snapshot row (-1 if missing)"""
+        self._layout = snapshot.layout
+        self._rows = np.array([snapshot.index.get(kpi, -1) for kpi in self._cond_kpi], dtype=np.int64)
+
+    def _condition_values(self, snapshot):
+        values = np.full(len(self._rows), np.nan)
+        present = self._rows >= 0
+        for attr, mask in self._field_masks.items():
+            sel = present & mask
+            values[sel] = getattr(snapshot, attr)[self._rows[sel]]
+        return values
+
+    def _evaluate(self, values, dirty):
+        """Re-test the conditions of dirty rules and reduce them per rule"""
+        holds = self._holds
+        cond_dirty = dirty[self._cond_rule]
+        with np.errstate(invalid='ignore'):
+            for code, func in enumerate(_OPERATOR_FUNCS):
+                sel = cond_dirty & (self._cond_op == code)
+                if sel.any():
+                    holds[sel] = func(values[sel], self._cond_value[sel])
+        all_hold = np.logical_and.reduceat(holds, self._rule_starts)
+        any_hold = np.logical_or.reduceat(holds, self._rule_starts)
+        return np.where(self._is_any, any_hold, all_hold)
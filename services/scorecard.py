@@ -0,0 +1,85 @@
+import numpy as np
+
+from ontology.snapshot import get_snapshot_store
+from ontology.thresholds import effective_bounds, worse
+
+LEVELS = ('hospital', 'department', 'category')
+
+
+def normalize(actual, target, warning, critical, polarity):
+    """
+    Score each KPI from 0 to 1 in its own direction (polarity, see
+    ontology/thresholds.py): 1 at or beyond target, 0 at or beyond the
+    critical bound evaluate() classifies against (so a critical KPI always
+    scores 0), linear in between. Where that bound doesn't sit on the bad
+    side of target the score is 0 beyond it and 1 otherwise. NaN when actual
+    or target is missing.
+    """
+    _, critical = effective_bounds(target, warning, critical, polarity)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        span = target - critical
+        banded = (actual - critical) / span
+    usable = ~np.isnan(span) & (np.sign(span) == polarity)
+    score = np.clip(np.where(usable, banded, np.where(worse(actual, critical, polarity), 0.0, 1.0)), 0.0, 1.0)
+    score[np.isnan(actual) | np.isnan(target)] = np.nan
+    return score
+
+
+def _composite(rows, codes, labels, ids, score, weight):
+    """
+    Weighted mean score per group in one bincount pass. rows/codes are
+    parallel: KPI row rows[k] belongs to group codes[k].
+    """
+    n = len(labels)
+    s = score[rows]
+    w = weight[rows]
+    scored = ~np.isnan(s)
+    total = np.bincount(codes, minlength=n)
+    count = np.bincount(codes[scored], minlength=n)
+    weight_sum = np.bincount(codes[scored], weights=w[scored], minlength=n)
+    credit_sum = np.bincount(codes[scored], weights=(w * s)[scored], minlength=n)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        composite = np.where(weight_sum > 0, 100 * credit_sum / weight_sum, np.nan)
+
+    # The KPI losing the group the most weighted points: first in (group, -gap) order
+    gap = np.where(scored, w * (1 - np.nan_to_num(s)), -1.0)
+    order = np.lexsort((-gap, codes))
+    first = order[np.r_[True, codes[order][1:] != codes[order][:-1]]] if len(order) else order
+    largest_gap = {int(codes[k]): str(ids[rows[k]]) for k in first if gap[k] > 0}
+
+    return {
+        str(labels[g]): {
+            'score': None if np.isnan(composite[g]) else round(float(composite[g]), 1),
+            'kpis': int(total[g]),
+            'scored': int(count[g]),
+            'weight': round(float(weight_sum[g]), 3),
+            'largest_gap': largest_gap.get(int(g)),
+        }
+        for g in np.flatnonzero(total)
+    }
+
+
+def compute_scorecards(snapshot):
+    """
+    Weighted composite scores (0-100) for the whole hospital and per
+    department and category, from direction-aware per-KPI scores (see
+    normalize()) weighted by each KPI's weight (1 when unset).
+    """
+    score = normalize(snapshot.actual, snapshot.target, snapshot.warning, snapshot.critical, snapshot.polarity)
+    weight = np.nan_to_num(snapshot.weight, nan=1.0)
+    rows = np.arange(snapshot.size)
+    category_rows = np.repeat(rows, np.diff(snapshot.category_indptr))
+    ids = snapshot.ids
+    hospital = _composite(rows, np.zeros(snapshot.size, dtype=np.int64), np.array(['hospital'], dtype=object),
+                          ids, score, weight)
+    return {
+        'hospital': hospital.get('hospital', {'score': None, 'kpis': 0, 'scored': 0, 'weight': 0.0,
+                                              'largest_gap': None}),
+        'department': _composite(rows, snapshot.dept_codes, snapshot.dept_names, ids, score, weight),
+        'category': _composite(category_rows, snapshot.category_codes, snapshot.category_names, ids, score, weight),
+    }
+
+
+def get_scorecards(onto, snapshot=None):
+    """Return compute_scorecards() for the ontology's current snapshot (or the one given), computed once"""
+    return get_snapshot_store(onto).derive('scorecards', compute_scorecards, snapshot)
@@ -0,0 +1,106 @@
+import math
+
+from ontology.history import parse_period
+from ontology.index import get_kpi_index
+from ontology.snapshot import get_snapshot_store, ontology_version
+
+MAX_BATCH_SIZE = 50000
+
+
+class InvalidUpdate(ValueError):
+    """A batch failed validation; errors lists {'index', 'id', 'error'} per bad item"""
+
+    def __init__(self, errors):
+        super().__init__(f"{len(errors)} invalid update(s)")
+        self.errors = errors
+
+
+class KPIValueUpdater:
+    """
+    Apply batches of {id, actual_value[, period]} updates. A batch is validated
+    as a whole before anything is written, then applied under the reasoner's
+    write lock with snapshot rebuilds held off, so readers see all of it or
+    none of it (and rolled back if a write fails); appended to history when a
+    period is given, and followed by an incremental reasoning run that
+    reclassifies the updated KPIs (see HospitalKPIReasoner.run_incremental).
+    Values and trends are patched into the current snapshot (see
+    SnapshotStore.patch) rather than rebuilding it. With a shared snapshot
+    the whole batch runs inside store.writing(), which publishes the result
+    to the other workers.
+    """
+
+    def __init__(self, onto, reasoner, history=None, max_batch=MAX_BATCH_SIZE):
+        self.onto = onto
+        self.reasoner = reasoner
+        self.history = history
+        self.max_batch = max_batch
+
+    def validate(self, updates):
+        """Return [(kpi id, value, period as datetime64 or None)] or raise InvalidUpdate"""
+        if not isinstance(updates, list) or not updates:
+            raise InvalidUpdate([{'index': None, 'id': None, 'error': "expected a non-empty list of updates"}])
+        if len(updates) > self.max_batch:
+            raise InvalidUpdate([{'index': None, 'id': None,
+                                  'error': f"batch of {len(updates)} exceeds the limit of {self.max_batch}"}])
+
+        index = get_kpi_index(self.onto)
+        parsed, errors = [], []
+        for n, update in enumerate(updates):
+            kpi_id = update.get('id') if isinstance(update, dict) else None
+            try:
+                if kpi_id is None:
+                    raise ValueError("missing id")
+                i = index.row(str(kpi_id))
+                if i is None:
+                    raise ValueError(f"unknown KPI {kpi_id}")
+                value = update.get('actual_value')
+                if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+                    raise ValueError(f"actual_value must be a finite number, got {value!r}")
+                period = update.get('period')
+                when = None if period is None else parse_period(period)
+            except (TypeError, ValueError) as e:
+                errors.append({'index': n, 'id': kpi_id, 'error': str(e)})
+                continue
+            parsed.append((str(index.snapshot.ids[i]), float(value), when))
+        if errors:
+            raise InvalidUpdate(errors)
+        return parsed
+
+    def apply(self, updates):
+        """Validate and apply a batch; returns the incremental ReasoningResult and the KPI ids touched"""
+        parsed = self.validate(updates)
+        store = get_snapshot_store(self.onto)
+        with store.writing(), self.reasoner.write_lock:
+            index = get_kpi_index(self.onto)
+            kpis = {}
+            previous = []
+            with store.write_batch():
+                before = ontology_version(self.onto)
+                with self.onto:
+                    try:
+                        for kpi_id, value, _ in parsed:
+                            kpi = kpis.get(kpi_id)
+                            if kpi is None:
+                                kpi = kpis[kpi_id] = index.get(kpi_id)
+                            previous.append((kpi, kpi.actual_value))
+                            kpi.actual_value = value
+                    except Exception:
+                        for kpi, value in reversed(previous):
+                            kpi.actual_value = value
+                        raise
+                store.patch(before, actual={kpi_id: value for kpi_id, value, _ in parsed})
+
+                if self.history is not None:
+                    dated = [(kpi_id, when, value) for kpi_id, value, when in parsed if when is not None]
+                    for kpi_id, when, value in dated:
+                        self.history.append(kpi_id, when, value)
+                    if dated:
+                        trended = {kpis[kpi_id] for kpi_id, _, _ in dated}
+                        before = ontology_version(self.onto)
+                        with self.onto:
+                            self.history.refresh_trends(self.onto, kpis=trended)
+                        store.patch(before, trends={kpi.name: kpi.trend_direction or 'N/A' for kpi in trended})
+
+            result = self.reasoner.run_incremental(list(kpis))
+        return result, list(kpis)
+
@@ -6,6 +6,11 @@
 const API_BASE = window.location.origin;
 let isReasoningRunning = false;
 
+// Latest KPI records by id and department summaries, patched by the live stream
+const kpiState = new Map();
+let departmentState = {};
+let liveStream = null;
+
 // =============================================================================
 // INITIALIZATION
 // =============================================================================
@@ -29,6 +34,7 @@ document.addEventListener('DOMContentLoaded', function() {
             console.log('✅ Initial data loaded successfully');
             hideLoadingMessage();
             showDashboardContent();
+            connectLiveUpdates();
         })
         .catch(error => {
             console.error('❌ Failed to load initial data:', error);
@@ -60,6 +66,8 @@ async function loadKPIs() {
             return;
         }
         
+        kpiState.clear();
+        kpis.forEach(kpi => kpiState.set(kpi.id, kpi));
         populateKPITable(kpis);
         
     } catch (error) {
@@ -87,6 +95,7 @@ async function loadSummary() {
         
         console.log(`✅ Summary: ${kpis.length} KPIs, ${Object.keys(departments).length} departments`);
         
+        departmentState = departments;
         populateSummaryCards(kpis, departments);
         
     } catch (error) {
@@ -96,6 +105,49 @@ async function loadSummary() {
     }
 }
 
+// =============================================================================
+// LIVE UPDATES (Server-Sent Events)
+// =============================================================================
+function connectLiveUpdates() {
+    if (!window.EventSource || liveStream) return;
+    
+    // EventSource reconnects on its own and resends the last event id as a cursor,
+    // so the server only replays the deltas this page missed
+    liveStream = new EventSource(`${API_BASE}/api/stream`);
+    liveStream.addEventListener('ready', () => console.log('📡 Live updates connected'));
+    liveStream.addEventListener('delta', event => applyDelta(JSON.parse(event.data)));
+    liveStream.addEventListener('reset', () => {
+        console.log('🔄 Live stream cursor expired, reloading data');
+        Promise.all([loadKPIs(), loadSummary()]).catch(error => console.error('❌ Reload failed:', error));
+    });
+    liveStream.onerror = () => console.warn('⚠️ Live update stream interrupted, retrying...');
+}
+
+async function applyDelta(delta) {
+    delta.kpis.forEach(kpi => kpiState.set(kpi.id, kpi));
+    delta.removed.forEach(id => kpiState.delete(id));
+    console.log(`📡 Delta v${delta.version}: ${delta.kpis.length} KPIs changed, ` +
+                `${delta.alerts.raised.length} alerts raised, ${delta.alerts.cleared.length} cleared`);
+    
+    delta.alerts.raised.forEach(alert => {
+        showTemporaryBanner(`${alert.kpi} is now ${alert.status}`,
+                            alert.status === 'critical' ? 'danger' : 'warning');
+    });
+    delta.alerts.cleared.forEach(alert => {
+        showTemporaryBanner(`${alert.kpi} is back to ${alert.status}`, 'success');
+    });
+    
+    const kpis = Array.from(kpiState.values());
+    populateKPITable(kpis);
+    try {
+        const response = await fetch(`${API_BASE}/api/departments`);
+        if (response.ok) departmentState = await response.json();
+    } catch (error) {
+        console.error('❌ Error refreshing departments:', error);
+    }
+    populateSummaryCards(kpis, departmentState);
+}
+
 // =============================================================================
 // UI POPULATION FUNCTIONS
 // =============================================================================
@@ -151,7 +203,7 @@ function populateKPITable(kpis) {
         // Add click handler for detail view
         row.onclick = () => {
             console.log('🔍 Opening details for:', kpi.id);
-            window.location.href = `/api/kpi/${kpi.id}`;
+            window.location.href = `/kpi/${kpi.id}`;
         };
         
         tbody.appendChild(row);
@@ -250,18 +302,9 @@ async function runReasoning() {
     document.getElementById('insights-panel').innerHTML = '<small class="text-muted">Processing...</small>';
     
     try {
-        console.log('📡 Fetching reasoning results...');
-        const response = await fetch(`${API_BASE}/api/reasoning`, {
-            method: 'GET',
-            headers: { 'Accept': 'application/json' }
-        });
-        
-        if (!response.ok) {
-            const errorText = await response.text();
-            throw new Error(`HTTP ${response.status}: ${errorText}`);
-        }
-        
-        const results = await response.json();
+        console.log('📡 Submitting reasoning job...');
+        const job = await submitReasoningJob();
+        const results = job.result;
         console.log('✅ Received reasoning results:', results);
         
         // Populate all panels
@@ -291,6 +334,38 @@ async function runReasoning() {
     }
 }
 
+// Reasoning runs in the background on the server: submit a job (or join the one
+// already running for the current data) and poll until it finishes
+async function submitReasoningJob() {
+    const submitted = await fetch(`${API_BASE}/api/reasoning/jobs`, {
+        method: 'POST',
+        headers: { 'Accept': 'application/json' }
+    });
+    if (!submitted.ok) {
+        const errorText = await submitted.text();
+        throw new Error(`HTTP ${submitted.status}: ${errorText}`);
+    }
+    
+    let job = await submitted.json();
+    while (job.status !== 'done') {
+        if (job.status === 'failed') {
+            throw new Error(job.error || 'Reasoning job failed');
+        }
+        await new Promise(resolve => setTimeout(resolve, 500));
+        const response = await fetch(`${API_BASE}/api/reasoning/jobs/${job.id}`);
+        if (!response.ok) {
+            throw new Error(`HTTP ${response.status}: ${response.statusText}`);
+        }
+        job = await response.json();
+    }
+    
+    if (!job.result) {
+        const response = await fetch(`${API_BASE}/api/reasoning/jobs/${job.id}`);
+        job = await response.json();
+    }
+    return job;
+}
+
 function populateAlerts(alerts) {
     console.log('🚨 Populating alerts:', alerts.length);
     const panel = document.getElementById('alerts-panel');
@@ -309,7 +384,7 @@ function populateAlerts(alerts) {
         
         return `
             <div class="alert alert-${alertClass} alert-dismissible fade show mb-2" role="alert">
-                <strong><i class="bi bi-exclamation-triangle"></i> ${alert.type}</strong><br>
+                <strong><i class="bi bi-exclamation-triangle"></i> ${alert.title || alert.type}</strong><br>
                 ${alert.message}
                 <br><small class="text-muted">Detected: ${new Date(alert.timestamp).toLocaleString()}</small>
                 <button type="button" class="btn-close" data-bs-dismiss="alert"></button>
@@ -369,10 +444,13 @@ function showTemporaryBanner(message, type = 'info') {
     const banner = document.createElement('div');
     banner.className = `alert alert-${type} alert-dismissible fade show position-fixed top-0 start-50 translate-middle-x mt-2`;
     banner.style.zIndex = '1050';
-    banner.innerHTML = `
-        ${message}
-        <button type="button" class="btn-close" data-bs-dismiss="alert"></button>
-    `;
+    // Messages carry server-provided names, so they go in as text, never markup
+    banner.textContent = message;
+    const close = document.createElement('button');
+    close.type = 'button';
+    close.className = 'btn-close';
+    close.dataset.bsDismiss = 'alert';
+    banner.appendChild(close);
     
     document.body.appendChild(banner);
     
@@ -4,12 +4,15 @@ import os
 import json
 from datetime import datetime
 
+import numpy as np
+
 # Add parent directory to path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from ontology.data import load_kpi_data
 from services.reasoning_engine import HospitalKPIReasoner
 from services.analytics import KPIAnalytics
+from app import create_app
 from owlready2 import *
 
 class TestHospitalKPIOntology(unittest.TestCase):
@@ -22,6 +25,7 @@ class TestHospitalKPIOntology(unittest.TestCase):
         cls.ontology = load_kpi_data()
         cls.reasoner = HospitalKPIReasoner(cls.ontology)
         cls.analytics = KPIAnalytics(cls.ontology)
+        cls.app = create_app(cls.ontology)
         
         # Verify ontology loaded
         cls.kpis = list(cls.ontology.KPI.instances())
@@ -103,15 +107,14 @@ class TestHospitalKPIOntology(unittest.TestCase):
         
         # Run semantic reasoning
         for kpi in self.kpis:
-            ratio = (kpi.actual_value / kpi.target_value) * 100
-            
-            # Expected classification
-            if ratio >= 100:
-                expected_status = self.ontology.Normal
-            elif ratio >= 95:
+            # Expected classification, in the KPI's own direction
+            sign = -1 if kpi.polarity == 'lower_is_better' else 1
+            if sign * kpi.actual_value < sign * kpi.critical_threshold:
+                expected_status = self.ontology.Critical
+            elif sign * kpi.actual_value < sign * kpi.warning_threshold:
                 expected_status = self.ontology.Warning
             else:
-                expected_status = self.ontology.Critical
+                expected_status = self.ontology.Normal
             
             # Check alert level is set
             self.assertTrue(hasattr(kpi, 'has_alert_level'))
@@ -390,6 +393,1378 @@ class TestHospitalKPIOntology(unittest.TestCase):
         
         print(f"✅ Performance acceptable: {elapsed:.2f}s for 10 runs")
 
+    def test_kpi_snapshot_tracks_ontology_changes(self):
+        """Test columnar KPI snapshot is reused until the ontology changes"""
+        print("\n🧮 Testing KPI snapshot store...")
+
+        from ontology.snapshot import get_snapshot_store
+
+        store = get_snapshot_store(self.ontology)
+        snapshot = store.get()
+        self.assertEqual(snapshot.size, len(self.kpis))
+        self.assertIs(store.get(), snapshot, "Snapshot should be cached between calls")
+
+        i = snapshot.index['ED_Wait_Time']
+        ed_wait = self.ontology.search_one(iri="*ED_Wait_Time")
+        self.assertAlmostEqual(snapshot.actual[i], ed_wait.actual_value)
+        self.assertEqual(snapshot.record(i)['department'], 'Emergency Department')
+
+        original_wait = ed_wait.actual_value
+        try:
+            ed_wait.actual_value = 50.0
+            rebuilt = store.get()
+            self.assertIsNot(rebuilt, snapshot, "Snapshot should rebuild after a change")
+            self.assertAlmostEqual(rebuilt.actual[rebuilt.index['ED_Wait_Time']], 50.0)
+        finally:
+            ed_wait.actual_value = original_wait
+
+        print("✅ Snapshot store rebuilds only on ontology changes")
+
+    def test_batch_classification_reuses_alert_levels(self):
+        """Test repeated reasoning reuses alert level individuals and writes nothing new"""
+        print("\n🧮 Testing batch alert classification...")
+
+        from ontology.snapshot import ontology_version
+
+        self.reasoner.run_reasoning()
+        level_count = len(list(self.ontology.AlertLevel.instances()))
+        version = ontology_version(self.ontology)
+
+        for _ in range(3):
+            self.reasoner.run_reasoning()
+
+        self.assertEqual(len(list(self.ontology.AlertLevel.instances())), level_count,
+                         "Alert level individuals should not accumulate")
+        self.assertEqual(ontology_version(self.ontology), version,
+                         "Unchanged KPIs should not be written back")
+
+        critical_levels = {kpi.has_alert_level[0] for kpi in self.kpis
+                           if isinstance(kpi.has_alert_level[0], self.ontology.Critical)}
+        self.assertLessEqual(len(critical_levels), 1)
+
+        print("✅ Batch classification writes only changed KPIs")
+
+    def test_kpi_index_lookup(self):
+        """Test name/IRI lookup and secondary indexes"""
+        print("\n🔎 Testing KPI index...")
+
+        from ontology.index import get_kpi_index
+
+        index = get_kpi_index(self.ontology)
+        ed_wait = self.ontology.search_one(iri="*ED_Wait_Time")
+        self.assertIs(index.get('ED_Wait_Time'), ed_wait)
+        self.assertIs(index.get(ed_wait.iri), ed_wait)
+        self.assertIsNone(index.get('No_Such_KPI'))
+
+        ed_kpis = self.analytics.get_kpis(department='Emergency Department')
+        self.assertEqual({k.name for k in ed_kpis},
+                         {'ED_Wait_Time', 'ED_LWBS', 'ED_Mortality_Rate'})
+
+        safety_monthly = self.analytics.get_kpis(category='Safety', period='Monthly')
+        self.assertEqual([k.name for k in safety_monthly], ['ED_Mortality_Rate'])
+
+        print("✅ KPI index resolves names, IRIs and filters")
+
+    def test_rule_engine_incremental_evaluation(self):
+        """Test declarative rules compile and re-evaluate only affected rules"""
+        print("\n📜 Testing declarative rule engine...")
+
+        from ontology.snapshot import get_snapshot_store
+        from services.rule_engine import RuleEngine
+
+        engine = RuleEngine([
+            {"id": "Occupancy_High", "level": "WARNING", "message": "ICU occupancy high",
+             "all": [{"kpi": "ICU_Occupancy_Rate", "op": ">=", "value": 90}]},
+            {"id": "Infection_Or_Margin", "level": "CRITICAL", "message": "Infection or margin",
+             "any": [{"kpi": "ICU_CLABSI_Rate", "op": ">", "value": 1.5},
+                     {"kpi": "Hospital_Operating_Margin", "op": "<", "value": 1.0}]},
+        ])
+        self.assertEqual(list(engine.affected_rules(['ICU_CLABSI_Rate'])), [1])
+
+        store = get_snapshot_store(self.ontology)
+        self.assertEqual(engine.evaluate(store.get()), [])
+
+        occupancy = self.ontology.search_one(iri="*ICU_Occupancy_Rate")
+        margin = self.ontology.search_one(iri="*Hospital_Operating_Margin")
+        original = occupancy.actual_value, margin.actual_value
+        layout = store.get().layout
+        try:
+            occupancy.actual_value = 96.0
+            fired = engine.evaluate(store.get())
+            self.assertEqual([r.id for r in fired], ['Occupancy_High'])
+            self.assertEqual(store.get().layout, layout, "Value changes keep the snapshot layout")
+
+            # changed= re-tests only the listed KPIs' rules; the margin move is
+            # not absorbed, so the next diff still catches it
+            margin.actual_value = 0.5
+            fired = engine.evaluate(store.get(), changed=['ICU_Occupancy_Rate'])
+            self.assertEqual([r.id for r in fired], ['Occupancy_High'])
+            fired = engine.evaluate(store.get())
+            self.assertEqual([r.id for r in fired], ['Occupancy_High', 'Infection_Or_Margin'])
+
+            alerts = self.reasoner.run_reasoning()['alerts']
+            self.assertIn(('Financial_Stress', 'Financial Stress'), [(a['type'], a['title']) for a in alerts])
+        finally:
+            occupancy.actual_value, margin.actual_value = original
+            self.reasoner.run_reasoning()
+        self.assertEqual(engine.evaluate(store.get()), [])
+
+        with self.assertRaises(ValueError):
+            RuleEngine([{"id": "Bad", "message": "x", "all": [{"kpi": "ED_LWBS", "op": "~", "value": 1}]}])
+
+        print("✅ Rule engine evaluates declarative rules incrementally")
+
+    def test_incremental_reasoning_follows_affects(self):
+        """Test incremental reasoning reclassifies the changed KPIs and re-checks rules over their closure"""
+        print("\n🔁 Testing incremental reasoning...")
+
+        from ontology.graph import get_dependency_graph
+        from ontology.index import get_kpi_index
+
+        self.reasoner.run_reasoning()
+        index = get_kpi_index(self.ontology)
+        closure = get_dependency_graph(self.ontology).closure([index.row('ED_Wait_Time')])
+        self.assertEqual(set(index.snapshot.ids[closure]),
+                         {'ED_Wait_Time', 'ED_LWBS', 'Patient_Satisfaction_Score'})
+
+        ed_wait = self.ontology.search_one(iri="*ED_Wait_Time")
+        occupancy = self.ontology.search_one(iri="*ICU_Occupancy_Rate")
+        lwbs = self.ontology.search_one(iri="*ED_LWBS")
+        originals = [(kpi, kpi.actual_value) for kpi in (ed_wait, occupancy, lwbs)]
+        occupancy_level = occupancy.has_alert_level[0]
+        lwbs_level = lwbs.has_alert_level[0]
+        try:
+            # Create a cycle: ED_LWBS -> ED_Wait_Time -> ED_LWBS
+            lwbs.affects.append(ed_wait)
+            ed_wait.actual_value = 90.0
+            lwbs.actual_value = 10.0
+            occupancy.actual_value = 1.0
+            result = self.reasoner.run_incremental(['ED_Wait_Time'])
+
+            self.assertIsInstance(ed_wait.has_alert_level[0], self.ontology.Critical)
+            self.assertIs(lwbs.has_alert_level[0], lwbs_level,
+                          "Only the KPIs reported as changed are reclassified")
+            self.assertIs(occupancy.has_alert_level[0], occupancy_level)
+            # Rules over the closure (ED_LWBS is downstream of ED_Wait_Time) are re-checked
+            self.assertIn('ED_Capacity_Crisis', [a['type'] for a in result['alerts']])
+        finally:
+            lwbs.affects.remove(ed_wait)
+            for kpi, value in originals:
+                kpi.actual_value = value
+            self.reasoner.run_reasoning()
+
+        print("✅ Incremental reasoning limited to dependent KPIs")
+
+    def test_api_etag_and_compression(self):
+        """Test cached API responses honour If-None-Match and Accept-Encoding"""
+        print("\n📦 Testing cached API responses...")
+
+        import gzip
+        from flask import Flask
+        from api.routes import init_api
+
+        app = Flask(__name__)
+        app.register_blueprint(init_api(self.ontology))
+
+        with app.test_client() as client:
+            first = client.get('/api/kpis')
+            self.assertEqual(first.status_code, 200)
+            etag = first.headers['ETag']
+
+            revalidated = client.get('/api/kpis', headers={'If-None-Match': etag})
+            self.assertEqual(revalidated.status_code, 304)
+
+            compressed = client.get('/api/kpis', headers={'Accept-Encoding': 'gzip'})
+            self.assertEqual(compressed.headers['Content-Encoding'], 'gzip')
+            self.assertEqual(json.loads(gzip.decompress(compressed.data)), first.get_json())
+
+            ed_wait = self.ontology.search_one(iri="*ED_Wait_Time")
+            original_wait = ed_wait.actual_value
+            try:
+                ed_wait.actual_value = original_wait + 1
+                changed = client.get('/api/kpis', headers={'If-None-Match': etag})
+                self.assertEqual(changed.status_code, 200)
+                self.assertNotEqual(changed.headers['ETag'], etag)
+            finally:
+                ed_wait.actual_value = original_wait
+
+        print("✅ API responses are cached per ontology version")
+
+    def test_persistent_quadstore_roundtrip(self):
+        """Test the ontology persists to a quadstore and reopens without rebuilding"""
+        print("\n💾 Testing persistent quadstore...")
+
+        import tempfile
+        from ontology.store import load_persistent_kpi_data, stored_fingerprint, source_fingerprint
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'kpis.sqlite3')
+            onto = load_persistent_kpi_data(path)
+            self.assertEqual(stored_fingerprint(path), source_fingerprint())
+            built_at = os.path.getmtime(path)
+
+            reopened = load_persistent_kpi_data(path)
+            self.assertEqual(os.path.getmtime(path), built_at, "Fresh store should not be rebuilt")
+            self.assertEqual(len(list(reopened.KPI.instances())), len(self.kpis))
+            self.assertAlmostEqual(reopened.ED_Wait_Time.actual_value,
+                                   self.ontology.search_one(iri="*ED_Wait_Time").actual_value)
+
+            # Writes stay private to the worker's in-memory copy
+            reopened.ED_Wait_Time.actual_value = 99.0
+            third = load_persistent_kpi_data(path)
+            self.assertNotEqual(third.ED_Wait_Time.actual_value, 99.0)
+            for world in (onto.world, reopened.world, third.world):
+                world.close()
+
+        print("✅ Quadstore reopens without rebuilding the ontology")
+
+    def test_bulk_ingestion_from_csv(self):
+        """Test bulk loader links KPIs to shared department/category/unit individuals"""
+        print("\n📥 Testing bulk KPI ingestion...")
+
+        import tempfile
+        from owlready2 import World
+        from ontology.ingest import BulkLoader, FileBuilder
+
+        with tempfile.TemporaryDirectory() as tmp:
+            definitions = os.path.join(tmp, 'kpis.csv')
+            values = os.path.join(tmp, 'values.csv')
+            with open(definitions, 'w') as f:
+                f.write("id,name,department,categories,unit,time_period,actual_value,target_value,weight\n"
+                        "Pharm_Errors,Dispensing Errors,Pharmacy Services,Safety|QualityOfCare,Percentage,Monthly,0.4,0.5,0.9\n"
+                        "Pharm_TAT,Order Turnaround,Pharmacy Services,Efficiency,Minutes,Weekly,42,30,0.7\n")
+            with open(values, 'w') as f:
+                f.write("id,actual_value,period\nPharm_TAT,40,2024-01\nPharm_TAT,35,2024-02\n")
+
+            world = World()
+            onto = FileBuilder(definitions, values, chunksize=1)(world)
+            errors, tat = onto.Pharm_Errors, onto.Pharm_TAT
+
+            self.assertEqual(errors.kpi_name, 'Dispensing Errors')
+            self.assertIs(errors.belongs_to_department[0], tat.belongs_to_department[0])
+            self.assertEqual(errors.belongs_to_department[0].dept_name, 'Pharmacy Services')
+            self.assertEqual(len(list(onto.Department.instances())), 1)
+            self.assertIsInstance(errors.belongs_to_category[0], onto.Safety)
+            self.assertEqual(tat.actual_value, 35.0, "Last value row should win")
+
+            # Bad rows are skipped and reported; the rest of the chunk still applies
+            with open(values, 'w') as f:
+                f.write("id,actual_value\nPharm_TAT,33\nNope,1\nPharm_Errors,abc\nPharm_Errors,0.3\n")
+            loader = BulkLoader(onto, chunksize=10)
+            self.assertEqual(loader.load_values(values), 2)
+            self.assertEqual([(n, kpi_id) for n, kpi_id, _ in loader.rejected], [(2, 'Nope'), (3, 'Pharm_Errors')])
+            self.assertEqual((tat.actual_value, errors.actual_value), (33.0, 0.3))
+
+            # A bad period mid-chunk rejects its row before anything is written for it
+            from ontology.history import HistoryStore
+            with open(values, 'w') as f:
+                f.write("id,actual_value,period\nPharm_TAT,31,2024-03\nPharm_Errors,0.2,someday\nPharm_TAT,30,2024-04\n")
+            history = HistoryStore()
+            loader = BulkLoader(onto, chunksize=10, history=history)
+            self.assertEqual(loader.load_values(values), 2)
+            self.assertEqual([(n, kpi_id) for n, kpi_id, _ in loader.rejected], [(2, 'Pharm_Errors')])
+            self.assertEqual((tat.actual_value, errors.actual_value), (30.0, 0.3))
+            self.assertEqual(len(history.range('Pharm_TAT')[1]), 2)
+            self.assertIsNone(history.series('Pharm_Errors'))
+            world.close()
+
+        print("✅ Bulk loader ingests CSV definitions and values")
+
+    def test_kpi_history_store_and_endpoint(self):
+        """Test time-series history append, range, downsampling and trend"""
+        print("\n📈 Testing KPI history...")
+
+        import tempfile
+        from flask import Flask
+        from api.routes import init_api
+        from ontology.history import HistoryStore
+
+        with tempfile.TemporaryDirectory() as tmp:
+            history = HistoryStore(tmp)
+            for week, value in enumerate([30, 31, 33, 34, 36, 38, 40, 41]):
+                history.append('ED_Wait_Time', np.datetime64('2024-01-01') + np.timedelta64(7 * week, 'D'), value)
+            history.append('ED_Wait_Time', '2024-01-01', 29)  # correction overwrites in place
+
+            reopened = HistoryStore(tmp)
+            times, values = reopened.range('ED_Wait_Time', start='2024-01-08', end='2024-01-22')
+            self.assertEqual(list(values), [31.0, 33.0, 34.0])
+
+            months, means = reopened.downsample('ED_Wait_Time', 'M')
+            self.assertEqual([str(m) for m in months], ['2024-01', '2024-02'])
+            self.assertAlmostEqual(means[0], (29 + 31 + 33 + 34 + 36) / 5)
+            self.assertEqual(reopened.trend('ED_Wait_Time'), 'up')
+
+            # ISO weeks: Monday 2024-01-01 starts its own week
+            weeks, _ = reopened.downsample('ED_Wait_Time', 'W', end='2024-01-15', how='last')
+            self.assertEqual([str(w) for w in weeks], ['2024-01-01', '2024-01-08', '2024-01-15'])
+            history.append('ED_Wait_Time', '2024-01-07', 30)  # a Sunday
+            weeks, _ = history.downsample('ED_Wait_Time', 'W', end='2024-01-07')
+            self.assertEqual([str(w) for w in weeks], ['2024-01-01'])
+
+            app = Flask(__name__)
+            app.register_blueprint(init_api(self.ontology, reopened))
+            with app.test_client() as client:
+                data = client.get('/api/kpi/ED_Wait_Time/history?bucket=period').get_json()
+                self.assertEqual(data['bucket'], 'M')
+                self.assertEqual(len(data['points']), 2)
+                self.assertEqual(client.get('/api/kpi/ED_Wait_Time/history?bucket=X').status_code, 400)
+                self.assertEqual(client.get('/api/kpi/Nope/history').status_code, 404)
+
+        # The demo data ships with history, and trends are derived from it
+        from owlready2 import World
+        from ontology.data import load_demo_history, DEMO_HISTORY
+        world = World()
+        demo = load_kpi_data(world)
+        demo.Hospital_Operating_Margin.trend_direction = 'up'
+        demo_history = HistoryStore()
+        load_demo_history(demo, demo_history)
+        self.assertEqual(demo.Hospital_Operating_Margin.trend_direction, 'down')
+        times, values = demo_history.range('Hospital_Operating_Margin')
+        self.assertEqual(list(values), DEMO_HISTORY['Hospital_Operating_Margin'])
+        self.assertEqual(str(times[-1].astype('datetime64[M]')), '2024-06')
+        self.assertEqual(str(times[-2].astype('datetime64[M]')), '2024-03', "Quarterly KPIs step by quarter")
+        world.close()
+
+        print("✅ KPI history supports range and downsampling queries")
+
+    def test_shared_memory_snapshot_swap(self):
+        """Test workers read the published snapshot from shared memory and follow swaps"""
+        print("\n🧠 Testing shared-memory snapshot...")
+
+        from owlready2 import World
+        from ontology.data import load_kpi_data
+        from ontology.snapshot import KPISnapshot, ontology_version
+        from ontology.shared import SnapshotPublisher, SharedSnapshotStore, SharedSnapshot, _attach, segment_name
+
+        # Master and worker each have their own world, as they would in their own processes
+        master = load_kpi_data(World())
+        worker = load_kpi_data(World())
+        prefix = f"hkpi-test-{os.getpid()}"
+        store = SharedSnapshotStore(worker, prefix)
+        before = store.get()
+
+        publisher = SnapshotPublisher(prefix)
+        try:
+            local = KPISnapshot(master)
+            publisher.publish(local)
+            segment = _attach(segment_name(prefix, 1))
+            shared = SharedSnapshot(segment, 1)
+            segment.close()
+            self.assertEqual(shared.records(), local.records())
+            self.assertEqual(shared.index.get('ED_LWBS'), local.index['ED_LWBS'])
+            self.assertFalse(shared.actual.flags.writeable)
+            # Columns outlive the segment handle and the snapshot they came from
+            kept = shared.actual
+            del shared
+            import gc
+            gc.collect()
+            self.assertEqual(kept[local.index['ED_LWBS']], local.actual[local.index['ED_LWBS']])
+
+            # Workers serve their own snapshot; an identical generation changes nothing
+            self.assertIs(store.get(), before)
+
+            master.search_one(iri="*ED_Wait_Time").actual_value = 77.0
+            publisher.publish(KPISnapshot(master))
+            swapped = store.get()
+            self.assertNotIsInstance(swapped, SharedSnapshot)
+            self.assertEqual(swapped.actual[swapped.index['ED_Wait_Time']], 77.0)
+            self.assertIs(swapped.ids, before.ids, "A value-only generation is patched in, not rebuilt")
+            self.assertEqual(store.version(), ontology_version(worker))
+            # Taking up a generation brings the worker's own ontology in line with it
+            ed_wait = worker.search_one(iri="*ED_Wait_Time")
+            self.assertEqual(ed_wait.actual_value, 77.0)
+
+            # A write to the worker's own ontology is served from it until the next publish
+            ed_wait.actual_value = 55.0
+            own = store.get()
+            self.assertEqual(own.actual[own.index['ED_Wait_Time']], 55.0)
+            self.assertEqual(store.version(), own.version)
+            publisher.publish(KPISnapshot(master))
+            self.assertEqual(store.get().actual[own.index['ED_Wait_Time']], 77.0)
+            self.assertEqual(ed_wait.actual_value, 77.0)
+        finally:
+            publisher.close()
+            master.world.close()
+            worker.world.close()
+
+        print("✅ Shared snapshot published and swapped atomically")
+
+    def test_group_aggregates(self):
+        """Test vectorized department/category/period aggregation and its caching"""
+        from ontology.snapshot import get_snapshot_store
+        from services.aggregation import get_aggregates
+
+        store = get_snapshot_store(self.ontology)
+        aggregates = get_aggregates(self.ontology)
+        self.assertIs(get_aggregates(self.ontology), aggregates)
+
+        snap = store.get()
+        by_dept = aggregates['department']
+        self.assertEqual(sum(d['total_kpis'] for d in by_dept.values()), snap.size)
+        self.assertEqual(sum(d['critical_count'] for d in by_dept.values()),
+                         int((snap.status_codes == 2).sum()))
+        self.assertEqual(sum(c['total_kpis'] for c in aggregates['category'].values()),
+                         len(snap.category_codes))
+        self.assertEqual(self.analytics.get_summary('time_period'), aggregates['time_period'])
+
+        # A department with only good KPIs scores 100, only critical KPIs 0
+        for name, data in by_dept.items():
+            if data['good_count'] == data['total_kpis']:
+                self.assertEqual(data['health_score'], 100)
+            if data['critical_count'] == data['total_kpis']:
+                self.assertEqual(data['health_score'], 0)
+        with self.assertRaises(ValueError):
+            self.analytics.get_summary('unit')
+
+    def test_sse_stream_deltas_and_resume(self):
+        """Test /api/stream sends only KPI deltas and resumes from a cursor"""
+        print("\n📡 Testing live update stream...")
+
+        from flask import Flask
+        from api.routes import init_api
+
+        def parse(body):
+            events = []
+            for block in body.decode().strip().split('\n\n'):
+                fields = dict(line.split(': ', 1) for line in block.split('\n') if not line.startswith(':'))
+                if 'event' in fields:
+                    events.append((fields['event'], fields['id'], json.loads(fields['data'])))
+            return events
+
+        app = Flask(__name__)
+        app.register_blueprint(init_api(self.ontology))
+        ed_wait = self.ontology.search_one(iri="*ED_Wait_Time")
+        original_wait = ed_wait.actual_value
+
+        with app.test_client() as client:
+            [(event, cursor, _)] = parse(client.get('/api/stream?once=1').data)
+            self.assertEqual(event, 'ready')
+            try:
+                ed_wait.actual_value = ed_wait.critical_threshold * 2
+                [(event, cursor, delta)] = parse(
+                    client.get('/api/stream?once=1', headers={'Last-Event-ID': cursor}).data)
+                self.assertEqual(event, 'delta')
+                self.assertEqual([kpi['id'] for kpi in delta['kpis']], ['ED_Wait_Time'])
+                self.assertEqual(delta['alerts']['raised'][0]['status'], 'critical')
+            finally:
+                ed_wait.actual_value = original_wait
+
+            [(event, cursor, delta)] = parse(client.get(f'/api/stream?once=1&cursor={cursor}').data)
+            self.assertEqual(delta['alerts']['cleared'][0]['kpi'], 'ED_Wait_Time')
+
+            # Nothing new since the last cursor; an unknown cursor forces a reload
+            self.assertEqual(client.get(f'/api/stream?once=1&cursor={cursor}').data, b'retry: 3000\n\n')
+            [(event, _, _)] = parse(client.get('/api/stream?once=1&cursor=stale:3').data)
+            self.assertEqual(event, 'reset')
+
+            # Streams end after SSE_MAX_DURATION and are turned away past SSE_MAX_STREAMS
+            app.config['SSE_MAX_DURATION'] = 0
+            self.assertEqual(client.get(f'/api/stream?cursor={cursor}').data, b'retry: 3000\n\n')
+            app.config['SSE_MAX_STREAMS'] = 0
+            body = client.get('/api/stream?once=1').data.decode()
+            self.assertRegex(body, r'^retry: \d+\n\n$')
+
+        print("✅ Stream delivers deltas and resumes from cursors")
+
+    def test_background_reasoning_jobs(self):
+        """Test reasoning jobs run in the background, deduplicate and serve the last result"""
+        print("\n⏳ Testing background reasoning jobs...")
+
+        import threading
+        from flask import Flask
+        from api.routes import init_api
+        from services.jobs import JobQueue, DONE
+
+        version = [1]
+        release = threading.Event()
+        runs = []
+
+        def run():
+            release.wait(5)
+            runs.append(version[0])
+            return {'version': version[0]}, version[0]
+
+        queue = JobQueue(run, lambda: version[0])
+        first = queue.submit()
+        self.assertIs(queue.submit(), first, "Concurrent identical submissions share a job")
+        release.set()
+        self.assertTrue(first.wait(5))
+        self.assertEqual(first.status, DONE)
+        self.assertIs(queue.submit(), first, "Completed job stays current until the version moves")
+        version[0] = 2
+        second = queue.submit()
+        self.assertIsNot(second, first)
+        second.wait(5)
+        self.assertEqual(runs, [1, 2])
+        self.assertEqual(queue.get(first.id).result, {'version': 1})
+        queue.shutdown()
+
+        # A run's own alert-level writes keep its result current; an update racing it doesn't
+        from services.reasoning_engine import HospitalKPIReasoner
+        from services.updates import KPIValueUpdater
+        from ontology.snapshot import get_snapshot_store
+        from api.routes import _reason
+        onto = load_kpi_data(World())
+        reasoner = HospitalKPIReasoner(onto)
+        store = get_snapshot_store(onto)
+        queue = JobQueue(lambda: _reason(reasoner), store.version)
+        job = queue.submit(inline=True)
+        self.assertTrue(queue.is_current(job), "The run's alert-level writes must not make it stale")
+        self.assertIs(queue.submit(inline=True), job)
+
+        updater = KPIValueUpdater(onto, reasoner)
+        updater.apply([{'id': 'ED_Wait_Time', 'actual_value': 300.0}])
+        reason = reasoner._rule_based_inference
+        def racing(run, changed=None):
+            del reasoner._rule_based_inference  # the update's own incremental run must not race again
+            updater.apply([{'id': 'ED_Wait_Time', 'actual_value': 400.0}])
+            return reason(run, changed)
+        reasoner._rule_based_inference = racing
+        raced = queue.submit(inline=True)
+        self.assertEqual(raced.status, DONE)
+        self.assertFalse(queue.is_current(raced), "An update during the run must leave its result stale")
+        self.assertIsNot(queue.submit(inline=True), raced)
+        queue.shutdown()
+
+        app = Flask(__name__)
+        app.register_blueprint(init_api(self.ontology))
+        with app.test_client() as client:
+            response = client.get('/api/reasoning')
+            self.assertEqual(response.status_code, 200)
+            data = response.get_json()
+            for key in ('alerts', 'insights', 'recommendations'):
+                self.assertIn(key, data)
+
+            submitted = client.post('/api/reasoning/jobs')
+            self.assertIn(submitted.status_code, (200, 202))
+            job = submitted.get_json()
+            self.assertTrue(submitted.headers['Location'].endswith(job['id']))
+            self.assertEqual(client.get(f"/api/reasoning/jobs/{job['id']}").status_code, 200)
+            self.assertEqual(client.get('/api/reasoning/jobs/missing').status_code, 404)
+
+        print("✅ Reasoning jobs are deduplicated and served from the last result")
+
+    def test_reasoning_results_are_immutable_and_bounded(self):
+        """Test each run returns its own read-only result and history stays bounded"""
+        print("\n🧵 Testing reasoning result isolation...")
+
+        from concurrent.futures import ThreadPoolExecutor
+        from services.reasoning_engine import HospitalKPIReasoner
+
+        reasoner = HospitalKPIReasoner(self.ontology, history_size=3)
+        first = reasoner.run_reasoning()
+        second = reasoner.run_reasoning()
+        self.assertIsNot(first, second)
+        self.assertEqual(len(second['alerts']), len(first['alerts']),
+                         "Alerts must not accumulate across runs")
+        with self.assertRaises(TypeError):
+            first['alerts'].append({'level': 'CRITICAL'})
+        with self.assertRaises(TypeError):
+            first['insights'] = []
+
+        with ThreadPoolExecutor(4) as pool:
+            results = list(pool.map(lambda _: reasoner.run_reasoning(), range(8)))
+        self.assertTrue(all([a['type'] for a in r['alerts']] == [a['type'] for a in first['alerts']]
+                            for r in results))
+        self.assertEqual(len(reasoner.history), 3)
+        self.assertIs(reasoner.results, reasoner.history[-1])
+        self.assertEqual(json.loads(json.dumps(first.to_dict()))['alerts'], list(first['alerts']))
+
+        print("✅ Reasoning runs are isolated, immutable and bounded")
+
+    def test_kpis_pagination_projection_and_filters(self):
+        """Test /api/kpis filters through the index, projects fields and pages by cursor"""
+        print("\n📑 Testing /api/kpis pagination and filtering...")
+
+        from flask import Flask
+        from api.routes import init_api
+        from ontology.snapshot import get_snapshot_store
+
+        app = Flask(__name__)
+        app.register_blueprint(init_api(self.ontology))
+        snapshot = get_snapshot_store(self.ontology).get()
+
+        with app.test_client() as client:
+            full = client.get('/api/kpis').get_json()
+            self.assertEqual(full, snapshot.records())
+
+            ed = client.get('/api/kpis?department=Emergency Department&fields=id,status').get_json()
+            self.assertEqual({k['id'] for k in ed},
+                             {k['id'] for k in full if k['department'] == 'Emergency Department'})
+            self.assertTrue(all(set(k) == {'id', 'status'} for k in ed))
+
+            self.reasoner.run_reasoning()
+            critical = client.get('/api/kpis?alert_level=Critical&fields=id,alert_level').get_json()
+            self.assertTrue(all(k['alert_level'] == 'critical' for k in critical))
+            failing = client.get('/api/kpis?status=Warning&fields=id,status').get_json()
+            self.assertTrue(failing)
+            self.assertTrue(all(k['status'] == 'warning' for k in failing))
+
+            # status follows the values, alert_level what the reasoner stored: until
+            # the next run, a KPI whose level was reset still has a warning status
+            ids = lambda url: {k['id'] for k in client.get(url + '&fields=id').get_json()}
+            kpi = self.ontology[failing[0]['id']]
+            self.assertIn(kpi.name, ids('/api/kpis?alert_level=warning'))
+            stored = list(kpi.has_alert_level)
+            with self.ontology:
+                kpi.has_alert_level = []
+            try:
+                self.assertIn(kpi.name, ids('/api/kpis?status=warning'))
+                self.assertIn(kpi.name, ids('/api/kpis?alert_level=unknown'))
+                self.assertNotIn(kpi.name, ids('/api/kpis?alert_level=warning'))
+            finally:
+                with self.ontology:
+                    kpi.has_alert_level = stored
+            self.assertEqual(client.get('/api/kpis?trend=nowhere').get_json(), [])
+
+            seen, cursor = [], None
+            while True:
+                url = '/api/kpis?limit=4&fields=id' + (f'&cursor={cursor}' if cursor else '')
+                page = client.get(url).get_json()
+                self.assertEqual(page['total'], len(full))
+                seen += [k['id'] for k in page['items']]
+                cursor = page['next_cursor']
+                if cursor is None:
+                    break
+            self.assertEqual(seen, sorted(k['id'] for k in full))
+
+            self.assertEqual(client.get('/api/kpis?fields=id,bogus').status_code, 400)
+            self.assertEqual(client.get('/api/kpis?limit=0').status_code, 400)
+            self.assertEqual(client.get('/api/kpis?limit=5&cursor=%%%').status_code, 400)
+
+        print("✅ /api/kpis supports filters, projection and cursors")
+
+    def test_kpi_detail_neighborhood(self):
+        """Test /api/kpi/<id> returns details and an N-hop dependency neighborhood"""
+        print("\n🔎 Testing KPI detail endpoint...")
+
+        from flask import Flask
+        from api.routes import init_api
+        from ontology.graph import within_hops
+
+        indptr = np.array([0, 1, 2, 3, 3])
+        indices = np.array([1, 2, 0])  # 0 -> 1 -> 2 -> 0 cycle, 3 isolated
+        rows, hops = within_hops(indptr, indices, 0, 5)
+        self.assertEqual(rows.tolist(), [1, 2])
+        self.assertEqual(hops.tolist(), [1, 2])
+
+        app = Flask(__name__)
+        app.register_blueprint(init_api(self.ontology))
+        with app.test_client() as client:
+            detail = client.get('/api/kpi/ED_Wait_Time').get_json()
+            self.assertEqual(detail['department'], 'Emergency Department')
+            self.assertEqual(detail['unit'], 'Minutes')
+            self.assertEqual(detail['time_period'], 'Monthly')
+            self.assertIn('Efficiency', detail['categories'])
+            self.assertEqual({k['id'] for k in detail['neighborhood']['affects']},
+                             {'ED_LWBS', 'Patient_Satisfaction_Score'})
+
+            upstream = client.get('/api/kpi/ED_LWBS').get_json()['neighborhood']['depends_on']
+            self.assertIn('ED_Wait_Time', [k['id'] for k in upstream])
+
+            self.assertEqual(client.get('/api/kpi/Nope').status_code, 404)
+            self.assertEqual(client.get('/api/kpi/ED_Wait_Time?hops=99').status_code, 400)
+
+        print("✅ KPI detail includes its dependency neighborhood")
+
+    def test_batch_value_update_endpoint(self):
+        """Test POST /api/kpis/values validates in bulk and applies atomically"""
+        print("\n📥 Testing batch KPI value updates...")
+
+        from flask import Flask
+        from api.routes import init_api
+        from ontology.history import HistoryStore
+        from ontology.snapshot import ontology_version
+
+        history = HistoryStore()
+        app = Flask(__name__)
+        app.register_blueprint(init_api(self.ontology, history))
+        ed_wait = self.ontology.search_one(iri="*ED_Wait_Time")
+        lwbs = self.ontology.search_one(iri="*ED_LWBS")
+        originals = [(kpi, kpi.actual_value) for kpi in (ed_wait, lwbs)]
+
+        with app.test_client() as client:
+            version = ontology_version(self.ontology)
+            bad = client.post('/api/kpis/values', json=[
+                {'id': 'ED_Wait_Time', 'actual_value': 1.0},
+                {'id': 'Nope', 'actual_value': 1.0},
+                {'id': 'ED_LWBS', 'actual_value': 'high'},
+            ])
+            self.assertEqual(bad.status_code, 400)
+            self.assertEqual([e['index'] for e in bad.get_json()['errors']], [1, 2])
+            self.assertEqual(ontology_version(self.ontology), version, "Invalid batch must write nothing")
+            self.assertEqual(ed_wait.actual_value, originals[0][1])
+
+            try:
+                ok = client.post('/api/kpis/values', json={'updates': [
+                    {'id': 'ED_Wait_Time', 'actual_value': 90.0, 'period': '2024-01-31'},
+                    {'id': 'ED_LWBS', 'actual_value': 0.1},
+                ]})
+                self.assertEqual(ok.status_code, 200)
+                self.assertEqual(ok.get_json()['applied'], 2)
+                self.assertEqual(ed_wait.actual_value, 90.0)
+                self.assertIsInstance(ed_wait.has_alert_level[0], self.ontology.Critical)
+                self.assertEqual(len(history.range('ED_Wait_Time')[1]), 1)
+                kpis = {k['id']: k for k in client.get('/api/kpis').get_json()}
+                self.assertEqual(kpis['ED_LWBS']['actual'], 0.1)
+            finally:
+                for kpi, value in originals:
+                    kpi.actual_value = value
+                self.reasoner.run_reasoning()
+
+        print("✅ Batch updates are validated and applied atomically")
+
+    def test_benchmark_suite_smoke(self):
+        """Test the synthetic hospital generator and benchmark regression check"""
+        print("\n⏱️ Testing benchmark suite...")
+
+        from owlready2 import World
+        from benchmarks.synthetic import SyntheticHospital
+        from benchmarks.run import run_benchmark, compare
+        from ontology.snapshot import get_snapshot_store
+
+        hospital = SyntheticHospital(departments=3, kpis=30, density=1.0, history=2, seed=7)
+        onto = hospital(World())
+        snapshot = get_snapshot_store(onto).get()
+        self.assertEqual(snapshot.size, 30)
+        self.assertEqual(len(set(snapshot.dept_names[snapshot.dept_codes])), 3)
+        self.assertGreater(len(snapshot.affects_indices), 0)
+
+        # History is anchored to history_end, not the current date, so runs stay comparable
+        from ontology.history import HistoryStore
+        hospital.history_store = HistoryStore()
+        hospital(World())
+        times, _ = hospital.history_store.range(str(snapshot.ids[0]))
+        self.assertEqual([str(t.astype('datetime64[M]')) for t in times], ['2023-11', '2023-12'])
+
+        results = run_benchmark(hospital, repeat=2)
+        self.assertIn('reasoning', results['metrics'])
+        self.assertIn('GET /api/kpis (cached)', results['metrics'])
+        self.assertLessEqual(results['metrics']['reasoning']['p50_ms'], results['metrics']['reasoning']['p99_ms'])
+
+        baseline = {results['scenario']: {'metrics': {
+            'reasoning': {'p50_ms': results['metrics']['reasoning']['p50_ms'] / 100 - 1},
+            'aggregation': {'p50_ms': 1e6},
+        }}}
+        slower = [name for name, _, _ in compare(results, baseline)]
+        self.assertNotIn('aggregation', slower)
+        self.assertIn('reasoning', slower)
+
+        print("✅ Benchmark suite runs and flags regressions")
+
+    def test_metrics_endpoint_and_profiler(self):
+        """Test /api/metrics exposes request and reasoning timings, and the sampling profiler"""
+        print("\n⏱️ Testing metrics and request profiling...")
+
+        import tempfile
+        from flask import Flask
+        from api.routes import init_api
+        from api.instrumentation import RequestProfiler
+        from services.metrics import REGISTRY
+
+        with tempfile.TemporaryDirectory() as directory:
+            app = Flask(__name__)
+            app.register_blueprint(init_api(self.ontology, profiler=RequestProfiler(1.0, directory)))
+            runs = REGISTRY.value('reasoning_runs_total', mode='full')
+            self.reasoner.run_reasoning()
+            self.assertEqual(REGISTRY.value('reasoning_runs_total', mode='full'), runs + 1)
+
+            with app.test_client() as client:
+                before = REGISTRY.value('http_requests_total', endpoint='/api/kpi/<kpi_id>', method='GET', status='200')
+                response = client.get('/api/kpi/ED_Wait_Time')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(
+                    REGISTRY.value('http_requests_total', endpoint='/api/kpi/<kpi_id>', method='GET', status='200'),
+                    before + 1)
+                self.assertTrue(os.path.exists(os.path.join(directory, response.headers['X-Profile'])))
+
+                text = client.get('/api/metrics').get_data(as_text=True)
+                self.assertIn('hospital_kpi_http_requests_total{endpoint="/api/kpi/<kpi_id>"', text)
+                self.assertIn('hospital_kpi_reasoning_phase_duration_seconds_count{phase="semantic_reasoning"}', text)
+                self.assertIn(f"hospital_kpi_kpis {len(self.kpis)}", text)
+
+        print("✅ Metrics and profiler working")
+
+    def test_app_factory_readiness_and_lazy_imports(self):
+        """Test create_app reports liveness and readiness separately and keeps heavy imports deferred"""
+        print("\n🚀 Testing app factory start-up...")
+
+        import subprocess
+
+        app = create_app(self.ontology, warmup='background')
+        state = app.extensions['hospital_kpi']
+        with app.test_client() as client:
+            self.assertEqual(client.get('/api/health').status_code, 200)
+            self.assertTrue(state.ready.wait(30), "Background warm-up never finished")
+            ready = client.get('/api/health/ready')
+            self.assertEqual(ready.status_code, 200)
+            self.assertEqual(ready.get_json()['warmup'], 'done')
+            self.assertTrue(client.get('/api/health').get_json()['ready'])
+            # The warm-up already produced the first reasoning result
+            self.assertEqual(client.get('/api/reasoning').get_json()['job']['status'], 'done')
+
+        with self.assertRaises(ValueError):
+            create_app(self.ontology, warmup='eventually')
+
+        # Preloaded by gunicorn, the background warm-up waits for post_fork
+        os.environ['KPI_WARMUP_AFTER_FORK'] = '1'
+        try:
+            state = create_app(self.ontology, warmup='background').extensions['hospital_kpi']
+        finally:
+            del os.environ['KPI_WARMUP_AFTER_FORK']
+        self.assertEqual(state.warmup, 'pending')
+        self.assertIsNotNone(state.deferred)
+        state.start_warmup(state.deferred)
+        self.assertTrue(state.ready.wait(30))
+
+        root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+        probe = ("import sys, app; app.create_app(warmup='off'); "
+                 "print(sorted(m for m in ('pandas', 'matplotlib', 'seaborn') if m in sys.modules))")
+        out = subprocess.run([sys.executable, '-c', probe], cwd=root, capture_output=True, text=True, check=True)
+        self.assertEqual(out.stdout.strip().splitlines()[-1], '[]')
+
+        print("✅ App factory and readiness working")
+
+    def test_multi_hospital_tenants(self):
+        """Test per-hospital ontologies load lazily, stay within budget and persist on eviction"""
+        print("\n🏥 Testing multi-hospital tenancy...")
+
+        import tempfile
+        from ontology.store import build_store
+
+        with tempfile.TemporaryDirectory() as directory:
+            for hospital in ('north', 'south'):
+                build_store(os.path.join(directory, f"{hospital}.sqlite3"), load_kpi_data)
+            app = create_app(self.ontology, warmup='off', tenants_dir=directory)
+            tenants = app.extensions['hospital_kpi'].tenants
+            self.assertEqual(tenants.loaded(), [])
+
+            with app.test_client() as client:
+                self.assertEqual(client.get('/api/hospitals').get_json()['hospitals'], ['north', 'south'])
+                self.assertEqual(client.get('/t/elsewhere/api/kpis').status_code, 404)
+                self.assertEqual(client.get('/t/../api/kpis').status_code, 404)
+
+                # Responses release their hospital once fully sent (buffered=True closes them here)
+                updated = client.post('/t/north/api/kpis/values', json=[{'id': 'ED_Wait_Time', 'actual_value': 1.0}],
+                                      buffered=True)
+                self.assertEqual(updated.status_code, 200)
+                self.assertEqual(tenants.loaded(), ['north'])
+                north = {k['id']: k for k in client.get('/t/north/api/kpis', buffered=True).get_json()}
+                self.assertEqual(north['ED_Wait_Time']['actual'], 1.0)
+
+                # Tenants are isolated from each other and from the default ontology
+                south = client.get('/api/kpis', headers={'X-Hospital-Tenant': 'south'}, buffered=True).get_json()
+                self.assertNotEqual({k['id']: k for k in south}['ED_Wait_Time']['actual'], 1.0)
+                self.assertNotEqual(self.ontology.search_one(iri="*ED_Wait_Time").actual_value, 1.0)
+                self.assertEqual(client.get('/t/south/api/health', buffered=True).get_json()['hospital'], 'south')
+
+                # Over budget, the least recently used hospital is written back and dropped
+                tenants.memory_budget = 1
+                client.get('/t/south/api/summary', buffered=True)
+                self.assertEqual(tenants.loaded(), ['south'])
+                self.assertEqual(tenants.evictions, 1)
+
+                north = {k['id']: k for k in client.get('/t/north/api/kpis', buffered=True).get_json()}
+                self.assertEqual(north['ED_Wait_Time']['actual'], 1.0, "Eviction must persist the update")
+                self.assertEqual(tenants.loaded(), ['north'])
+
+                # A live stream releases its hospital when it ends (SSE_MAX_DURATION)
+                tenants.evict('north')
+                app.config['SSE_MAX_DURATION'] = 0
+                client.get('/t/north/api/stream', buffered=True)
+                self.assertEqual(tenants._loaded['north'].refs, 0)
+                self.assertTrue(tenants.evict('north'))
+            tenants.close()
+            self.assertEqual(tenants.loaded(), [])
+
+            # The warm-up's alert levels alone are not written back
+            from ontology.tenants import TenantRegistry
+            path = os.path.join(directory, 'south.sqlite3')
+            stamp = os.stat(path).st_mtime_ns
+            warmed = TenantRegistry(directory, setup=lambda t: HospitalKPIReasoner(t.ontology).run_reasoning())
+            warmed.release(warmed.acquire('south'))
+            self.assertTrue(warmed.evict('south'))
+            self.assertEqual(os.stat(path).st_mtime_ns, stamp)
+
+            # Two workers update the same hospital: the later save doesn't overwrite the earlier one
+            first, second = TenantRegistry(directory), TenantRegistry(directory)
+            for registry, value in ((first, 2.0), (second, 3.0)):
+                tenant = registry.acquire('south')
+                tenant.ontology.search_one(iri="*ED_Wait_Time").actual_value = value
+                registry.release(tenant)
+            self.assertTrue(first.evict('south'))
+            self.assertTrue(second.evict('south'))
+            tenant = first.acquire('south')
+            self.assertEqual(tenant.ontology.search_one(iri="*ED_Wait_Time").actual_value, 2.0)
+            first.release(tenant)
+            first.close()
+
+        print("✅ Multi-hospital tenancy working")
+
+    def test_peer_benchmarks(self):
+        """Test percentile rank, z-score and peer median over comparable_to, updated incrementally"""
+        print("\n📏 Testing peer benchmarking...")
+
+        from owlready2 import World
+        from flask import Flask
+        from api.routes import init_api
+        from benchmarks.synthetic import SyntheticHospital
+        from ontology.snapshot import get_snapshot_store
+        from services.benchmarking import get_benchmarks, BenchmarkTable
+
+        onto = SyntheticHospital(departments=4, kpis=120, comparable=2.0, seed=3)(World())
+        app = Flask(__name__)
+        app.register_blueprint(init_api(onto))
+        with app.test_client() as client:
+            rows = client.get('/api/benchmarks').get_json()
+            self.assertGreater(len(rows), 0)
+            self.assertTrue(all(0 <= row['percentile_rank'] <= 100 for row in rows))
+
+            kpi_id = rows[0]['id']
+            detail = client.get(f'/api/kpi/{kpi_id}/benchmark').get_json()
+            values = [peer['actual'] for peer in detail['peers']]
+            self.assertEqual(values, sorted(values))
+            self.assertEqual(detail['benchmark']['peer_count'], len(values) - 1)
+            self.assertAlmostEqual(detail['benchmark']['peer_median'], float(np.median(values)))
+            mine = detail['actual']
+            # The percentile counts the peers doing worse: below for higher-is-better, above otherwise
+            lower = detail['polarity'] == 'lower_is_better'
+            worse = sum((v > mine) if lower else (v < mine) for v in values) + 0.5 * sum(v == mine for v in values)
+            self.assertAlmostEqual(detail['benchmark']['percentile_rank'], 100 * worse / len(values))
+            self.assertEqual(detail['benchmark']['z_score'] > 0,
+                             (mine < detail['benchmark']['peer_mean']) if lower else (mine > detail['benchmark']['peer_mean']))
+            self.assertEqual(client.get('/api/kpi/Nope/benchmark').status_code, 404)
+
+            # A value change re-ranks only its peer group and matches a full rebuild
+            table = get_benchmarks(onto)
+            onto[kpi_id].actual_value = max(values) + 1
+            updated = get_benchmarks(onto)
+            self.assertIsNot(updated, table)
+            self.assertIs(updated.groups, table.groups)
+            snapshot = get_snapshot_store(onto).get()
+            full = BenchmarkTable(table.groups, snapshot.actual, polarity=snapshot.polarity)
+            np.testing.assert_allclose(updated.percentile, full.percentile)
+            np.testing.assert_allclose(updated.median, full.median)
+            self.assertAlmostEqual(client.get(f'/api/kpi/{kpi_id}/benchmark').get_json()['benchmark']['percentile_rank'],
+                                   100 * (0.5 if lower else len(values) - 0.5) / len(values))
+
+            # Lower-is-better KPIs rank the lowest value best
+            i = int(np.flatnonzero((snapshot.polarity < 0) & (table.groups.group >= 0))[0])
+            peers = updated.peers(i)
+            best = peers[~np.isnan(snapshot.actual[peers])][0]
+            self.assertEqual(snapshot.polarity[best], -1)
+            self.assertGreater(updated.percentile[best], 50)
+            self.assertGreaterEqual(updated.z_score[best], 0)
+
+        print("✅ Peer benchmarking working")
+
+    def test_root_cause_analysis(self):
+        """Test upstream root-cause ranking, cycle detection and the root-cause endpoints"""
+        print("\n🔎 Testing root-cause analysis...")
+
+        from owlready2 import World
+        from flask import Flask
+        from api.routes import init_api
+        from ontology.models import create_hospital_kpi_ontology
+        from ontology.graph import get_dependency_graph
+
+        onto = create_hospital_kpi_ontology(World())
+        with onto:
+            def kpi(name, actual, weight=1.0):
+                return onto.KPI(name, actual_value=actual, target_value=100.0, weight=weight)
+            a, b, c = kpi('A', 50.0), kpi('B', 60.0), kpi('C', 80.0)
+            d, e = kpi('D', 90.0, weight=3.0), kpi('E', 100.0)
+            a.affects = [b]
+            b.affects = [c]
+            c.affects = [a]
+            d.affects = [c]
+            e.affects = [c]
+
+        app = Flask(__name__)
+        app.register_blueprint(init_api(onto))
+        with app.test_client() as client:
+            detail = client.get('/api/kpi/C/root-causes').get_json()
+            # B: 1 x 0.4; D: 3 x 0.1; A: 1 x 0.5, halved for the extra hop; E is on target
+            self.assertEqual([cause['id'] for cause in detail['causes']], ['B', 'D', 'A'])
+            self.assertEqual([cause['hops'] for cause in detail['causes']], [1, 1, 2])
+            self.assertEqual({cause['id']: cause['root'] for cause in detail['causes']},
+                             {'B': False, 'D': True, 'A': False})
+            self.assertEqual(sorted(detail['cycle']), ['A', 'B', 'C'])
+            self.assertEqual(len(client.get('/api/kpi/C/root-causes?limit=1').get_json()['causes']), 1)
+            self.assertEqual(client.get('/api/kpi/C/root-causes?limit=0').status_code, 400)
+            self.assertEqual(client.get('/api/kpi/Nope/root-causes').status_code, 404)
+
+            report = client.get('/api/root-causes').get_json()
+            # D is critical too, but has nothing upstream
+            self.assertEqual([kpi['id'] for kpi in report['kpis']], ['A', 'B', 'C'])
+            self.assertEqual([sorted(cycle) for cycle in report['cycles']], [['A', 'B', 'C']])
+
+            # The reasoner recommends investigating the top cause of each critical KPI
+            results = HospitalKPIReasoner(onto).run_reasoning()
+            investigate = [rec for rec in results['recommendations'] if 'kpi' in rec]
+            self.assertTrue(investigate)
+            self.assertTrue({rec['kpi'] for rec in investigate} <= {'A', 'B', 'C'})
+
+            # Upstream reachability is memoized on the graph, which outlives value changes
+            graph = get_dependency_graph(onto)
+            b.actual_value = 100.0
+            self.assertIs(get_dependency_graph(onto), graph)
+            self.assertEqual([cause['id'] for cause in client.get('/api/kpi/C/root-causes').get_json()['causes']],
+                             ['D', 'A'])
+
+        print("✅ Root-cause analysis working")
+
+    def test_weighted_scorecards(self):
+        """Test direction-aware normalization and weighted composite scorecards"""
+        print("\n🏆 Testing weighted scorecards...")
+
+        from ontology.thresholds import infer_polarity, evaluate, HIGHER_IS_BETTER, LOWER_IS_BETTER, ALERT_CRITICAL
+        from ontology.snapshot import get_snapshot_store
+        from services.scorecard import normalize, get_scorecards
+
+        nan = np.nan
+        target = np.array([30.0, 5.0, 10.0, 10.0, 10.0, nan])
+        warning = np.array([35.0, 3.0, nan, nan, nan, nan])
+        critical = np.array([45.0, 1.0, nan, nan, nan, nan])
+        actual = np.array([32.5, 4.2, 8.0, 9.75, 12.0, 1.0])
+        polarity = infer_polarity(target, warning, critical)
+        self.assertEqual(polarity[:2].tolist(), [LOWER_IS_BETTER, HIGHER_IS_BETTER])
+        scores = normalize(actual, target, warning, critical, polarity)
+        # Banded between the critical bound (0) and target (1), the 95% fallback without
+        # thresholds; NaN without a target
+        np.testing.assert_allclose(scores[:5], [12.5 / 15, 0.8, 0.0, 0.5, 1.0])
+        self.assertTrue(np.isnan(scores[5]))
+        # Scorecards and alert levels use the same bounds: a critical KPI scores 0
+        codes = evaluate(actual, target, warning, critical, polarity)
+        self.assertEqual(codes[2], ALERT_CRITICAL)
+        self.assertTrue(np.all(scores[codes == ALERT_CRITICAL] == 0))
+
+        with self.app.test_client() as client:
+            cards = client.get('/api/scorecards').get_json()
+            self.assertEqual(set(cards), {'hospital', 'department', 'category'})
+            snapshot_rows = client.get('/api/kpis?fields=id,department,weight').get_json()
+            self.assertEqual(cards['hospital']['kpis'], len(snapshot_rows))
+            self.assertEqual(cards['hospital']['weight'],
+                             round(sum(row['weight'] or 1.0 for row in snapshot_rows), 3))
+            for card in cards['department'].values():
+                self.assertTrue(0 <= card['score'] <= 100)
+            self.assertEqual(client.get('/api/scorecards?level=department').get_json(), cards['department'])
+            self.assertEqual(client.get('/api/scorecards?level=ward').status_code, 400)
+            self.assertEqual(client.get('/api/summary').get_json()['composite_score'], cards['hospital']['score'])
+        snapshot = get_snapshot_store(self.ontology).get()
+        self.assertIs(get_scorecards(self.ontology, snapshot), get_scorecards(self.ontology))
+
+        print("✅ Weighted scorecards working")
+
+    def test_threshold_evaluator_shared(self):
+        """Every layer classifies KPIs with the one direction-aware threshold model"""
+        print("\n🧭 Testing shared threshold evaluator...")
+        from ontology.thresholds import (evaluate, infer_polarity, parse_polarity, HIGHER_IS_BETTER,
+                                         LOWER_IS_BETTER, ALERT_NORMAL, ALERT_WARNING, ALERT_CRITICAL,
+                                         ALERT_UNKNOWN)
+        from ontology.snapshot import get_snapshot_store
+        nan = np.nan
+        self.assertEqual(parse_polarity('Lower-is-better'), LOWER_IS_BETTER)
+        self.assertEqual(parse_polarity(None), 0)
+
+        # Higher is better: strictly below warning/critical; exactly on a bound is not beyond it
+        target = np.array([10.0, 10.0, 10.0, 10.0, 30.0, 30.0, 30.0, nan, 10.0])
+        warning = np.array([8.0, 8.0, 8.0, nan, 35.0, 35.0, 35.0, nan, 8.0])
+        critical = np.array([6.0, 6.0, 6.0, nan, 45.0, 45.0, 45.0, nan, 6.0])
+        actual = np.array([8.0, 7.0, 5.9, 9.6, 35.0, 40.0, 45.5, 1.0, nan])
+        polarity = infer_polarity(target, warning, critical)
+        self.assertEqual(polarity.tolist(), [HIGHER_IS_BETTER] * 4 + [LOWER_IS_BETTER] * 3 + [HIGHER_IS_BETTER] * 2)
+        self.assertEqual(evaluate(actual, target, warning, critical, polarity).tolist(),
+                         [ALERT_NORMAL, ALERT_WARNING, ALERT_CRITICAL, ALERT_WARNING,
+                          ALERT_NORMAL, ALERT_WARNING, ALERT_CRITICAL, ALERT_UNKNOWN, ALERT_UNKNOWN])
+        # Target only: the old 100% / 95% cutoffs
+        only = np.array([nan, nan, nan])
+        self.assertEqual(evaluate(np.array([10.0, 9.6, 9.4]), np.full(3, 10.0), only, only,
+                                  np.full(3, HIGHER_IS_BETTER)).tolist(),
+                         [ALERT_NORMAL, ALERT_WARNING, ALERT_CRITICAL])
+
+        snapshot = get_snapshot_store(self.ontology).get()
+        margin, wait = snapshot.index['Hospital_Operating_Margin'], snapshot.index['ED_Wait_Time']
+        self.assertEqual(snapshot.polarity[margin], HIGHER_IS_BETTER)
+        self.assertEqual(snapshot.polarity[wait], LOWER_IS_BETTER)
+
+        # Reasoner, analytics and API agree on every KPI
+        self.reasoner.run_reasoning()
+        with self.app.test_client() as client:
+            api = {k['id']: k['status'] for k in client.get('/api/kpis').get_json()}
+            summary = client.get('/api/summary').get_json()
+        labels = {'Normal': 'good', 'Warning': 'warning', 'Critical': 'critical'}
+        dashboard = self.analytics.get_dashboard_data()
+        analytics = dict(zip(dashboard['id'], dashboard['status']))
+        for kpi in self.kpis:
+            status = api[kpi.name]
+            self.assertEqual(analytics[kpi.name], status, kpi.name)
+            self.assertEqual(labels[kpi.has_alert_level[0].is_a[0].name], status, kpi.name)
+
+        # A wait time above target misses it; an operating margin above target does not
+        below = [kpi for kpi in self.kpis
+                 if (kpi.actual_value > kpi.target_value) == (kpi.polarity == 'lower_is_better')
+                 and kpi.actual_value != kpi.target_value]
+        self.assertEqual(summary['below_target'], len(below))
+        # Statuses allow a shortfall up to the warning threshold, so they can count fewer misses
+        counts = summary['status_counts']
+        self.assertEqual(counts, {status: list(api.values()).count(status) for status in ('good', 'warning', 'critical')})
+        self.assertEqual(sum(counts.values()), summary['total_kpis'])
+        self.assertGreaterEqual(summary['below_target'], counts['warning'] + counts['critical'])
+        margin = self.ontology.search_one(iri="*Hospital_Operating_Margin")
+        original = margin.actual_value
+        try:
+            margin.actual_value = margin.target_value + 1
+            with self.app.test_client() as client:
+                self.assertEqual(client.get('/api/summary').get_json()['below_target'], len(below) - 1)
+        finally:
+            margin.actual_value = original
+
+        print("✅ Threshold evaluator shared across layers")
+
+    def test_stale_run_does_not_overwrite_levels(self):
+        """Test a run whose snapshot went stale skips levels the current values no longer give"""
+        print("\n⏱️ Testing stale alert level write-back...")
+
+        from services.reasoning_engine import _Run
+
+        self.reasoner.run_reasoning()
+        ed_wait = self.ontology.search_one(iri="*ED_Wait_Time")
+        original_wait = ed_wait.actual_value
+        level = ed_wait.has_alert_level[0]
+        try:
+            ed_wait.actual_value = ed_wait.critical_threshold * 2
+            run = _Run(self.reasoner.snapshots.get(), self.reasoner.snapshots.version())
+            # An update puts the value back before the run writes its levels
+            ed_wait.actual_value = original_wait
+            self.reasoner._semantic_reasoning(run)
+            self.assertIs(ed_wait.has_alert_level[0], level)
+            self.assertNotIsInstance(ed_wait.has_alert_level[0], self.ontology.Critical)
+        finally:
+            ed_wait.actual_value = original_wait
+            self.reasoner.run_reasoning()
+
+        print("✅ Stale runs leave newer alert levels alone")
+
+    def test_shared_snapshot_updates_reach_other_workers(self):
+        """Test value updates in one worker are published to the others, which sync before writing"""
+        print("\n🔀 Testing shared-snapshot value updates...")
+
+        from owlready2 import World
+        from ontology.data import load_kpi_data
+        from ontology.snapshot import KPISnapshot, set_snapshot_store
+        from ontology.shared import SnapshotPublisher, SharedSnapshotStore
+        from services.updates import KPIValueUpdater
+
+        prefix = f"hkpi-writes-{os.getpid()}"
+        # Two workers, each with its own ontology as after a fork
+        workers = []
+        for _ in range(2):
+            onto = load_kpi_data(World())
+            store = SharedSnapshotStore(onto, prefix)
+            set_snapshot_store(onto, store)
+            workers.append((onto, store, KPIValueUpdater(onto, HospitalKPIReasoner(onto))))
+        (onto_a, store_a, updater_a), (onto_b, store_b, updater_b) = workers
+
+        publisher = SnapshotPublisher(prefix)
+        try:
+            publisher.publish(KPISnapshot(onto_a))
+            updater_a.apply([{'id': 'ED_Wait_Time', 'actual_value': 90.0}])
+            self.assertEqual(publisher.current(), 2)
+
+            snap_b = store_b.get()
+            self.assertEqual(snap_b.actual[snap_b.index.get('ED_Wait_Time')], 90.0)
+            self.assertEqual(snap_b.status_codes[snap_b.index.get('ED_Wait_Time')], 2)
+            # Taking up the generation copied the value and alert level into B's ontology
+            ed_wait_b = onto_b.search_one(iri="*ED_Wait_Time")
+            self.assertEqual(ed_wait_b.actual_value, 90.0)
+            self.assertIsInstance(ed_wait_b.has_alert_level[0], onto_b.Critical)
+
+            # B's update is published on top of A's, and A catches up before serving it
+            updater_b.apply([{'id': 'ED_LWBS', 'actual_value': 9.0}])
+            snap_a = store_a.get()
+            self.assertEqual(publisher.current(), 3)
+            self.assertEqual(snap_a.actual[snap_a.index.get('ED_LWBS')], 9.0)
+            self.assertEqual(snap_a.actual[snap_a.index.get('ED_Wait_Time')], 90.0)
+            self.assertEqual(onto_a.search_one(iri="*ED_LWBS").actual_value, 9.0)
+
+            # Syncing a new generation into A's ontology waits for A's writers
+            import threading
+            updater_b.apply([{'id': 'ED_LWBS', 'actual_value': 8.0}])
+            reader = threading.Thread(target=store_a.get)
+            with store_a.write_lock:
+                reader.start()
+                reader.join(0.2)
+                self.assertTrue(reader.is_alive(), "A sync must not write while a writer holds the lock")
+                self.assertEqual(onto_a.search_one(iri="*ED_LWBS").actual_value, 9.0)
+            reader.join(5)
+            self.assertEqual(onto_a.search_one(iri="*ED_LWBS").actual_value, 8.0)
+        finally:
+            publisher.close()
+            for onto, _, _ in workers:
+                onto.world.close()
+
+        print("✅ Updates published across workers")
+
+    def test_evicted_tenant_is_collected(self):
+        """Test an evicted hospital's ontology is freed along with its snapshots and benchmarks"""
+        print("\n♻️ Testing evicted hospitals are released...")
+
+        import gc
+        import tempfile
+        import weakref
+        from ontology.store import build_store
+
+        with tempfile.TemporaryDirectory() as directory:
+            build_store(os.path.join(directory, 'north.sqlite3'), load_kpi_data)
+            app = create_app(self.ontology, warmup='off', tenants_dir=directory)
+            tenants = app.extensions['hospital_kpi'].tenants
+            with app.test_client() as client:
+                for path in ('kpis', 'summary', 'benchmarks', 'root-causes', 'kpi/ED_Wait_Time', 'reasoning'):
+                    self.assertEqual(client.get(f'/t/north/api/{path}', buffered=True).status_code, 200)
+            ontology = weakref.ref(tenants._loaded['north'].ontology)
+            self.assertTrue(tenants.evict('north'))
+            gc.collect()
+            self.assertIsNone(ontology(), "Eviction must let the hospital's ontology be collected")
+            tenants.close()
+
+        print("✅ Evicted hospitals released")
+
+    def test_value_updates_patch_snapshot(self):
+        """Test value-only updates patch the current snapshot instead of rebuilding it"""
+        print("\n🩹 Testing in-place snapshot patches...")
+
+        from ontology.history import HistoryStore
+        from ontology.snapshot import KPISnapshot, get_snapshot_store
+        from services.updates import KPIValueUpdater
+
+        onto = load_kpi_data(World())
+        reasoner = HospitalKPIReasoner(onto)
+        reasoner.run_reasoning()
+        store = get_snapshot_store(onto)
+        before = store.get()
+
+        history = HistoryStore()
+        updater = KPIValueUpdater(onto, reasoner, history)
+        updater.apply([{'id': 'ED_Wait_Time', 'actual_value': 20.0, 'period': '2024-01-31'}])
+        updater.apply([{'id': 'ED_Wait_Time', 'actual_value': 400.0, 'period': '2024-02-29'},
+                       {'id': 'ED_LWBS', 'actual_value': 0.5}])
+        patched = store.get()
+        self.assertIsNot(patched, before)
+        self.assertIs(patched.ids, before.ids, "Value-only writes must not rebuild the snapshot")
+        self.assertEqual(patched.layout, before.layout)
+
+        rebuilt = KPISnapshot(onto)
+        self.assertEqual(patched.version, rebuilt.version)
+        for field in ('actual', 'status_codes', 'alert_codes', 'trends'):
+            np.testing.assert_array_equal(getattr(patched, field), getattr(rebuilt, field), err_msg=field)
+        self.assertNotEqual(before.actual[before.index['ED_LWBS']], 0.5, "Earlier snapshots stay unchanged")
+
+        # A structural change still rebuilds from the ontology
+        with onto:
+            onto.KPI('New_KPI')
+        self.assertIn('New_KPI', store.get().index)
+
+        print("✅ Value-only updates patch the snapshot")
+
+    def test_history_shared_between_workers(self):
+        """Test workers sharing a history directory see each other's appends without losing any"""
+        print("\n🗂️ Testing history shared between workers...")
+
+        import multiprocessing
+        import tempfile
+        from flask import Flask
+        from api.routes import init_api
+        from ontology.history import HistoryStore
+
+        DAYS = 300
+
+        def worker(directory, offset, start):
+            history = HistoryStore(directory)
+            history.series('ED_Wait_Time')  # cached before the others write
+            start.wait(10)
+            for day in range(offset, DAYS, 3):  # interleaved days: out-of-order inserts rewrite the file
+                history.append('ED_Wait_Time', np.datetime64('2024-01-01') + np.timedelta64(day, 'D'), day)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            history = HistoryStore(tmp)
+            history.append('ED_Wait_Time', '2023-12-31', -1.0)
+            self.assertEqual(len(history.range('ED_Wait_Time')[1]), 1)
+
+            context = multiprocessing.get_context('fork')
+            start = context.Barrier(3)
+            workers = [context.Process(target=worker, args=(tmp, offset, start)) for offset in (2, 1, 0)]
+            for process in workers:
+                process.start()
+            for process in workers:
+                process.join(30)
+                self.assertEqual(process.exitcode, 0)
+
+            # This process's cached series picks up the other workers' writes
+            times, values = history.range('ED_Wait_Time')
+            self.assertEqual(list(values), [-1.0] + [float(day) for day in range(DAYS)])
+            self.assertTrue(np.all(np.diff(times.astype(np.int64)) > 0))
+
+        # A period that is not an ISO date string is a client error
+        app = Flask(__name__)
+        app.register_blueprint(init_api(load_kpi_data(World()), HistoryStore()))
+        with app.test_client() as client:
+            for period in (20240131, 'someday', '', ['2024-01-31']):
+                response = client.post('/api/kpis/values', json=[
+                    {'id': 'ED_Wait_Time', 'actual_value': 1.0, 'period': period}])
+                self.assertEqual(response.status_code, 400, period)
+                self.assertIn('period', response.get_json()['errors'][0]['error'])
+
+        print("✅ History is shared between workers")
+
+    def test_sse_settings_from_environment(self):
+        """SSE_* environment variables configure the live stream like KPI_WARMUP"""
+        print("\n📡 Testing SSE settings from the environment...")
+        from app import create_app
+
+        os.environ.update({'SSE_MAX_STREAMS': '7', 'SSE_HEARTBEAT': '2.5', 'SSE_RETRY_MS': '500'})
+        try:
+            app = create_app(self.ontology, warmup='off')
+            os.environ['SSE_MAX_STREAMS'] = 'many'
+            with self.assertRaises(ValueError):
+                create_app(self.ontology, warmup='off')
+        finally:
+            for name in ('SSE_MAX_STREAMS', 'SSE_HEARTBEAT', 'SSE_RETRY_MS'):
+                del os.environ[name]
+        self.assertEqual(app.config['SSE_MAX_STREAMS'], 7)
+        self.assertEqual(app.config['SSE_HEARTBEAT'], 2.5)
+        self.assertEqual(app.config['SSE_RETRY_MS'], 500)
+        # Unset ones keep the defaults from api/routes.py
+        self.assertNotIn('SSE_MAX_DURATION', app.config)
+
+        print("✅ SSE settings read from the environment")
+
+    def test_benchmarks_on_demo_data(self):
+        """Test /api/benchmarks on the default deployment's seeded comparable_to edges"""
+        print("\n📏 Testing benchmarks on the demo data...")
+
+        from owlready2 import World
+
+        app = create_app(load_kpi_data(World()), warmup='off')
+        with app.test_client() as client:
+            rows = {row['id']: row for row in client.get('/api/benchmarks').get_json()}
+            self.assertEqual(set(rows), {'ED_Mortality_Rate', 'ICU_CLABSI_Rate', 'Surgery_SSI_Rate'})
+            self.assertEqual(len({row['peer_group'] for row in rows.values()}), 1)
+            self.assertTrue(all(row['peer_count'] == 2 for row in rows.values()))
+            # All lower-is-better, so the lowest rate ranks best
+            ranked = sorted(rows, key=lambda kpi_id: rows[kpi_id]['percentile_rank'], reverse=True)
+            self.assertEqual(ranked, sorted(rows, key=lambda kpi_id: rows[kpi_id]['actual']))
+            self.assertGreater(rows['ICU_CLABSI_Rate']['z_score'], 0)
+
+            surgery = client.get('/api/benchmarks?department=Surgery Department').get_json()
+            self.assertEqual([row['id'] for row in surgery], ['Surgery_SSI_Rate'])
+            detail = client.get('/api/kpi/ED_Mortality_Rate/benchmark').get_json()
+            self.assertEqual([peer['id'] for peer in detail['peers']],
+                             ['ICU_CLABSI_Rate', 'ED_Mortality_Rate', 'Surgery_SSI_Rate'])
+            self.assertEqual(client.get('/api/kpi/ED_Wait_Time/benchmark').get_json()['peers'], [])
+
+        print("✅ Demo KPIs benchmark against their Safety peers")
+
 if __name__ == '__main__':
     # Run tests with verbose output
     unittest.main(verbosity=2)